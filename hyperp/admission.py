@@ -0,0 +1,275 @@
+import time
+import inspect
+import threading
+from functools import wraps
+from collections import deque
+from contextlib import contextmanager
+
+from bottle import request, response, HTTPResponse
+
+from .bottle import _check, _around
+from .utils import dumps
+
+
+class Limiter:
+    """
+    Lets `limit` callers in at a time, `queue` more wait up to `timeout`
+    seconds for a slot and the rest are turned away.
+
+    With `adaptive` the limit follows AIMD: it grows by 1/limit per
+    request answered under `target_ms` and shrinks by `backoff` when one
+    is slower or fails, at most once per request duration, within
+    `min_limit` and `max_limit`.
+    """
+    def __init__(self, limit, queue=0, timeout=1.0, adaptive=False, target_ms=500,
+                 min_limit=1, max_limit=None, backoff=0.9):
+        self.limit = float(limit)
+        self.queue = queue
+        self.timeout = timeout
+        self.adaptive = adaptive
+        self.target_ms = target_ms
+        self.min_limit = min_limit
+        self.max_limit = max_limit or limit * 4
+        self.backoff = backoff
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.accepted = 0
+        self.rejected = 0
+        self._decreased = 0.0
+        self._cond = threading.Condition()
+        # Futures of the requests waiting on an event loop, see acquire_async
+        self._waiters = deque()
+
+    def _enter(self):
+        # With the lock held, None when the caller may queue
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            self.accepted += 1
+            return True
+
+        if self.waiting >= self.queue:
+            self.rejected += 1
+            return False
+
+        return None
+
+    def acquire(self):
+        with self._cond:
+            entered = self._enter()
+            if entered is not None:
+                return entered
+
+            self.waiting += 1
+            deadline = time.monotonic() + self.timeout
+            try:
+                while self.in_flight >= int(self.limit):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+
+            self.in_flight += 1
+            self.accepted += 1
+            return True
+
+    async def acquire_async(self):
+        """acquire() for an event loop, a queued request waits without blocking it"""
+        import asyncio
+
+        with self._cond:
+            entered = self._enter()
+            if entered is not None:
+                return entered
+            self.waiting += 1
+
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + self.timeout
+        try:
+            while True:
+                waiter = (loop, loop.create_future())
+                with self._cond:
+                    if self.in_flight < int(self.limit):
+                        self.in_flight += 1
+                        self.accepted += 1
+                        return True
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        return False
+                    self._waiters.append(waiter)
+
+                try:
+                    await asyncio.wait_for(waiter[1], remaining)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    with self._cond:
+                        if waiter in self._waiters:
+                            self._waiters.remove(waiter)
+        finally:
+            with self._cond:
+                self.waiting -= 1
+
+    def release(self, seconds=None, failed=False):
+        with self._cond:
+            self.in_flight -= 1
+            if self.adaptive and seconds is not None:
+                self._adjust(seconds, failed)
+            self._cond.notify()
+            # They check again for the slot, a thread may have taken it
+            while self._waiters:
+                loop, future = self._waiters.popleft()
+                loop.call_soon_threadsafe(_wake, future)
+
+    def _adjust(self, seconds, failed):
+        now = time.monotonic()
+        if failed or seconds * 1000 > self.target_ms:
+            # Requests started before the last decrease still report the old load
+            if now - self._decreased >= seconds:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._decreased = now
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def stats(self):
+        return dict(
+            limit=int(self.limit),
+            in_flight=self.in_flight,
+            waiting=self.waiting,
+            accepted=self.accepted,
+            rejected=self.rejected,
+        )
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionPlugin:
+    """
+    Bottle plugin shedding load before the worker threads are all stuck
+    behind one slow dependency. Every route passes the global limiter,
+    routes declared with `concurrency=n`, or all routes when `route_limit`
+    is set, pass their own limiter first, one per path whatever the
+    method. A request that gets no slot is answered 503 with Retry-After.
+    Async handlers under hyperp.asgi wait for their slot on the event loop.
+    """
+    name = "hyperp_admission"
+    api = 2
+
+    def __init__(self, limit=64, route_limit=None, queue=64, timeout=1.0, retry_after=1,
+                 adaptive=False, target_ms=500):
+        self.options = dict(queue=queue, timeout=timeout, adaptive=adaptive, target_ms=target_ms)
+        self.route_limit = route_limit
+        self.retry_after = retry_after
+        self.limiter = Limiter(limit, **self.options)
+        self.routes = {}
+        # Routes are applied on their first request, maybe on several threads at once
+        self._lock = threading.Lock()
+
+    def apply(self, callback, route):
+        limit = route.config.get("concurrency") or self.route_limit
+        limiters = [self.limiter]
+        if limit:
+            # Shared by the methods of a path, an rpc with allow_get is one route
+            with self._lock:
+                if route.rule not in self.routes:
+                    self.routes[route.rule] = Limiter(limit, **self.options)
+                limiters.insert(0, self.routes[route.rule])
+
+        @wraps(callback)
+        def wrapper(*args, **kwargs):
+            if request.environ.get("hyperp.asgi"):
+                # An async handler on the event loop, waits there for a slot
+                return self._admit_async(limiters, callback, args, kwargs)
+
+            acquired = []
+            for limiter in limiters:
+                if not limiter.acquire():
+                    self._reject(acquired)
+                acquired.append(limiter)
+
+            return _around(self._admitted(acquired), lambda: callback(*args, **kwargs))
+
+        return wrapper
+
+    async def _admit_async(self, limiters, callback, args, kwargs):
+        acquired = []
+        for limiter in limiters:
+            if not await limiter.acquire_async():
+                self._reject(acquired)
+            acquired.append(limiter)
+
+        with self._admitted(acquired):
+            result = callback(*args, **kwargs)
+            if inspect.iscoroutine(result):
+                result = await result
+            return result
+
+    def _reject(self, acquired):
+        for held in acquired:
+            held.release()
+        raise self._overloaded()
+
+    @contextmanager
+    def _admitted(self, acquired):
+        start = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = response.status_code >= 500
+        except HTTPResponse as e:
+            failed = e.status_code >= 500
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            for limiter in acquired:
+                limiter.release(seconds, failed)
+
+    def _overloaded(self):
+        return HTTPResponse(
+            status=503,
+            headers={"Content-Type": "application/json", "Retry-After": str(self.retry_after)},
+            body=dumps(dict(msg="Overloaded, try again later")),
+        )
+
+    def stats(self):
+        return dict(
+            total=self.limiter.stats(),
+            routes={name: limiter.stats() for name, limiter in list(self.routes.items())},
+        )
+
+
+def install_admission(app, limit=64, route_limit=None, queue=64, timeout=1.0, retry_after=1,
+                      adaptive=False, target_ms=500, path="/_admission", checker=None):
+    """
+    Installs the AdmissionPlugin on `app` and a route at `path` with the
+    limits and in-flight counts as JSON for monitoring, guarded by the
+    required `checker` like `rpc` and `get` do. Keep `limit` below the
+    number of worker threads so some are always free for the healthy routes.
+    """
+    if checker is None:
+        raise ValueError("install_admission needs a checker for its route")
+
+    plugin = AdmissionPlugin(
+        limit, route_limit=route_limit, queue=queue, timeout=timeout,
+        retry_after=retry_after, adaptive=adaptive, target_ms=target_ms,
+    )
+    app.install(plugin)
+
+    @app.get(path, skip=[plugin])
+    def admission_view():
+        checked = _check(checker, None)
+        if checked:
+            raise HTTPResponse(status=401, body=dumps(dict(msg=checked)), headers={"Content-Type": "application/json"})
+
+        response.content_type = "application/json"
+        return dumps(plugin.stats())
+
+    return plugin
@@ -0,0 +1,301 @@
+import sys
+import asyncio
+import inspect
+import tempfile
+from traceback import format_exc
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+
+import bottle
+from bottle import request, response, HTTPResponse, HTTPError
+
+from .utils import dumps
+from .context import ContextLocal
+
+
+def _context_property(name):
+    var = ContextVar(f"bottle.{name}")
+
+    def fget(_):
+        try:
+            return var.get()
+        except LookupError:
+            raise RuntimeError("Request context not initialized.") from None
+
+    def fset(_, value):
+        var.set(value)
+
+    def fdel(_):
+        var.set(None)
+
+    return property(fget, fset, fdel, "Thread and task local property")
+
+
+def _bind_per_task():
+    # bottle's request and response are thread locals, the requests
+    # awaited together on the event loop need their own too
+    if getattr(bottle.LocalRequest, "_hyperp_per_task", False):
+        return
+
+    bottle.LocalRequest.environ = _context_property("request.environ")
+    for name in ("_status_line", "_status_code", "_cookies", "_headers", "body"):
+        setattr(bottle.LocalResponse, name, _context_property(f"response.{name}"))
+    bottle.LocalRequest._hyperp_per_task = True
+
+
+class _Body:
+    """wsgi.input for a worker thread, reads the ASGI body as it arrives"""
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = b""
+        self._more = True
+
+    def _fill(self):
+        message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+        if message["type"] == "http.disconnect":
+            self._more = False
+            return
+        self._buffer += message.get("body", b"")
+        self._more = message.get("more_body", False)
+
+    def read(self, size=-1):
+        while self._more and (size is None or size < 0 or len(self._buffer) < size):
+            self._fill()
+
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        while self._more and b"\n" not in self._buffer and (size < 0 or len(self._buffer) < size):
+            self._fill()
+
+        end = self._buffer.find(b"\n") + 1 or len(self._buffer)
+        if size >= 0:
+            end = min(end, size)
+        data, self._buffer = self._buffer[:end], self._buffer[end:]
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+
+async def _spool(receive):
+    # Read without a thread, kept in memory up to bottle's MEMFILE_MAX
+    body = tempfile.SpooledTemporaryFile(max_size=bottle.BaseRequest.MEMFILE_MAX)
+    more = True
+    while more:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body.write(message.get("body", b""))
+        more = message.get("more_body", False)
+
+    size = body.tell()
+    body.seek(0)
+    return body, size
+
+
+def _environ(scope):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("127.0.0.1", 0)
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        # WSGI wants the raw path as latin1, bottle decodes it again
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+
+        if name in ("CONTENT_LENGTH", "CONTENT_TYPE"):
+            environ[name] = value
+            continue
+
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    return environ
+
+
+class ASGI:
+    """
+    Serves a bottle app, and the `rpc` and `get` routes on it, over ASGI
+    so it can be run by uvicorn:
+
+        from hyperp.asgi import ASGI
+        application = ASGI(bottle.default_app())
+
+    Sync routes run in a thread pool of `workers` threads exactly like
+    under WSGI, their body is read as the handler asks for it.
+
+    `async def` handlers, with the hooks and plugins of their route, run
+    on the event loop and hold no thread while awaiting. bottle's `request`
+    and `response` are bound per request there too, but the checker,
+    the hooks and the plugins run on the loop, so keep them quick, e.g.
+    a TokenCache in front of the principal lookup. hyperp's plugins wrap
+    the awaited handler, others only the call that returns the coroutine.
+    Unhandled errors are answered 500 and passed to `on_error`.
+    """
+    def __init__(self, app=None, workers=32, on_error=None):
+        self.app = app or bottle.default_app()
+        self.workers = workers
+        self.on_error = on_error
+        self._pool = None
+        _bind_per_task()
+
+    @property
+    def pool(self):
+        # Created lazily so the pool is not shared across forked workers
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+
+        if scope["type"] != "http":
+            return
+
+        environ = _environ(scope)
+        loop = asyncio.get_running_loop()
+
+        try:
+            route, args = self.app.router.match(dict(environ, PATH_INFO=scope["path"]))
+        except HTTPError:
+            route, args = None, {}
+
+        if route is not None and getattr(route.callback, "_hyperp_async", False):
+            environ["wsgi.input"], size = await _spool(receive)
+            environ["CONTENT_LENGTH"] = str(size)
+            status, headers, data = await self._handle(environ, route, args)
+        else:
+            if "CONTENT_LENGTH" in environ:
+                environ["wsgi.input"] = _Body(receive, loop)
+            else:
+                # Without a length bottle would not read the body
+                environ["wsgi.input"], size = await _spool(receive)
+                environ["CONTENT_LENGTH"] = str(size)
+            status, headers, data = await loop.run_in_executor(self.pool, self._wsgi, environ)
+
+        headers = [(k, v) for k, v in headers if k.lower() != "content-length"]
+        headers.append(("Content-Length", str(len(data))))
+
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(k.encode("latin1"), v.encode("latin1")) for k, v in headers],
+        })
+        await send({"type": "http.response.body", "body": data})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._pool is not None:
+                    self._pool.shutdown(wait=False)
+                    self._pool = None
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _wsgi(self, environ):
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split()[0])
+            started["headers"] = list(headers)
+
+        body = self.app(environ, start_response)
+        try:
+            data = b"".join(body)
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+
+        return started["status"], started["headers"], data
+
+    async def _handle(self, environ, route, args):
+        # bottle's Bottle._handle, with the handler awaited in between
+        ContextLocal._reset()
+        path = environ["bottle.raw_path"] = environ["PATH_INFO"]
+        environ["PATH_INFO"] = path.encode("latin1").decode("utf8", "ignore")
+        environ.update({
+            "bottle.app": self.app,
+            "route.handle": route,
+            "bottle.route": route,
+            "route.url_args": args,
+            "hyperp.asgi": True,
+        })
+        request.bind(environ)
+        response.bind()
+
+        out = None
+        try:
+            try:
+                self.app.trigger_hook("before_request")
+                out = route.call(**args)
+                while inspect.isawaitable(out):
+                    out = await out
+            except HTTPResponse as e:
+                out = e
+            finally:
+                if isinstance(out, HTTPResponse):
+                    out.apply(response)
+                try:
+                    self.app.trigger_hook("after_request")
+                except HTTPResponse as e:
+                    out = e
+                    out.apply(response)
+        except Exception as e:
+            out = self._error(e)
+
+        return self._cast(out)
+
+    def _cast(self, out):
+        if isinstance(out, HTTPResponse) and isinstance(out.body, (dict, list)):
+            out.body = dumps(out.body)
+            out.content_type = "application/json"
+        elif isinstance(out, (dict, list)):
+            response.content_type = "application/json"
+            out = dumps(out)
+
+        try:
+            body = self.app._cast(out)
+            data = b"".join(body)
+            if hasattr(body, "close"):
+                body.close()
+        except Exception as e:
+            data = b"".join(self.app._cast(self._error(e)))
+
+        if response.status_code in (100, 101, 204, 304) or request.method == "HEAD":
+            data = b""
+
+        return response.status_code, list(response.headerlist), data
+
+    def _error(self, e):
+        stacktrace = format_exc()
+        if self.on_error and callable(self.on_error):
+            self.on_error(stacktrace)
+
+        error = HTTPError(500, "Internal Server Error", e, stacktrace)
+        error.apply(response)
+        return error
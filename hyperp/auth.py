@@ -1,10 +1,14 @@
 import hashlib
+import hmac
 import base64
 import secrets
+import threading
+import time
 import datetime
 from decimal import Decimal
 import string
 import random
+from collections import OrderedDict
 
 
 UNUSABLE_PASSWORD_PREFIX = '!'
@@ -109,3 +113,100 @@ def generate_pin(length=6):
     characters = string.ascii_uppercase + string.digits
     pin = ''.join(random.choice(characters) for _ in range(length))
     return pin
+
+
+class TokenCache:
+    """
+    Resolves tokens to principals through `loader` and keeps the
+    result for `ttl` seconds. The least recently used entries are
+    dropped when more than `maxsize` tokens are cached.
+    Call `invalidate(token)` on logout.
+    """
+    def __init__(self, loader, ttl=300, maxsize=10000):
+        self._loader = loader
+        self._ttl = ttl
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by invalidate and clear, a load started before is not cached
+        self._generation = 0
+
+    def __call__(self, token):
+        if not token:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                principal, expires = entry
+                if expires > now:
+                    self._entries.move_to_end(token)
+                    return principal
+                del self._entries[token]
+            generation = self._generation
+
+        # Loaded outside the lock so a slow lookup does not block others
+        principal = self._loader(token)
+
+        # Unknown tokens are not cached, a token created right after
+        # a failed lookup should work at once
+        if principal is None:
+            return None
+
+        with self._lock:
+            if generation != self._generation:
+                # Logged out while loading, the principal may be stale
+                return principal
+            self._entries[token] = (principal, now + self._ttl)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+        return principal
+
+    def invalidate(self, token):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+def _sign(value, secret):
+    digest = hmac.new(force_bytes(secret), force_bytes(value), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode('ascii').rstrip('=')
+
+
+def make_signed_token(value, secret):
+    """
+    Return a stateless token for `value` that can be verified with
+    `read_signed_token` without a database lookup.
+    `value` must not contain '$'.
+    """
+    if '$' in str(value):
+        raise ValueError("Signed token values must not contain '$'")
+    payload = f"{value}${int(time.time())}"
+    return f"{payload}${_sign(payload, secret)}"
+
+
+def read_signed_token(token, secret, max_age=None):
+    """
+    Return the value of a token made by `make_signed_token`
+    or None if the signature is invalid or it is older than `max_age` seconds.
+    """
+    if not token or token.count('$') != 2:
+        return None
+
+    payload, signature = token.rsplit('$', 1)
+    if not constant_time_compare(signature, _sign(payload, secret)):
+        return None
+
+    value, issued = payload.split('$', 1)
+    if max_age is not None and time.time() - int(issued) > max_age:
+        return None
+
+    return value
@@ -0,0 +1,279 @@
+"""
+Load test a hyperp app in-process over WSGI, run with `python -m hyperp.bench`
+
+Usage:
+  hyperp.bench [--requests=<n>] [--concurrency=<c>] [--output=<path>] [--compare=<path>]
+
+Options:
+  --requests=<n>     Requests per route [default: 2000]
+  --concurrency=<c>  Concurrent client threads [default: 8]
+  --output=<path>    Write the results as JSON to this file
+  --compare=<path>   Print the change against an earlier JSON result
+"""
+import io
+import os
+import sys
+import json
+import time
+import tempfile
+import platform
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Route:
+    def __init__(self, name, method, path, body=None, headers=None, query=""):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = json.dumps(body).encode() if body is not None else b""
+        self.headers = headers or {}
+        self.query = query
+
+        if body is not None:
+            self.headers.setdefault("Content-Type", "application/json")
+
+    def environ(self):
+        environ = {
+            "REQUEST_METHOD": self.method,
+            "PATH_INFO": self.path,
+            "QUERY_STRING": self.query,
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "REMOTE_ADDR": "127.0.0.1",
+            "CONTENT_LENGTH": str(len(self.body)),
+            "HTTP_HOST": "localhost",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(self.body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+
+        for key, value in self.headers.items():
+            if key.lower() == "content-type":
+                environ["CONTENT_TYPE"] = value
+            else:
+                environ["HTTP_" + key.upper().replace("-", "_")] = value
+
+        return environ
+
+
+def call(app, route):
+    """Runs one request through the WSGI app, returns the status code"""
+    status = []
+
+    def start_response(line, headers, exc_info=None):
+        status.append(int(line.split()[0]))
+
+    body = app(route.environ(), start_response)
+    try:
+        for _ in body:
+            pass
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+
+    return status[0]
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _reset_peak():
+    # The traced size the peak now counts from
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+    else:
+        # Before 3.9 only clearing the traces resets the peak, memory
+        # allocated before and freed in the call is then not subtracted
+        tracemalloc.clear_traces()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def _allocations(app, route, samples):
+    # Single threaded so the numbers belong to this route only
+    peaks = []
+    retained = 0
+    tracemalloc.start()
+    try:
+        call(app, route)
+        for _ in range(samples):
+            start = _reset_peak()
+            call(app, route)
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - start)
+            retained += current - start
+    finally:
+        tracemalloc.stop()
+
+    return sum(peaks) / len(peaks), retained / samples
+
+
+def bench_route(app, route, requests=2000, concurrency=8, alloc_samples=100):
+    """
+    Sends `requests` requests to `route` from `concurrency` threads, returns
+    latency percentiles in ms, requests per second, errors (5xx) and
+    the mean peak bytes allocated and bytes retained per request.
+    """
+    def worker(count):
+        timings = []
+        errors = 0
+        for _ in range(count):
+            start = time.perf_counter()
+            status = call(app, route)
+            timings.append(time.perf_counter() - start)
+            errors += status >= 500
+        return timings, errors
+
+    per_worker = [requests // concurrency] * concurrency
+    per_worker[0] += requests - sum(per_worker)
+
+    call(app, route)  # warm up
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, per_worker))
+    elapsed = time.perf_counter() - started
+
+    timings = sorted(t for worker_timings, _ in results for t in worker_timings)
+    alloc_peak, alloc_retained = _allocations(app, route, alloc_samples)
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": sum(errors for _, errors in results),
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(_percentile(timings, 0.50) * 1000, 3),
+        "p95_ms": round(_percentile(timings, 0.95) * 1000, 3),
+        "p99_ms": round(_percentile(timings, 0.99) * 1000, 3),
+        "alloc_peak_bytes": round(alloc_peak),
+        "alloc_retained_bytes": round(alloc_retained),
+    }
+
+
+def bench(app, routes, requests=2000, concurrency=8):
+    return {
+        "python": platform.python_version(),
+        "time": int(time.time()),
+        "routes": {
+            route.name: bench_route(app, route, requests, concurrency)
+            for route in routes
+        },
+    }
+
+
+def sample_app(db_path):
+    """
+    A bottle app using rpc, get, install_cors, install_peewee
+    with SQLite and ErrorHandler, and the routes to load it with
+    """
+    import bottle
+    from peewee import SqliteDatabase, Model, CharField, IntegerField
+
+    from .bottle import rpc, get, install_cors, install_peewee, ErrorHandler
+
+    db = SqliteDatabase(db_path)
+
+    class Item(Model):
+        name = CharField()
+        price = IntegerField()
+
+        class Meta:
+            database = db
+
+    db.create_tables([Item])
+    with db.atomic():
+        Item.insert_many([dict(name=f"item {i}", price=i) for i in range(100)]).execute()
+    db.close()
+
+    # rpc and get register on the default app, push a fresh one for the bench
+    app = bottle.default_app.push()
+    try:
+        install_cors(app, ["localhost"])
+        install_peewee(db)
+        app.install(ErrorHandler(lambda msg: None))
+
+        @get("/bench/ping")
+        def ping():
+            return "pong"
+
+        @rpc("/bench/echo")
+        def echo(x: int, name: str = ""):
+            return {"x": x, "name": name}
+
+        @rpc("/bench/items")
+        def items(limit: int = 20):
+            return {"items": list(Item.select().order_by(Item.id).limit(limit).dicts())}
+
+        @rpc("/bench/auth", checker=lambda: "" if bottle.request.get_header("Authorization") else "No access")
+        def auth():
+            return {"ok": True}
+    finally:
+        bottle.default_app.pop()
+
+    routes = [
+        Route("get_ping", "GET", "/bench/ping"),
+        Route("rpc_echo", "POST", "/bench/echo", {"x": 1, "name": "a"}),
+        Route("rpc_invalid", "POST", "/bench/echo", {"x": "a"}),
+        Route("rpc_items", "POST", "/bench/items", {"limit": 20}),
+        Route("rpc_auth", "POST", "/bench/auth", {}, {"Authorization": "Bearer abc"}),
+        Route("rpc_unauthorized", "POST", "/bench/auth", {}),
+    ]
+
+    return app, routes
+
+
+def compare(old, new):
+    """Returns lines with the change of each metric between two results"""
+    lines = []
+
+    for name, metrics in new["routes"].items():
+        if name not in old["routes"]:
+            continue
+
+        changes = []
+        for key in ("rps", "p50_ms", "p99_ms", "alloc_peak_bytes"):
+            before, after = old["routes"][name][key], metrics[key]
+            change = (after - before) / before * 100 if before else 0
+            changes.append(f"{key} {before} -> {after} ({change:+.1f}%)")
+        lines.append(f"{name}: {', '.join(changes)}")
+
+    return lines
+
+
+def main(argv=None):
+    from docopt import docopt
+
+    args = docopt(__doc__, argv=argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app, routes = sample_app(os.path.join(tmp_dir, "bench.db"))
+        result = bench(app, routes, int(args["--requests"]), int(args["--concurrency"]))
+
+    for name, metrics in result["routes"].items():
+        print(
+            f"{name:18} {metrics['rps']:>9} rps  p50 {metrics['p50_ms']}ms  "
+            f"p95 {metrics['p95_ms']}ms  p99 {metrics['p99_ms']}ms  "
+            f"alloc {metrics['alloc_peak_bytes']}B  errors {metrics['errors']}"
+        )
+
+    if args["--output"]:
+        with open(args["--output"], "w") as fh:
+            json.dump(result, fh, indent=2)
+
+    if args["--compare"]:
+        with open(args["--compare"]) as fh:
+            print("\n".join(compare(json.load(fh), result)))
+
+    return result
+
+
+if __name__ == "__main__":
+    main()
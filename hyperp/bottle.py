@@ -1,21 +1,25 @@
 import os
+import random
 import inspect
-from zipfile import ZipFile
+import logging
 from functools import wraps
+from contextlib import contextmanager, ExitStack, nullcontext
 from traceback import format_exc
-from datetime import datetime
-import tempfile
-from uuid import uuid4
+from datetime import datetime, date
+import types
+from typing import Union, get_origin, get_args
+from dataclasses import dataclass
 
-from bottle import post, request, HTTPResponse, response, hook
+from bottle import post, route, request, HTTPResponse, response, hook, install
 from bottle import get as bottleget
 
-from .utils import to_int, dumps, is_ip4, rmdir, mkdir
-from .docs import DOCS
+from .utils import to_int, to_date, bars2list, dumps, is_ip4, rmdir, mkdir
 from enum import Enum
 
 # TODO: rpc msg on errors
 
+logger = logging.getLogger("hyperp")
+
 
 class InvalidForm(Exception):
     def __init__(self, param, msg):
@@ -25,8 +29,9 @@ class InvalidForm(Exception):
 
 def get_or_404(query):
     from peewee import DoesNotExist
+    from .peewee import get_cached
     try:
-        return query.get()
+        return get_cached(query)
     except DoesNotExist as e:
         e_msg = e.__class__.__name__
         model_name = e_msg.split("DoesNotExist")[0] if len(e_msg.split("DoesNotExist")) > 0 else ""
@@ -38,57 +43,120 @@ def get_or_404(query):
         )
 
 
-def _get_sig(func):
+@dataclass
+class Param:
+    __slots__ = ("name", "annotation", "type", "enums", "required", "default", "has_default",
+                 "check", "enum", "optional")
 
-    signature = inspect.signature(func)
-    params = []
-    paramsDict = {}
+    name: str
+    annotation: object
+    type: str
+    enums: list
+    required: bool
+    default: object
+    has_default: bool
+    # Runtime type for isinstance, None when anything goes
+    check: object
+    enum: object
+    # Optional[X] or X | None, None passes the check
+    optional: bool
 
-    def get_type(p):
-        if isinstance(p.annotation, type) and issubclass(p.annotation, Enum):
-            return "enum"
 
-        if p.annotation != p.empty:
-            return p.annotation.__name__
+class Api:
+    """
+    A registered rpc. The signature is only introspected on first call
+    or when the docs are rendered, not at import.
+    """
+    __slots__ = ("name", "path", "func", "method", "_params", "_coerce")
 
-        return "Unknown"
+    def __init__(self, name, path, func, method="post"):
+        self.name = name
+        self.path = path
+        self.func = func
+        self.method = method
+        self._params = None
+        self._coerce = None
 
-    def get_enums(p):
-        if isinstance(p.annotation, type) and issubclass(p.annotation, Enum):
-            return [item.value for item in p.annotation]
-        
-        return []
-
-    # paramDict is exactly like params but just an dict instead of list
-    # this is so validate can access it faster
-    for name, p in signature.parameters.items():
-
-        param = {
-            "name": name,
-            "docs": str(inspect.getdoc(func) if inspect.getdoc(func) else ""),
-            "typeClass": p.annotation if p.annotation != inspect.Parameter.empty else "Any",
-            "type": get_type(p),
-            "enums": get_enums(p),
-            "required": p.default == p.empty,
-            "default": p.default if p.default != inspect.Parameter.empty else "N/A",
-            "has_default": True if p.default != inspect.Parameter.empty else False,
-        }
-        params.append(param)
-        paramsDict[param['name']] = param
-
-    result = {
-        "name": func.__name__,
-        "params": params, 
-        "paramsDict": paramsDict,
-        "method": "post", 
-        "func": func,
-    }
+    def __repr__(self):
+        return f"Api(name={self.name!r}, path={self.path!r}, method={self.method!r})"
+
+    @property
+    def params(self):
+        if self._params is None:
+            self._params = _get_sig(self.func)
+        return self._params
+
+    @property
+    def coerce(self):
+        if self._coerce is None:
+            self._coerce = _compile_coercion(self)
+        return self._coerce
+
+    @property
+    def docs(self):
+        return inspect.getdoc(self.func) or ""
+
+
+class Registry:
+    """The rpcs by path and by name, in the order they were declared"""
+    __slots__ = ("by_path", "by_name", "version")
+
+    def __init__(self):
+        self.by_path = {}
+        self.by_name = {}
+        self.version = 0
+
+    def add(self, api):
+        self.by_path[api.path] = api
+        self.by_name[api.name] = api
+        self.version += 1
+
+    def __iter__(self):
+        return iter(self.by_path.values())
+
+    def __len__(self):
+        return len(self.by_path)
+
+
+def _get_sig(func):
+    params = {}
+
+    for name, p in inspect.signature(func).parameters.items():
+        annotation = p.annotation
+        has_annotation = annotation is not p.empty
+        is_enum = isinstance(annotation, type) and issubclass(annotation, Enum)
+
+        if is_enum:
+            type_name = "enum"
+        elif has_annotation:
+            type_name = getattr(annotation, "__name__", str(annotation))
+        else:
+            type_name = "Unknown"
+
+        inner = _optional(annotation)
+        check = inner if inner is not None else annotation
+        check = get_origin(check) or check
+        if is_enum or not isinstance(check, type) or issubclass(check, Enum):
+            check = None
+
+        params[name] = Param(
+            name=name,
+            annotation=annotation if has_annotation else "Any",
+            type=type_name,
+            enums=[item.value for item in annotation] if is_enum else [],
+            required=p.default is p.empty,
+            default=p.default if p.default is not p.empty else "N/A",
+            has_default=p.default is not p.empty,
+            check=check,
+            enum=annotation if is_enum else None,
+            optional=inner is not None,
+        )
 
-    return result
+    return params
 
 
-def validate_and_call(func, sig, args):
-    params = sig["paramsDict"]
+def validate_and_call(func, api, args):
+    params = api.params
 
     def get_enum_value(expected_type, name, value):
         # Check if the value matches any of the Enum members' values
@@ -104,153 +172,452 @@ def validate_and_call(func, sig, args):
         raise InvalidForm(name, f'Expected one of {[item.value for item in expected_type]}')
 
     for arg_name, arg_value in args.items():
-        if arg_name not in params:
-            # TODO log this error
-            print(f'Unexpected argument {arg_name}={arg_value}')
+        param = params.get(arg_name)
+        if param is None:
+            logger.warning(
+                f'Unexpected argument {arg_name}',
+                extra={"event": "unexpected_argument", "argument": arg_name},
+            )
             continue
         
-        expected_type = params[arg_name]["typeClass"]
-        
-        if isinstance(expected_type, type) and issubclass(expected_type, Enum):
-            args[arg_name] = get_enum_value(expected_type, arg_name, arg_value)
-        elif expected_type != "Any" and not isinstance(arg_value, expected_type):
-            raise InvalidForm(arg_name, f'Expected {expected_type.__name__} type')
+        if param.enum is not None:
+            args[arg_name] = get_enum_value(param.enum, arg_name, arg_value)
+        elif param.check is not None and not isinstance(arg_value, param.check) \
+                and not (arg_value is None and param.optional):
+            raise InvalidForm(arg_name, f'Expected {param.check.__name__} type')
     
     kwargs = {arg_name: args[arg_name] for arg_name in params if arg_name in args}
 
     # Check that all of them are there
-    for param, param_details in params.items():
-        if param not in args and param_details['required']:
-            raise InvalidForm(param, 'Missing expected parameter')
+    for name, param in params.items():
+        if name not in args and param.required:
+            raise InvalidForm(name, 'Missing expected parameter')
 
     return func(**kwargs)
 
 
-_apis = []
+_apis = Registry()
 
 
-def _get_request_data():
+def _get_request_data(stream_uploads=False):
     """
-    Get request data depends on content type
+    Get request data depends on content type, the second value
+    tells if the values are text and need coercion to the parameter types
     """
     content_type = request.get_header("Content-Type", "")
-    # TODO: Should we accept also query parameters?
     try:
-        if "application/json" in content_type:
-            return request.json
-        elif "multipart/form-data" in content_type:
-            return request.forms
+        if request.method == "GET":
+            return request.query.decode(), True
+        elif "application/json" in content_type:
+            return request.json, False
+        elif stream_uploads and "multipart/form-data" in content_type:
+            # Left unread for parse_multipart in the handler
+            request.environ["hyperp.stream_uploads"] = True
+            return {}, False
+        elif "multipart/form-data" in content_type or "application/x-www-form-urlencoded" in content_type:
+            return request.forms.decode(), True
         else:
-            return {}
+            return {}, False
     except:
-        return {}
+        return {}, False
+
+
+# X | None is a types.UnionType from 3.10 on
+_UNIONS = (Union, getattr(types, "UnionType", Union))
+
+_TRUE = frozenset(["true", "1", "yes", "on"])
+_FALSE = frozenset(["false", "0", "no", "off", ""])
+
+
+def _optional(annotation):
+    """X for Optional[X] and X | None, else None"""
+    if get_origin(annotation) in _UNIONS:
+        args = get_args(annotation)
+        rest = [arg for arg in args if arg is not type(None)]
+        if len(rest) == 1 and len(args) == 2:
+            return rest[0]
+    return None
+
+
+def _get_converter(annotation):
+    """
+    Returns a function turning one text value into `annotation`,
+    or None when the text is used as it is
+    """
+    if isinstance(annotation, type) and issubclass(annotation, Enum):
+        choices = {str(item.value): item.value for item in annotation}
+
+        def convert_enum(name, value):
+            if value not in choices:
+                raise InvalidForm(name, f'Expected one of {list(choices.values())}')
+            return choices[value]
+
+        return convert_enum
+
+    if annotation is bool:
+        def convert_bool(name, value):
+            value = value.strip().lower()
+            if value in _TRUE:
+                return True
+            if value in _FALSE:
+                return False
+            raise InvalidForm(name, 'Expected bool type')
+
+        return convert_bool
+
+    if annotation in (int, float):
+        def convert_number(name, value):
+            try:
+                return annotation(value)
+            except ValueError:
+                raise InvalidForm(name, f'Expected {annotation.__name__} type')
+
+        return convert_number
+
+    if annotation in (date, datetime):
+        def convert_date(name, value):
+            converted = to_date(value, None)
+            if converted is None:
+                raise InvalidForm(name, 'Expected date as YYYY-MM-DD')
+            return converted if annotation is datetime else converted.date()
+
+        return convert_date
+
+    return None
+
+
+def _get_coercer(annotation):
+    """
+    Returns a function turning the text value(s) of a form or query string
+    into `annotation`, or None when the text is used as it is
+    """
+    inner = _optional(annotation)
+    if inner is not None:
+        coerce = _get_coercer(inner)
+        if coerce is None:
+            return None
+
+        def coerce_optional(name, form):
+            # An empty field is None
+            return None if form.get(name) == "" else coerce(name, form)
+
+        return coerce_optional
+
+    if (get_origin(annotation) or annotation) is list:
+        args = get_args(annotation)
+        convert = _get_converter(args[0]) if args else None
+
+        def coerce_list(name, form):
+            values = form.getall(name)
+            values = bars2list(values[0]) if len(values) == 1 else values
+            return [convert(name, value) for value in values] if convert else values
+
+        return coerce_list
+
+    convert = _get_converter(annotation)
+    if convert is None:
+        return None
+
+    def coerce_value(name, form):
+        return convert(name, form.get(name))
+
+    return coerce_value
+
+
+def _compile_coercion(api):
+    coercers = {}
+    for name, param in api.params.items():
+        coercer = _get_coercer(param.annotation)
+        if coercer:
+            coercers[name] = coercer
+
+    return coercers
+
+
+def _coerce(coercers, form):
+    return {
+        name: coercers[name](name, form) if name in coercers else form.get(name)
+        for name in form.keys()
+    }
+
+
+def get_principal():
+    """
+    Returns the principal resolved for the current request
+    by the `resolver` given to `rpc` or `get`.
+    """
+    return request.environ.get("hyperp.principal")
+
+
+def _check(checker, resolver):
+    if resolver is None:
+        return checker() if checker else ''
+
+    principal = resolver(get_token())
+    request.environ["hyperp.principal"] = principal
+
+    return checker(principal) if checker else ''
+
+
+def _run(res):
+    # async handlers are run to completion when served by plain WSGI, under
+    # hyperp.asgi the coroutine is returned for its event loop to await,
+    # plugins and hooks wrap it there, see _around
+    if not inspect.iscoroutine(res):
+        return res
+
+    import asyncio
+    from .deadline import remaining
+
+    left = remaining()
+    if left is not None:
+        res = asyncio.wait_for(res, max(left, 0))
+
+    if request.environ.get("hyperp.asgi"):
+        return res
+    return asyncio.run(res)
+
+
+def _around(manager, call):
+    """
+    Runs `call()` inside the context `manager`. When it returns a coroutine,
+    an async handler under hyperp.asgi, the context is only left once the
+    coroutine is awaited, so plugins can wrap sync and async handlers alike.
+    """
+    with ExitStack() as stack:
+        stack.enter_context(manager)
+        result = call()
+        if not inspect.iscoroutine(result):
+            return result
+        pending = stack.pop_all()
+
+    async def awaited():
+        with pending:
+            return await result
+
+    return awaited()
+
+
+def _call_get(func, checker, resolver, *args, **kwargs):
+    checked = _check(checker, resolver)
+    if checked:
+        response.status = 401
+        return checked
+
+    return func(*args, **kwargs)
+
+
+def _call_rpc(func, api, checker, resolver, stream_uploads=False):
+    req_data, is_text = _get_request_data(stream_uploads)
+    checked = _check(checker, resolver)
+    if checked:
+        response.status = 401
+        response.content_type = "application/json"
 
+        return dict(msg=checked)
+    try:
+        response.status = 200
+        response.content_type = "application/json"
+        if is_text:
+            req_data = _coerce(api.coerce, req_data)
+        return validate_and_call(func, api, req_data)
+    except InvalidForm as e:
+        response.status = 400
+        response.content_type = "application/json"
+        return {"msg": "Invalid Form", "param": e.param, "msg": e.msg}
+
+
+def get_many_or_404(Model, ids):
+    """
+    Returns the objects with `ids`, in that order, fetched with one IN
+    query, 404 unless all of them exist.
+    """
+    from .peewee import get_many, _adapt
+
+    found = get_many(Model, ids)
+    try:
+        return [found[_adapt(Model, pk)] for pk in ids]
+    except KeyError:
+        raise HTTPResponse(
+            status=404,
+            headers={"Content-Type": "application/json"},
+            body=dumps(dict(msg=f"{Model.__name__} Not Exist")),
+        )
+
+
+# The databases given to install_peewee, their queries are only bounded
+# by the time left once a route declares a deadline
+_deadlines = dict(used=False, databases=[])
+
+
+def _bound_queries(databases):
+    from .peewee import enforce_deadlines
+    for database in databases:
+        enforce_deadlines(database)
+
+
+def _declare_deadline(seconds):
+    if seconds is not None and not _deadlines["used"]:
+        _deadlines["used"] = True
+        _bound_queries(_deadlines["databases"])
+
+
+def _within(seconds):
+    if seconds is None:
+        return nullcontext()
+    return _deadline(seconds)
+
+
+def _timeouts():
+    # What a call cut short by the deadline raises, requests' only when in use
+    import sys
+    import socket
+    import asyncio
+
+    errors = (TimeoutError, socket.timeout, asyncio.TimeoutError, asyncio.CancelledError)
+    requests = sys.modules.get("requests")
+    if requests is not None:
+        errors += (requests.exceptions.Timeout,)
+    return errors
+
+
+@contextmanager
+def _deadline(seconds):
+    from .deadline import deadline, expired, DeadlineExceeded
+
+    with deadline(seconds):
+        try:
+            yield
+        except DeadlineExceeded:
+            pass
+        except _timeouts():
+            # A timeout of its own before the deadline passed is an error
+            if not expired():
+                raise
+        else:
+            return
+
+    raise HTTPResponse(
+        status=504,
+        headers={"Content-Type": "application/json"},
+        body=dumps(dict(msg="Deadline exceeded")),
+    )
+
+
+def get(path, checker=None, resolver=None, profile=None, read_only=True, concurrency=None,
+        deadline=None):
+    _declare_deadline(deadline)
 
-def get(path, checker=None):
     def decorator(func):
      
         @wraps(func)
-        @bottleget(path)
+        @bottleget(path, profile=profile, read_only=read_only, concurrency=concurrency)
         def wrapper(*args, **kwargs):
-            checked = checker() if checker else ''
-            if checked:
-                response.status = 401
-                return checked
+            return _around(_within(deadline), lambda: _run(_call_get(func, checker, resolver, *args, **kwargs)))
+
+        wrapper._hyperp_async = inspect.iscoroutinefunction(func)
 
-            return func(*args, **kwargs)
-        
         return wrapper
     return decorator
 
 
-def rpc(path, checker=None):
+def rpc(path, checker=None, resolver=None, profile=None, allow_get=False, read_only=False,
+        concurrency=None, deadline=None, stream_uploads=False):
+    """
+    Exposes `func` at `path`. Arguments are read from a JSON body, or
+    from a form, with the text values coerced to the annotated types.
+    With `allow_get` the route also answers GET with the arguments in
+    the query string, so reads can be cached by browsers and CDNs.
+    With `read_only` it reads from the replicas given to install_peewee.
+    `concurrency` limits the requests running at once, see install_admission.
+    With a `deadline` in seconds, queries and outbound calls get the time
+    left as timeout and the request is answered 504 when it runs out.
+    With `stream_uploads` a multipart body is not parsed into arguments,
+    the handler reads it with hyperp.uploads.parse_multipart and its limits.
+    """
+    _declare_deadline(deadline)
+
     def decorator(func):
-        sig = _get_sig(func)
-        sig['path'] = path
-        _apis.append(sig)
+        api = Api(func.__name__, path, func)
+        _apis.add(api)
 
         @wraps(func)
-        @post(path)
+        @route(path, method=["GET", "POST"] if allow_get else "POST", profile=profile,
+               read_only=read_only, concurrency=concurrency)
         def wrapper(*args, **kwargs):
-            req_data = _get_request_data()        
-            checked = checker() if checker else ''
-            if checked:
-                response.status = 401
-                response.content_type = "application/json"
+            return _around(_within(deadline), lambda: _run(_call_rpc(func, api, checker, resolver, stream_uploads)))
 
-                return dict(msg=checked)
-            try:
-                response.status = 200
-                response.content_type = "application/json"
-                return validate_and_call(func, sig, req_data)
-            except InvalidForm as e:
-                response.status = 400
-                response.content_type = "application/json"
-                return {"msg": "Invalid Form", "param": e.param, "msg": e.msg}
-            return dumps(res)
+        wrapper._hyperp_async = inspect.iscoroutinefunction(func)
 
         return wrapper
 
     return decorator
 
 
-def install_docs(app, path, base):
-    # It is important that this is at init else it wont work
-
+def _render_docs(base):
+    # Without func and parameter classes, so it is serializable
     apis = []
 
-    # We do this because we need the base url
-    # and we need to remove non-seriazable things
-    # like func and parameter classes
-    # It is slow, but only done everytime we render docs
-    # so it's okay
     for api in _apis:
-        params = []
-
-        for p in api['params']:
-            params.append(dict(
-                name=p['name'],
-                type=p['type'],
-                enums=p['enums'],
-                required=p['required'],
-                default=p['default'],
-                has_default=p['has_default'],
-            ))
-
         apis.append(dict(
-            name=api['name'],
-            url=f"{base}{api['path']}",
-            method=api['method'],
-            docs=p['docs'],
-            params=params,
-        )) 
+            name=api.name,
+            url=f"{base}{api.path}",
+            method=api.method,
+            docs=api.docs,
+            params=[
+                dict(
+                    name=p.name,
+                    type=p.type,
+                    enums=p.enums,
+                    required=p.required,
+                    default=p.default.value if isinstance(p.default, Enum) else p.default,
+                    has_default=p.has_default,
+                )
+                for p in api.params.values()
+            ],
+        ))
+
+    from .docs import DOCS
+    return DOCS.replace("APIS", dumps(apis)).replace("BASE", base)
+
+
+def install_docs(app, path, base):
+    # Rendered on the first visit and again only when rpcs were added,
+    # so routes declared after this call are included too
+    rendered = {}
 
     @app.get(path)
     def mydocs_view():
-        return DOCS.replace("APIS", dumps(apis)).replace("BASE", base)
+        if rendered.get("version") != _apis.version:
+            rendered["html"] = _render_docs(base)
+            rendered["version"] = _apis.version
+        return rendered["html"]
 
 
 def get_token():
-    if "Authorization" in request.headers:
-        return (
-            request.
-            headers["Authorization"].
-            replace('bearer', '').
-            replace('Bearer', '').
-            replace('BEARER', '').
-            strip()
-        )
+    authorization = request.environ.get("HTTP_AUTHORIZATION")
+    if authorization is not None:
+        authorization = authorization.strip()
+        if authorization[:6].lower() == "bearer":
+            authorization = authorization[6:].lstrip()
+        return authorization
     elif 'token' in request.cookies:
         return request.cookies['token']
-    elif "multipart/form-data" in str(request.content_type):
+    elif "multipart/form-data" in str(request.content_type) and not request.environ.get("hyperp.stream_uploads"):
+        # A streamed body is left for parse_multipart, reading the form would spool it
         return request.forms.get("authorization")
 
     return None
 
 
-def install_deploy(path, output, key="", on_invalid_key=None, post_fun=None, merge=False):
+def install_deploy(path, output, key="", on_invalid_key=None, post_fun=None, merge=False, max_size=None):
     @post(path)
     def deployer():
+        import tempfile
+        from zipfile import ZipFile
+        from uuid import uuid4
+        from .uploads import parse_multipart
+
         if key and request.headers.get("Authorization", "") != f"apitoken {key}":
             if on_invalid_key and callable(on_invalid_key):
                 on_invalid_key()
@@ -258,21 +625,32 @@ def install_deploy(path, output, key="", on_invalid_key=None, post_fun=None, mer
 
         with tempfile.TemporaryDirectory() as tmp_dir:
             zip_path = os.path.join(tmp_dir, f'deployer-{uuid4()}.zip')
-            request.files.get("file").save(zip_path, overwrite=True)
+            # Streamed to disk, the zip is never held in memory
+            _, uploads = parse_multipart(
+                target=lambda name, filename: zip_path if name == "file" else None,
+                max_part_size=max_size,
+                max_total_size=max_size,
+            )
+            if "file" not in uploads:
+                response.status = 400
+                return "missing file"
 
-            with ZipFile(zip_path, "r") as fh:
-                if not merge:
-                    rmdir(output)
+            if os.path.islink(output):
+                # Switched to releases by install_delta_deploy, extracting
+                # in place would write through hard links into older releases
+                from .deploy import Releases
+                Releases(output).deploy(zip_path, [], None, replace=not merge)
+            else:
+                with ZipFile(zip_path, "r") as fh:
+                    if not merge:
+                        rmdir(output)
 
-                mkdir(output)
-                fh.extractall(output)
+                    mkdir(output)
+                    fh.extractall(output)
 
             if post_fun and callable(post_fun):
                 post_fun()
 
-            request.body.close()
-            # TODO remove file after deploy
-
         return "ok"
 
 
@@ -312,7 +690,7 @@ def _formatted_headers() -> str:
         [
             f"{key}: {value}"
             for key, value in request.headers.items()
-            if key.lower() not in forbidden_names
+            if not any(name in key.lower() for name in forbidden_names)
         ]
     )
 
@@ -355,35 +733,160 @@ class ErrorHandler:
 
         return msg
 
+    def _handle(self):
+        # Called in the except block, for sync and awaited handlers
+        try:
+            raise
+        except HTTPResponse as e:
+            response.status = getattr(e, "status", None)
+            response.headers.update(getattr(e, "headers", {}))
+            return getattr(e, "body", {"msg": "Something went wrong"})
+        except:  # noqa
+            msg = f"{self._format()}\n\n{format_exc()}"
+            self._on_error(msg)
+            logger.exception(
+                "Internal error",
+                extra={"event": "error", "headers": _formatted_headers()},
+            )
+            return {"msg": "Internal Error"}
+
+    async def _awaited(self, result):
+        try:
+            return await result
+        except:  # noqa
+            return self._handle()
+
     def __call__(self, callback):
         def wrapper(*args, **kwargs):
             try:
-                return callback(*args, **kwargs)
-            except HTTPResponse as e:
-                response.status = getattr(e, "status", None)
-                response.headers.update(getattr(e, "headers", {}))
-                return getattr(e, "body", {"msg": "Something went wrong"})
+                result = callback(*args, **kwargs)
             except:  # noqa
-                msg = f"{self._format()}\n\n{format_exc()}"
-                self._on_error(msg)
-                print(msg)
-                return {"msg": "Internal Error"}
+                return self._handle()
+
+            if inspect.iscoroutine(result):
+                return self._awaited(result)
+            return result
+
+        return wrapper
+
+
+class _ReadReplicaPlugin:
+    """Runs the read_only routes with a random replica for their reads"""
+    name = "hyperp_read_replica"
+    api = 2
+
+    def __init__(self, db, replicas):
+        self.db = db
+        self.replicas = replicas
+
+    def apply(self, callback, route):
+        if not route.config.get("read_only"):
+            return callback
+
+        from .peewee import read_replica
+
+        @wraps(callback)
+        def wrapper(*args, **kwargs):
+            return _around(read_replica(self.db, random.choice(self.replicas)), lambda: callback(*args, **kwargs))
 
         return wrapper
 
 
-def install_peewee(db):
+def install_peewee(db, query_stats=False, slow_query_ms=None, repeated_query_limit=None, replicas=None,
+                   identity_map=False):
+    """
+    Connects `db` for every request.
+
+    With `identity_map` primary key lookups through get_or_404 and
+    get_many_or_404 load every object once per request, any write to
+    `db` clears the map.
+
+    With `replicas` (databases with the same schema, e.g. the reader of
+    sqlite_databases) `get` routes and rpcs declared `read_only` run
+    their SELECTs on one of them, until the request writes to `db`.
+
+    Once a route declares a `deadline`, the queries on `db` and the
+    replicas are bounded by the time it has left, see enforce_deadlines.
+
+    With `query_stats` the number of queries and the time spent in them
+    are sent as X-Query-Count and Server-Timing headers. Queries slower
+    than `slow_query_ms`, and statements repeated more than
+    `repeated_query_limit` times in one request (N+1), are logged.
+    """
+    instrument = query_stats or slow_query_ms is not None or repeated_query_limit is not None
+
+    if instrument:
+        from .peewee import instrument_queries
+        for database in [db, *(replicas or [])]:
+            instrument_queries(database)
+
+    from .peewee import context_connections
+    databases = [db, *(replicas or [])]
+    for database in databases:
+        context_connections(database)
+
+    _deadlines["databases"].extend(databases)
+    if _deadlines["used"]:
+        _bound_queries(databases)
+
+    if replicas:
+        from .peewee import route_reads
+        route_reads(db)
+        install(_ReadReplicaPlugin(db, replicas))
+
+    if identity_map:
+        from .peewee import track_identity
+        track_identity(db)
+
     @hook("before_request")
     def _db_connect():
         db.connect(reuse_if_open=True)
 
+        if instrument:
+            from .peewee import start_counting
+            start_counting(slow_query_ms)
+
+        if identity_map:
+            from .peewee import start_identity_map
+            start_identity_map()
+
     @hook("after_request")
     def _db_close():
+        if instrument:
+            _report_queries(query_stats, repeated_query_limit)
+
+        if identity_map:
+            from .peewee import stop_identity_map
+            stop_identity_map()
+
         if not db.is_closed():
             db.close()
 
 
-def cache(hours=None, days=None):
+def _report_queries(query_stats, repeated_query_limit):
+    from .peewee import stop_counting, repeated_queries, _request_route
+
+    stats = stop_counting()
+    if stats is None:
+        return
+
+    if query_stats:
+        response.set_header("X-Query-Count", str(stats.count))
+        response.add_header("Server-Timing", f'db;dur={stats.ms:.2f};desc="{stats.count} queries"')
+
+    if repeated_query_limit is not None:
+        for sql, count in repeated_queries(stats, repeated_query_limit):
+            logger.warning(
+                "Repeated query",
+                extra={"event": "repeated_query", "sql": sql, "count": count, **_request_route()},
+            )
+
+
+def cache(hours=None, days=None, immutable=False):
+    """
+    Sets Cache-Control, `immutable` is for files whose name changes
+    with their content, browsers then never revalidate them.
+    """
     if hours is None and days is None:
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate'
         return
@@ -395,4 +898,7 @@ def cache(hours=None, days=None):
     if days:
         time += days * 60 * 60 * 24
 
-    response.set_header('Cache-Control', f'public, max-age={time}')
+    if immutable:
+        response.set_header('Cache-Control', f'public, max-age={time}, immutable')
+    else:
+        response.set_header('Cache-Control', f'public, max-age={time}')
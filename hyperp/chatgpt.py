@@ -1,6 +1,6 @@
 from traceback import format_exc
 
-import openai
+from .deadline import timeout
 
 
 class ChatGPT:
@@ -12,10 +12,13 @@ class ChatGPT:
         message = default
 
         try:
+            import openai
+
             client = openai.OpenAI(api_key=self.key)
             response = client.chat.completions.create(
                 model="gpt-3.5-turbo",
                 messages=[{"role": "system", 'content': prompt}],
+                timeout=timeout(60),
             )
             message = response.choices[0].message.content.strip()
         except:  # noqa
@@ -1,20 +1,38 @@
 import base64
 import os
+from functools import lru_cache
 from json import loads
 from sys import argv
 
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.backends import default_backend
-from cryptography.fernet import Fernet
 from hyperp.utils import read
 
 
-_key = read(".config.key", "").strip()
-_config = loads(read(".config.json", "{}"))
+# .config.key and .config.json are read on first use, not at import
+_loaded = {}
+
+
+def _load(name):
+    if name not in _loaded:
+        if name == "_key":
+            _loaded[name] = read(".config.key", "").strip()
+        else:
+            _loaded[name] = loads(read(".config.json", "{}"))
+
+    return _loaded[name]
+
+
+def __getattr__(name):
+    if name in ("_key", "_config"):
+        return _load(name)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def _derive_key(password: str, salt: bytes) -> bytes:
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.backends import default_backend
+
     # Derive a cryptographic key from the password and salt
     kdf = PBKDF2HMAC(
         algorithm=hashes.SHA256(),
@@ -26,17 +44,78 @@ def _derive_key(password: str, salt: bytes) -> bytes:
     return base64.urlsafe_b64encode(kdf.derive(password.encode()))
 
 
+# Envelope v2: "v2$" + base64(master salt + nonce + fernet token)
+# The master key is derived with PBKDF2 once per process and salt,
+# each message, or each encrypt_many batch, gets an HKDF subkey from its nonce.
+# Values without the prefix are v1: base64(salt + fernet token)
+# with a PBKDF2 derivation per message.
+_V2 = "v2$"
+_SALT_SIZE = 16
+_NONCE_SIZE = 16
+_process_salt = os.urandom(_SALT_SIZE)
+
+
+@lru_cache(maxsize=32)
+def _master_key(password: str, salt: bytes) -> bytes:
+    return base64.urlsafe_b64decode(_derive_key(password, salt))
+
+
+def _cipher(password: str, salt: bytes, nonce: bytes):
+    from cryptography.fernet import Fernet
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+    from cryptography.hazmat.primitives import hashes
+
+    subkey = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=nonce,
+        info=b"hyperp-config",
+    ).derive(_master_key(password, salt))
+    return Fernet(base64.urlsafe_b64encode(subkey))
+
+
+def encrypt_many(messages, password: str) -> list:
+    nonce = os.urandom(_NONCE_SIZE)
+    cipher = _cipher(password, _process_salt, nonce)
+    header = _process_salt + nonce
+
+    return [
+        _V2 + base64.urlsafe_b64encode(header + cipher.encrypt(message.encode())).decode()
+        for message in messages
+    ]
+
+
+def decrypt_many(encrypted_messages, password: str) -> list:
+    ciphers = {}
+    result = []
+
+    for encrypted_message in encrypted_messages:
+        if not encrypted_message.startswith(_V2):
+            result.append(_decrypt_v1(encrypted_message, password))
+            continue
+
+        data = base64.urlsafe_b64decode(encrypted_message[len(_V2):])
+        header_size = _SALT_SIZE + _NONCE_SIZE
+        header = data[:header_size]
+
+        if header not in ciphers:
+            ciphers[header] = _cipher(password, header[:_SALT_SIZE], header[_SALT_SIZE:])
+        result.append(ciphers[header].decrypt(data[header_size:]).decode())
+
+    return result
+
+
 def encrypt(message: str, password: str) -> str:
-    # Generate a random salt
-    salt = os.urandom(16)
-    key = _derive_key(password, salt)
-    cipher = Fernet(key)
-    encrypted_message = cipher.encrypt(message.encode())
-    # Combine salt and encrypted message and encode to Base64
-    return base64.urlsafe_b64encode(salt + encrypted_message).decode()
+    return encrypt_many([message], password)[0]
 
 
 def decrypt(encrypted_message: str, password: str) -> str:
+    return decrypt_many([encrypted_message], password)[0]
+
+
+def _decrypt_v1(encrypted_message: str, password: str) -> str:
+    from cryptography.fernet import Fernet
+
     # Decode the Base64 encoded message
     encrypted_message = base64.urlsafe_b64decode(encrypted_message)
     # Extract the salt from the encrypted message
@@ -51,23 +130,23 @@ def decrypt(encrypted_message: str, password: str) -> str:
 
 def _decrypt_if_needed(msg):
     if msg.startswith("HYPERP_ENCRYPTED:"):
-        return decrypt(msg[17:], _key)
+        return decrypt(msg[17:], _load("_key"))
     return msg
 
 
 
 def get_int(name, default):
     try:
-        return int(_config.get(name, default))
+        return int(_load("_config").get(name, default))
     except:
         return int(default)
 
 def get_str(name, default):
-    return _decrypt_if_needed(_config.get(name, default))
+    return _decrypt_if_needed(_load("_config").get(name, default))
 
 
 def get_bool(name, default):
-    return _config.get(name, default).lower() == "true"
+    return _load("_config").get(name, default).lower() == "true"
 
 
 if __name__ == "__main__":
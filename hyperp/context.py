@@ -0,0 +1,50 @@
+import weakref
+from contextvars import ContextVar
+
+
+class ContextLocal:
+    """
+    Like threading.local, but also separate per asyncio task, so the
+    requests hyperp.asgi awaits on one event loop do not share state.
+    Subclasses get __init__ called again in every new context.
+    """
+    _instances = weakref.WeakSet()
+
+    def __new__(cls, *args, **kwargs):
+        self = super().__new__(cls)
+        object.__setattr__(self, "_hyperp_context", ContextVar(f"hyperp.local.{id(self)}"))
+        object.__setattr__(self, "_hyperp_init", (args, kwargs))
+        # __init__ runs right after, for the current context
+        self._hyperp_context.set({})
+        ContextLocal._instances.add(self)
+        return self
+
+    def _values(self):
+        values = self._hyperp_context.get(None)
+        if values is None:
+            values = {}
+            self._hyperp_context.set(values)
+            args, kwargs = self._hyperp_init
+            self.__init__(*args, **kwargs)
+        return values
+
+    def __getattr__(self, name):
+        try:
+            return self._values()[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        self._values()[name] = value
+
+    def __delattr__(self, name):
+        try:
+            del self._values()[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    @classmethod
+    def _reset(cls):
+        # A new request task starts empty instead of sharing what it inherited
+        for local in list(cls._instances):
+            local._hyperp_context.set(None)
@@ -0,0 +1,70 @@
+import time
+from contextlib import contextmanager
+
+from .context import ContextLocal
+
+
+# For outbound calls made without a deadline, so nothing waits forever
+DEFAULT_TIMEOUT = 30
+
+# Per thread, and per request task under hyperp.asgi
+_local = ContextLocal()
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    Gives the code in the block `seconds` to finish, a nested deadline
+    can only shorten it. hyperp's outbound calls and instrumented
+    databases use what is left, see timeout().
+    """
+    previous = getattr(_local, "expires", None), getattr(_local, "callbacks", None)
+    expires = time.monotonic() + seconds
+    _local.expires = min(expires, previous[0]) if previous[0] is not None else expires
+    _local.callbacks = {}
+    try:
+        yield
+    finally:
+        callbacks = _local.callbacks
+        _local.expires, _local.callbacks = previous
+        for callback in callbacks.values():
+            callback()
+
+
+def on_exit(callback, key=None):
+    """
+    Runs `callback` when the current deadline block ends, e.g. to undo a
+    setting, once per `key`. Returns False when `key` was registered already.
+    """
+    key = key or callback
+    if key in _local.callbacks:
+        return False
+    _local.callbacks[key] = callback
+    return True
+
+
+def remaining():
+    """Seconds left of the current deadline, None without one"""
+    expires = getattr(_local, "expires", None)
+    if expires is None:
+        return None
+    return expires - time.monotonic()
+
+
+def expired():
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def timeout(default=DEFAULT_TIMEOUT):
+    """The timeout for a blocking call, raises DeadlineExceeded when no time is left"""
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceeded()
+    return min(left, default)
@@ -0,0 +1,312 @@
+"""
+Upload only the changed files of a folder to install_delta_deploy, run with `python -m hyperp.deploy`
+
+Usage:
+  hyperp.deploy <url> <folder> [--key=<key>]
+
+Options:
+  --key=<key>  The key given to install_delta_deploy
+"""
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import tempfile
+from uuid import uuid4
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from bottle import get, post, request, response, HTTPResponse
+
+from .utils import dumps
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def manifest(directory):
+    """
+    {relative path: sha256} of the files under `directory`, without the
+    .gz and .br variants hyperp.static writes next to the files
+    """
+    files = {}
+    for folder, _, names in os.walk(directory):
+        present = set(names)
+        for name in names:
+            root, extension = os.path.splitext(name)
+            if extension in (".gz", ".br") and root in present:
+                continue
+
+            path = os.path.join(folder, name)
+            files[os.path.relpath(path, directory).replace(os.sep, "/")] = _hash(path)
+    return files
+
+
+def _safe(relpath):
+    path = os.path.normpath(relpath).replace(os.sep, "/")
+    if os.path.isabs(path) or path in (".", "..") or path.startswith("../"):
+        raise HTTPResponse(status=400, body=f"Invalid path {relpath}")
+    return path
+
+
+def _extract(archive, target):
+    """
+    Writes the files of `archive` under `target` by their _safe name,
+    not extractall's own sanitizing, returns the names written
+    """
+    members = {_safe(info.filename): info for info in archive.infolist() if not info.is_dir()}
+    for relpath, info in members.items():
+        path = os.path.join(target, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with archive.open(info) as source, open(path, "wb") as destination:
+            shutil.copyfileobj(source, destination, CHUNK_SIZE)
+    return set(members)
+
+
+class Releases:
+    """
+    Keeps every deploy of `output` in its own folder under
+    `output`.releases, `output` is a symlink to the current one and is
+    switched atomically. Unchanged files are hard links to the previous
+    release, so a deploy only writes what changed. The newest `keep`
+    releases are kept, for requests still reading the old files.
+    """
+    def __init__(self, output, keep=3):
+        self.output = os.path.abspath(output)
+        self.root = f"{self.output}.releases"
+        self.keep = keep
+        os.makedirs(self.root, exist_ok=True)
+
+    def current(self):
+        """(release, folder), release is "" when `output` is not a release yet"""
+        if os.path.islink(self.output):
+            folder = os.path.realpath(self.output)
+            return os.path.basename(folder), folder
+        if os.path.isdir(self.output):
+            return "", self.output
+        return "", None
+
+    def manifest(self):
+        release, folder = self.current()
+        if release:
+            with open(os.path.join(self.root, f"{release}.json")) as fh:
+                return release, json.load(fh)
+        return release, manifest(folder) if folder else {}
+
+    def deploy(self, zip_path, deleted, base, replace=False):
+        """
+        Builds a release from the current one, the files in the zip at
+        `zip_path` (may be None) and without `deleted`. `base` must be the
+        release the client diffed against, else 409, None skips the check.
+        With `replace` the release only has the files in the zip.
+        """
+        with open(os.path.join(self.root, ".lock"), "w") as lock:
+            # One deploy at a time, across worker processes too
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            current, files = self.manifest()
+            if base is not None and base != current:
+                raise HTTPResponse(status=409, body="Deployed meanwhile, diff again")
+            if replace:
+                files = {}
+
+            _, folder = self.current()
+            release = f"{int(time.time() * 1000)}-{uuid4().hex[:8]}"
+            target = os.path.join(self.root, release)
+            # Built aside and renamed once complete, a failed deploy leaves nothing
+            building = tempfile.mkdtemp(dir=self.root, prefix=f".{release}-")
+
+            try:
+                changed = set()
+                if zip_path:
+                    with ZipFile(zip_path) as archive:
+                        changed = _extract(archive, building)
+                deleted = {_safe(name) for name in deleted}
+
+                for relpath in list(files):
+                    if relpath in deleted:
+                        del files[relpath]
+                    elif relpath not in changed:
+                        _link(os.path.join(folder, relpath), os.path.join(building, relpath))
+
+                for relpath in changed:
+                    files[relpath] = _hash(os.path.join(building, relpath))
+
+                with open(os.path.join(self.root, f"{release}.json"), "w") as fh:
+                    json.dump(files, fh)
+                os.rename(building, target)
+            except:  # noqa
+                shutil.rmtree(building, ignore_errors=True)
+                if os.path.exists(os.path.join(self.root, f"{release}.json")):
+                    os.remove(os.path.join(self.root, f"{release}.json"))
+                raise
+
+            self._switch(target, current)
+            self._trim(release)
+            return release
+
+    def _switch(self, target, current):
+        link = f"{self.output}.{uuid4().hex[:8]}"
+        os.symlink(target, link)
+
+        if os.path.isdir(self.output) and not os.path.islink(self.output):
+            # First delta deploy, the plain folder becomes a release
+            release = os.path.join(self.root, f"0-{uuid4().hex[:8]}")
+            if _exchange(link, self.output):
+                os.rename(link, release)
+                return
+            # Without renameat2 there is a moment without `output`
+            os.rename(self.output, release)
+
+        os.replace(link, self.output)
+
+    def _trim(self, current):
+        releases = sorted(
+            (entry.name for entry in os.scandir(self.root) if entry.is_dir()),
+            reverse=True,
+        )
+        for release in releases[self.keep:]:
+            if release == current:
+                continue
+            shutil.rmtree(os.path.join(self.root, release), ignore_errors=True)
+            if os.path.exists(os.path.join(self.root, f"{release}.json")):
+                os.remove(os.path.join(self.root, f"{release}.json"))
+
+
+def _exchange(first, second):
+    """Swaps two paths atomically with renameat2, False where it is not supported"""
+    import errno
+    import ctypes
+
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return False
+
+    AT_FDCWD, RENAME_EXCHANGE = -100, 2
+    if renameat2(AT_FDCWD, os.fsencode(first), AT_FDCWD, os.fsencode(second), RENAME_EXCHANGE) == 0:
+        return True
+
+    code = ctypes.get_errno()
+    if code in (errno.ENOSYS, errno.EINVAL):
+        return False
+    raise OSError(code, os.strerror(code), second)
+
+
+def _link(source, destination):
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        os.link(source, destination)
+    except OSError:
+        # Another file system, or links are not allowed
+        shutil.copy2(source, destination)
+
+
+def install_delta_deploy(path, output, key="", on_invalid_key=None, post_fun=None, max_size=None, keep=3):
+    """
+    Like install_deploy, but in two phases so only changed files are
+    uploaded, see `python -m hyperp.deploy`. GET `path`/manifest returns
+    the hashes of the deployed files, POST `path`/delta takes a zip of
+    the new and changed files and a JSON list of deleted ones. Serve
+    `output` through its path, it becomes a symlink to the release.
+    """
+    releases = Releases(output, keep)
+
+    def check():
+        if key and request.headers.get("Authorization", "") != f"apitoken {key}":
+            if on_invalid_key and callable(on_invalid_key):
+                on_invalid_key()
+            raise HTTPResponse(status=401, body="no access")
+
+    @get(f"{path}/manifest")
+    def deploy_manifest():
+        check()
+        release, files = releases.manifest()
+        response.content_type = "application/json"
+        return dumps(dict(release=release, files=files))
+
+    @post(f"{path}/delta")
+    def deploy_delta():
+        from .uploads import parse_multipart
+
+        check()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            zip_path = os.path.join(tmp_dir, "delta.zip")
+            fields, uploads = parse_multipart(
+                target=lambda name, filename: zip_path if name == "file" else None,
+                max_part_size=max_size,
+                max_total_size=max_size,
+            )
+            release = releases.deploy(
+                zip_path if "file" in uploads else None,
+                json.loads(fields.get("deleted") or "[]"),
+                fields.get("base", ""),
+            )
+
+        if post_fun and callable(post_fun):
+            post_fun()
+
+        response.content_type = "application/json"
+        return dumps(dict(release=release))
+
+    return releases
+
+
+def diff(local, remote):
+    """(changed, deleted) paths between two manifests"""
+    changed = [path for path, digest in local.items() if remote.get(path) != digest]
+    deleted = [path for path in remote if path not in local]
+    return changed, deleted
+
+
+def push(url, folder, key=""):
+    """Deploys `folder` to install_delta_deploy at `url`, returns (changed, deleted)"""
+    import requests
+
+    headers = {"Authorization": f"apitoken {key}"} if key else {}
+    res = requests.get(f"{url}/manifest", headers=headers, timeout=60)
+    res.raise_for_status()
+    remote = res.json()
+
+    changed, deleted = diff(manifest(folder), remote["files"])
+    if not changed and not deleted:
+        return changed, deleted
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        zip_path = os.path.join(tmp_dir, "delta.zip")
+        with ZipFile(zip_path, "w", ZIP_DEFLATED) as archive:
+            for relpath in changed:
+                archive.write(os.path.join(folder, relpath), relpath)
+
+        with open(zip_path, "rb") as fh:
+            res = requests.post(
+                f"{url}/delta",
+                headers=headers,
+                data=dict(base=remote["release"], deleted=json.dumps(deleted)),
+                files=dict(file=("delta.zip", fh, "application/zip")),
+                timeout=600,
+            )
+        res.raise_for_status()
+
+    return changed, deleted
+
+
+def main(argv=None):
+    from docopt import docopt
+
+    args = docopt(__doc__, argv=argv)
+    changed, deleted = push(args["<url>"].rstrip("/"), args["<folder>"], args["--key"] or "")
+    print(f"{len(changed)} changed, {len(deleted)} deleted")
+
+
+if __name__ == "__main__":
+    main()
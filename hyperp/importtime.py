@@ -0,0 +1,97 @@
+"""
+Checks how long `import hyperp.*` takes against a budget per module,
+so heavy dependencies creeping back into module level are caught:
+
+    python -m hyperp.importtime
+
+Exits with 1 if any module is over budget.
+"""
+import sys
+import subprocess
+
+
+# Milliseconds, cumulative including third party imports such as bottle.
+# Generous on purpose, these should only trip on real regressions.
+BUDGETS = {
+    "hyperp.utils": 50,
+    "hyperp.auth": 50,
+    "hyperp.config": 50,
+    "hyperp.mailers": 50,
+    "hyperp.messages": 50,
+    "hyperp.chatgpt": 50,
+    "hyperp.docs": 20,
+    "hyperp.django": 20,
+    "hyperp.ip": 20,
+    "hyperp.play": 50,
+    "hyperp.bottle": 150,
+    "hyperp.peewee": 150,
+    "hyperp.asgi": 200,
+    "hyperp.context": 20,
+    "hyperp.deadline": 20,
+    "hyperp.bench": 100,
+    "hyperp.tasks": 100,
+    "hyperp.outbox": 150,
+    "hyperp.log": 150,
+    "hyperp.profiling": 150,
+    "hyperp.serve": 150,
+    "hyperp.static": 150,
+    "hyperp.uploads": 150,
+    "hyperp.admission": 150,
+    "hyperp.deploy": 150,
+    "hyperp.memory": 150,
+}
+
+
+def measure(module, runs=3):
+    """
+    Returns the best cumulative import time of `module` in milliseconds,
+    each run is a fresh interpreter started with `-X importtime`.
+    """
+    best = None
+
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode != 0:
+            raise ImportError(f"Could not import {module}\n{proc.stderr}")
+
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:"):
+                continue
+            _, cumulative, name = line.split("|")
+            if name.strip() == module:
+                ms = int(cumulative) / 1000
+                best = ms if best is None else min(best, ms)
+
+    return best
+
+
+def check(budgets=None):
+    """
+    Returns a list of (module, ms, budget) for the modules over budget.
+    Modules whose optional dependencies are not installed are skipped.
+    """
+    over = []
+
+    for module, budget in (budgets or BUDGETS).items():
+        try:
+            ms = measure(module)
+        except ImportError:
+            print(f"{module}: skipped, not importable")
+            continue
+
+        print(f"{module}: {ms:.1f}ms (budget {budget}ms)")
+        if ms > budget:
+            over.append((module, ms, budget))
+
+    return over
+
+
+if __name__ == "__main__":
+    over = check()
+    for module, ms, budget in over:
+        print(f"Over budget: {module} took {ms:.1f}ms, budget is {budget}ms")
+    exit(1 if over else 0)
@@ -0,0 +1,226 @@
+import sys
+import copy
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from bottle import request, response
+
+from .bottle import get_ip
+
+
+logger = logging.getLogger("hyperp")
+
+# Attributes every LogRecord has, anything else came in through extra=
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line. Fields given with
+    `extra=` and the request context are included as top level keys.
+    """
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                data[key] = value
+
+        if record.exc_info:
+            data["traceback"] = self.formatException(record.exc_info)
+
+        return json.dumps(data, default=str)
+
+
+class _RequestContext(logging.Filter):
+    """Adds path, method, ip and time spent in the request so far"""
+    def filter(self, record):
+        try:
+            environ = request.environ
+        except (RuntimeError, AttributeError, KeyError):
+            return True
+
+        if "PATH_INFO" not in environ:
+            return True
+
+        record.path = request.path
+        record.method = request.method
+        record.ip = get_ip()
+
+        if "hyperp.start" in environ:
+            record.duration_ms = round((time.perf_counter() - environ["hyperp.start"]) * 1000, 2)
+
+        return True
+
+
+class _Sampler(logging.Filter):
+    """Keeps only a fraction of the records of noisy events, by `extra={"event": ...}`"""
+    def __init__(self, rates):
+        super().__init__()
+        self._rates = rates
+
+    def filter(self, record):
+        rate = self._rates.get(getattr(record, "event", None), 1)
+        return rate >= 1 or random.random() < rate
+
+
+class _QueueHandler(QueueHandler):
+    def __init__(self, queue, on_close):
+        super().__init__(queue)
+        self._on_close = on_close
+
+    # The default prepare() folds the traceback into msg,
+    # keep it as its own field instead
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            record.traceback = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        record.exc_text = None
+
+        return record
+
+    def close(self):
+        # logging.shutdown() also writes what is still queued
+        self._on_close()
+        super().close()
+
+
+class BatchStreamHandler(logging.Handler):
+    """
+    Writes formatted records to `stream` in batches, when `batch_size`
+    lines are waiting or at the latest every `flush_interval` seconds.
+    """
+    def __init__(self, stream=None, batch_size=100, flush_interval=1.0):
+        super().__init__()
+        self.stream = stream or sys.stdout
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.start()
+
+    def start(self):
+        """Starts the thread flushing every `flush_interval`, again in a forked child"""
+        self._lines = []
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def emit(self, record):
+        try:
+            line = self.format(record)
+        except:  # noqa
+            self.handleError(record)
+            return
+
+        with self.lock:
+            self._lines.append(line)
+            full = len(self._lines) >= self.batch_size
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            lines, self._lines = self._lines, []
+
+            if lines:
+                self.stream.write("\n".join(lines) + "\n")
+                self.stream.flush()
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stopped.set()
+        self.flush()
+        super().close()
+
+
+def install_logging(app=None, stream=None, level=logging.INFO, batch_size=100,
+                    flush_interval=1.0, sampling=None, log_requests=True):
+    """
+    Sends the `hyperp` logger, and so everything hyperp logs, as JSON
+    lines to `stream` (stdout by default). Records are put on a queue
+    and written by a background thread in batches, so request threads
+    never wait on stdout.
+
+    `sampling` maps an event name to the fraction of its records to keep,
+    e.g. {"request": 0.1, "unexpected_argument": 0.01}.
+
+    If `app` is given and `log_requests` is set, every request is logged
+    as a "request" event with its status and duration.
+
+    The threads are started again in the workers of `hyperp.serve`
+    when the app is preloaded.
+
+    Returns the QueueListener, it is stopped and flushed at exit.
+    """
+    records = queue.SimpleQueue()
+
+    output = BatchStreamHandler(stream, batch_size, flush_interval)
+    output.setFormatter(JSONFormatter())
+
+    listener = QueueListener(records, output)
+    listener.start()
+
+    def _stop():
+        if listener._thread is not None:
+            listener.stop()
+            output.close()
+
+    def _after_fork():
+        # Only the thread that forked lives on in the child, records
+        # still queued were copied from the parent, which writes them
+        listener.queue = queue_handler.queue = queue.SimpleQueue()
+        listener._thread = None
+        listener.start()
+        output.start()
+
+    queue_handler = _QueueHandler(records, _stop)
+    if sampling:
+        queue_handler.addFilter(_Sampler(sampling))
+    queue_handler.addFilter(_RequestContext())
+
+    from .serve import register_at_fork
+
+    atexit.register(_stop)
+    register_at_fork(after_in_child=_after_fork)
+
+    logger.addHandler(queue_handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+    if app is not None and log_requests:
+        _install_request_log(app)
+
+    return listener
+
+
+def _install_request_log(app):
+    @app.hook("before_request")
+    def _log_start():
+        request.environ["hyperp.start"] = time.perf_counter()
+
+    @app.hook("after_request")
+    def _log_request():
+        logger.info(
+            "request",
+            extra={"event": "request", "status": response.status_code},
+        )
+
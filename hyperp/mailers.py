@@ -1,7 +1,12 @@
-import requests
+import logging
 from traceback import format_exc
 from dataclasses import dataclass
 
+from .deadline import timeout
+
+
+logger = logging.getLogger("hyperp")
+
 
 def str_or_exception(d, key):
     if key in d:
@@ -25,6 +30,8 @@ class PostmarkMailer:
         self.domain = domain
 
     def send(self, mail: Mail):
+        import requests
+
         request_url = "https://api.postmarkapp.com/email"
         resp = requests.post(
             request_url,
@@ -40,6 +47,7 @@ class PostmarkMailer:
                 "TextBody": mail.txt_body,
                 "HtmlBody": mail.html_body,
             },
+            timeout=timeout(),
         )
 
         return resp.text if resp.status_code != 200 else None
@@ -52,6 +60,8 @@ class MailgunMailer:
         self.in_eu = in_eu
 
     def send(self, mail: Mail):
+        import requests
+
         if self.in_eu:
             request_url = f"https://api.eu.mailgun.net/v3/{self.domain}/messages"
         else:
@@ -65,6 +75,7 @@ class MailgunMailer:
                 "subject": mail.subject,
                 "text": mail.txt_body,
             },
+            timeout=timeout(),
         )
 
         return req.text if req.status_code != 200 else None
@@ -77,6 +88,8 @@ class TelegramMailer:
         self.on_error = on_error
 
     def send(self, mail: Mail):
+        import requests
+
         try:
             requests.post(
                 f"https://api.telegram.org/bot{self.key}/sendMessage",
@@ -88,10 +101,11 @@ class TelegramMailer:
                         f"body: {mail.txt_body}"
                     ),
                 ),
+                timeout=timeout(),
             )
             return True
         except:  # noqa
-            print(format_exc())
+            logger.exception("Telegram mail failed", extra={"event": "mail_failed"})
             self.log_error(format_exc())
             return False
 
@@ -116,6 +130,24 @@ class ConsoleMailer:
         return None
 
 
+class StubMailer:
+    """
+    Keeps sent mails in `sent` instead of sending them, for tests.
+    The first `fail` sends return an error.
+    """
+    def __init__(self, fail=0):
+        self.fail = fail
+        self.sent = []
+
+    def send(self, mail: Mail):
+        if self.fail > 0:
+            self.fail -= 1
+            return "Stub failure"
+
+        self.sent.append(mail)
+        return None
+
+
 def init_mailer(configs):
     mail_type = str_or_exception(configs, "type")
     if mail_type == "telegram":
@@ -136,8 +168,10 @@ def init_mailer(configs):
         )
     elif mail_type == "console":
         return ConsoleMailer()
+    elif mail_type == "stub":
+        return StubMailer(configs.get("fail", 0))
 
     raise Exception(
-        f"Invalid mail_type, expected telegram, mailgun, console "
+        f"Invalid mail_type, expected telegram, postmark, mailgun, console, stub "
         f"but got {mail_type}"
     )
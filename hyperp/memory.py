@@ -0,0 +1,226 @@
+import time
+import random
+import threading
+import tracemalloc
+from uuid import uuid4
+from functools import wraps
+from contextlib import contextmanager
+
+from bottle import request, response, HTTPResponse
+
+from .bottle import _check, _around
+from .utils import dumps, to_int
+
+
+# 3.9+, before it the peak of a request is not known and its
+# retained size is reported instead
+_reset_peak = getattr(tracemalloc, "reset_peak", None)
+
+# More frames make every allocation slower and every snapshot bigger
+MAX_FRAMES = 25
+# A snapshot holds a trace per allocation site, they add up fast
+MAX_SNAPSHOTS = 20
+
+_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def _site(stat):
+    frame = stat.traceback[0]
+    return dict(file=frame.filename, line=frame.lineno)
+
+
+def top(snapshot, group="lineno", limit=20):
+    """The `limit` biggest allocation sites, by "lineno" or "filename" """
+    return [
+        dict(_site(stat), size=stat.size, count=stat.count)
+        for stat in snapshot.statistics(group)[:limit]
+    ]
+
+
+def diff(old, new, group="lineno", limit=20):
+    """The `limit` sites that grew or shrank the most from `old` to `new`"""
+    return [
+        dict(_site(stat), size=stat.size, size_diff=stat.size_diff, count=stat.count, count_diff=stat.count_diff)
+        for stat in new.compare_to(old, group)[:limit]
+    ]
+
+
+class MemoryPlugin:
+    """
+    Bottle plugin sampling the peak memory allocated by a fraction
+    `sample` of the requests per route while tracemalloc is tracing.
+    One request is measured at a time, since the peak is per process,
+    and the figures include what other threads, or other requests on the
+    event loop of hyperp.asgi, allocate meanwhile.
+    When not tracing it costs one check per request.
+    """
+    name = "hyperp_memory"
+    api = 2
+
+    def __init__(self, sample=0.01, keep=5):
+        if not 1 <= keep <= MAX_SNAPSHOTS:
+            raise ValueError(f"keep must be between 1 and {MAX_SNAPSHOTS}")
+
+        self.sample = sample
+        self.keep = keep
+        self.routes = {}
+        self.snapshots = {}
+        self._measuring = threading.Lock()
+        # Guards routes and snapshots, read by the admin routes meanwhile
+        self._lock = threading.Lock()
+
+    def apply(self, callback, route):
+        name = f"{route.method} {route.rule}"
+
+        @wraps(callback)
+        def wrapper(*args, **kwargs):
+            if (not tracemalloc.is_tracing() or random.random() >= self.sample
+                    or not self._measuring.acquire(blocking=False)):
+                return callback(*args, **kwargs)
+
+            return _around(self._measure(name), lambda: callback(*args, **kwargs))
+
+        return wrapper
+
+    @contextmanager
+    def _measure(self, name):
+        try:
+            start = tracemalloc.get_traced_memory()[0]
+            if _reset_peak:
+                _reset_peak()
+            yield
+        finally:
+            # Stopped meanwhile, the counters restarted from zero
+            if tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                if not _reset_peak:
+                    peak = current
+                self._record(name, max(peak - start, 0), current - start)
+            self._measuring.release()
+
+    def _record(self, name, peak, retained):
+        with self._lock:
+            stats = self.routes.setdefault(name, dict(samples=0, peak_total=0, peak_max=0, retained_total=0))
+            stats["samples"] += 1
+            stats["peak_total"] += peak
+            stats["peak_max"] = max(stats["peak_max"], peak)
+            stats["retained_total"] += retained
+
+    def route_stats(self):
+        with self._lock:
+            return {
+                name: dict(
+                    samples=stats["samples"],
+                    peak_mean=stats["peak_total"] // stats["samples"],
+                    peak_max=stats["peak_max"],
+                    retained_mean=stats["retained_total"] // stats["samples"],
+                )
+                for name, stats in self.routes.items()
+            }
+
+    def take_snapshot(self):
+        snapshot_id = f"{int(time.time())}-{uuid4().hex[:6]}"
+        snapshot = tracemalloc.take_snapshot().filter_traces(_FILTERS)
+        with self._lock:
+            self.snapshots[snapshot_id] = snapshot
+            for old in list(self.snapshots)[:-self.keep]:
+                del self.snapshots[old]
+        return snapshot_id
+
+    def clear_snapshots(self):
+        with self._lock:
+            self.snapshots.clear()
+
+
+def install_memory_profiling(app, path="/_memory", checker=None, sample=0.01, keep=5):
+    """
+    Installs the MemoryPlugin on `app` and admin routes, guarded by the
+    required `checker` like `rpc` and `get` do, to find what makes a
+    worker grow:
+
+        POST path/start?frames=1   starts tracemalloc, 1 to MAX_FRAMES frames
+        POST path/snapshot         takes a snapshot, keeps the last `keep`
+        GET  path/top?id=..        biggest allocation sites of a snapshot
+        GET  path/diff?old=..&new=..  what grew between two snapshots
+        POST path/stop             stops tracemalloc and drops the snapshots
+        GET  path                  traced memory, snapshots and per-route peaks
+
+    `group=filename` groups by file instead of line, `limit` sets the
+    number of sites. Tracing slows the process down, stop it when done.
+    """
+    if checker is None:
+        raise ValueError("install_memory_profiling needs a checker for its admin routes")
+
+    plugin = MemoryPlugin(sample=sample, keep=keep)
+    app.install(plugin)
+
+    def check():
+        checked = _check(checker, None)
+        if checked:
+            raise HTTPResponse(status=401, body=dumps(dict(msg=checked)), headers={"Content-Type": "application/json"})
+        response.content_type = "application/json"
+
+    def snapshot(snapshot_id):
+        # Dropped meanwhile by a newer snapshot maybe, looked up once
+        found = plugin.snapshots.get(snapshot_id)
+        if found is None:
+            raise HTTPResponse(status=404, body=dumps(dict(msg="Snapshot Not Exist")), headers={"Content-Type": "application/json"})
+        return found
+
+    def options():
+        group = "filename" if request.query.get("group") == "filename" else "lineno"
+        return group, to_int(request.query.get("limit"), 20)
+
+    @app.get(path, skip=[plugin])
+    def memory_view():
+        check()
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        return dumps(dict(
+            tracing=tracemalloc.is_tracing(),
+            current=current,
+            peak=peak,
+            snapshots=list(plugin.snapshots.copy()),
+            routes=plugin.route_stats(),
+        ))
+
+    @app.post(f"{path}/start", skip=[plugin])
+    def memory_start():
+        check()
+        if not tracemalloc.is_tracing():
+            frames = to_int(request.query.get("frames"), 1)
+            tracemalloc.start(min(max(frames, 1), MAX_FRAMES))
+        return dumps(dict(tracing=True))
+
+    @app.post(f"{path}/stop", skip=[plugin])
+    def memory_stop():
+        check()
+        tracemalloc.stop()
+        plugin.clear_snapshots()
+        return dumps(dict(tracing=False))
+
+    @app.post(f"{path}/snapshot", skip=[plugin])
+    def memory_snapshot():
+        check()
+        if not tracemalloc.is_tracing():
+            raise HTTPResponse(status=400, body=dumps(dict(msg="Not tracing")), headers={"Content-Type": "application/json"})
+        return dumps(dict(id=plugin.take_snapshot()))
+
+    @app.get(f"{path}/top", skip=[plugin])
+    def memory_top():
+        check()
+        group, limit = options()
+        return dumps(top(snapshot(request.query.get("id")), group, limit))
+
+    @app.get(f"{path}/diff", skip=[plugin])
+    def memory_diff():
+        check()
+        group, limit = options()
+        old, new = snapshot(request.query.get("old")), snapshot(request.query.get("new"))
+        return dumps(diff(old, new, group, limit))
+
+    return plugin
@@ -1,5 +1,10 @@
+import logging
 from traceback import format_exc
-import requests
+
+from .deadline import timeout
+
+
+logger = logging.getLogger("hyperp")
 
 
 class Telegram:
@@ -9,16 +14,19 @@ class Telegram:
         self.on_error = on_error
 
     def __call__(self, msg):
+        import requests
+
         try:
             res = requests.post(
                 f"https://api.telegram.org/bot{self.key}/sendMessage",
                 json=dict(chat_id=self.chat, text=msg),
+                timeout=timeout(),
             )
             if res.status_code != 200:
                 self.log_error(res.text)
             return True
         except:  # noqa
-            print(format_exc())
+            logger.exception("Telegram message failed", extra={"event": "message_failed"})
             self.log_error(format_exc())
             return False
 
@@ -32,6 +40,24 @@ class Console:
         print(f'Message "{msg}"')
 
 
+class Stub:
+    """
+    Keeps messages in `sent` instead of sending them, for tests.
+    The first `fail` calls return False.
+    """
+    def __init__(self, fail=0):
+        self.fail = fail
+        self.sent = []
+
+    def __call__(self, msg):
+        if self.fail > 0:
+            self.fail -= 1
+            return False
+
+        self.sent.append(msg)
+        return True
+
+
 def init_message(settings):
     message_type = settings.get('type', '')
 
@@ -39,5 +65,7 @@ def init_message(settings):
         return Console()
     elif message_type == "telegram":
         return Telegram(settings['key'], settings['chat'])
+    elif message_type == "stub":
+        return Stub(settings.get('fail', 0))
     else:
         raise Exception("Invalid settings for messenger.")
@@ -0,0 +1,307 @@
+import json
+import time
+import random
+import logging
+import threading
+from uuid import uuid4
+from contextlib import contextmanager
+from dataclasses import asdict
+from datetime import datetime, timedelta
+from traceback import format_exc
+
+from peewee import Model, CharField, TextField, IntegerField, DateTimeField
+
+from .mailers import Mail
+
+
+logger = logging.getLogger("hyperp")
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+
+@contextmanager
+def _connected(database):
+    # Only closes a connection it opened, the caller's, e.g. the request's, stays open
+    opened = database.is_closed()
+    if opened:
+        database.connect()
+    try:
+        yield
+    finally:
+        if opened and not database.is_closed():
+            database.close()
+
+
+def _outbox_model(db, table):
+    class OutboxItem(Model):
+        kind = CharField()
+        key = CharField(unique=True)
+        payload = TextField()
+        status = CharField(default=PENDING, index=True)
+        attempts = IntegerField(default=0)
+        next_attempt_at = DateTimeField(default=datetime.utcnow, index=True)
+        claim = CharField(null=True)
+        claimed_at = DateTimeField(null=True)
+        created_at = DateTimeField(default=datetime.utcnow)
+        sent_at = DateTimeField(null=True)
+        last_error = TextField(null=True)
+
+        class Meta:
+            database = db
+            table_name = table
+
+    return OutboxItem
+
+
+def _failed(result):
+    # Mailers return None or True when sent, the messengers True or None,
+    # an error text or False means it was not delivered
+    return result is False or (isinstance(result, str) and result != "")
+
+
+class Outbox:
+    """
+    Transactional outbox for mails and messages.
+
+    `mail()` and `message()` only write a row, so call them inside the
+    same `database.atomic()` block as the change they belong to and
+    they are stored, or rolled back, together with it:
+
+        outbox = Outbox(db, mailer=init_mailer(...), messenger=init_message(...))
+
+        with db.atomic():
+            user.save()
+            outbox.mail(Mail(...), key=f"welcome-{user.id}")
+
+        outbox.start()  # or call outbox.deliver() from a cron
+
+    Delivery is done in batches by `workers` threads. Failed items are
+    retried with exponential backoff until `max_attempts`. The `key` is
+    an idempotency key, enqueuing the same key twice stores it once.
+    """
+    def __init__(self, database, mailer=None, messenger=None, table_name="hyperp_outbox",
+                 batch_size=50, max_attempts=10, backoff=2, max_backoff=3600, lease=300):
+        self.database = database
+        self.mailer = mailer
+        self.messenger = messenger
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+
+        self.Item = _outbox_model(database, table_name)
+        self.database.create_tables([self.Item], safe=True)
+
+        self._threads = []
+        self._started_with = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._forking = threading.Condition()
+        self._paused, self._active = False, 0
+        self._started = time.monotonic()
+        self._counts = {"sent": 0, "failed": 0, "retried": 0, "batches": 0}
+
+    def mail(self, mail: Mail, key=None):
+        return self._add("mail", asdict(mail), key)
+
+    def message(self, msg: str, key=None):
+        return self._add("message", {"msg": msg}, key)
+
+    def _add(self, kind, payload, key):
+        key = key or uuid4().hex
+        (self.Item
+            .insert(kind=kind, key=key, payload=json.dumps(payload))
+            .on_conflict_ignore()
+            .execute())
+        return key
+
+    def _claim(self):
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=self.lease)
+        Item = self.Item
+
+        claimable = (
+            ((Item.status == PENDING) & (Item.next_attempt_at <= now))
+            | ((Item.status == SENDING) & (Item.claimed_at < stale))
+        )
+        ids = [
+            row.id for row in
+            Item.select(Item.id).where(claimable).order_by(Item.id).limit(self.batch_size)
+        ]
+        if not ids:
+            return []
+
+        # Another worker may claim the same ids, only rows carrying
+        # our claim token are ours
+        claim = uuid4().hex
+        (Item
+            .update(status=SENDING, claim=claim, claimed_at=now)
+            .where(Item.id.in_(ids) & claimable)
+            .execute())
+
+        return list(Item.select().where(Item.claim == claim, Item.status == SENDING))
+
+    def _send(self, item):
+        payload = json.loads(item.payload)
+
+        if item.kind == "mail":
+            return self.mailer.send(Mail(**payload))
+
+        return self.messenger(payload["msg"])
+
+    def deliver(self):
+        """
+        Delivers one batch of due items, returns how many were sent
+        """
+        with _connected(self.database):
+            items = self._claim()
+            sent_ids = []
+
+            for item in items:
+                try:
+                    result = self._send(item)
+                    error = result if _failed(result) else None
+                except:  # noqa
+                    error = format_exc()
+
+                if error is None:
+                    sent_ids.append(item.id)
+                else:
+                    self._retry_later(item, error)
+
+            if sent_ids:
+                (self.Item
+                    .update(status=SENT, sent_at=datetime.utcnow(), claim=None)
+                    .where(self.Item.id.in_(sent_ids))
+                    .execute())
+
+        with self._lock:
+            self._counts["sent"] += len(sent_ids)
+            self._counts["batches"] += 1 if items else 0
+
+        return len(sent_ids)
+
+    def _retry_later(self, item, error):
+        attempts = item.attempts + 1
+        error = error if isinstance(error, str) else "Not delivered"
+
+        if attempts >= self.max_attempts:
+            status, next_attempt_at = FAILED, item.next_attempt_at
+            logger.error(
+                f"Outbox gave up on {item.kind} {item.key}",
+                extra={"event": "outbox_failed", "attempts": attempts, "traceback": error},
+            )
+            counter = "failed"
+        else:
+            delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+            delay *= 1 + random.random() / 10
+            status, next_attempt_at = PENDING, datetime.utcnow() + timedelta(seconds=delay)
+            counter = "retried"
+
+        (self.Item
+            .update(
+                status=status,
+                attempts=attempts,
+                next_attempt_at=next_attempt_at,
+                last_error=error,
+                claim=None,
+            )
+            .where(self.Item.id == item.id)
+            .execute())
+
+        with self._lock:
+            self._counts[counter] += 1
+
+    def start(self, workers=2, interval=1.0):
+        """
+        Starts `workers` threads delivering batches, each waits `interval`
+        seconds when there was nothing to deliver. The workers of
+        `hyperp.serve` start their own threads when the app is preloaded.
+        """
+        if self._started_with is None:
+            from .serve import register_at_fork
+
+            register_at_fork(
+                before=self._before_fork,
+                after_in_parent=self._resume,
+                after_in_child=self._after_fork,
+            )
+        self._started_with = (workers, interval)
+        self._stop.clear()
+
+        def work():
+            while not self._stop.is_set():
+                try:
+                    with self._batch():
+                        delivered = self.deliver()
+                    if delivered == 0:
+                        self._stop.wait(interval)
+                except:  # noqa
+                    logger.exception("Outbox worker failed", extra={"event": "outbox_worker"})
+                    self._stop.wait(interval)
+
+        for _ in range(workers):
+            thread = threading.Thread(target=work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @contextmanager
+    def _batch(self):
+        with self._forking:
+            self._forking.wait_for(lambda: not self._paused)
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._forking:
+                self._active -= 1
+                self._forking.notify_all()
+
+    def _before_fork(self):
+        # Forking in the middle of a batch would copy the database's
+        # locks taken into the child, wait for the running batches
+        with self._forking:
+            self._paused = True
+            self._forking.wait_for(lambda: self._active == 0)
+
+    def _resume(self):
+        with self._forking:
+            self._paused = False
+            self._forking.notify_all()
+
+    def _after_fork(self):
+        # Only the thread that forked lives on in the child
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._forking = threading.Condition()
+        self._paused, self._active = False, 0
+        if self._threads:
+            self._threads = []
+            self.start(*self._started_with)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def metrics(self):
+        """
+        Returns counters since start, the delivery rate and
+        how many items are waiting
+        """
+        with _connected(self.database):
+            pending = self.Item.select().where(self.Item.status.in_([PENDING, SENDING])).count()
+
+        with self._lock:
+            counts = dict(self._counts)
+
+        elapsed = time.monotonic() - self._started
+        counts["pending"] = pending
+        counts["sent_per_second"] = counts["sent"] / elapsed if elapsed > 0 else 0
+
+        return counts
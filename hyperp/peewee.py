@@ -1,10 +1,29 @@
 #!/usr/bin/env python3
+import io
 import os
+import re
+import csv
+import json
 import math
+import time
+import logging
+from datetime import datetime
+from collections import Counter
+from itertools import chain, islice
+from contextlib import contextmanager
 
 
+from peewee import JOIN, DateTimeField, TimestampField, SqliteDatabase, MySQLDatabase, PostgresqlDatabase
+from peewee import SelectBase, Node, _ConnectionState
 from playhouse.kv import KeyValue
 
+from .utils import dumps
+from .context import ContextLocal
+from .deadline import remaining, expired, on_exit, DeadlineExceeded
+
+
+logger = logging.getLogger("hyperp")
+
 
 def update_model(model, updates):
     for key, value in updates.items():
@@ -33,6 +52,272 @@ def migrate(database, migration_path):
             cursor = cursor.close()
 
 
+# WAL lets readers and the writer work at the same time, the rest trades
+# durability on power loss (not on crashes) and memory for speed
+SQLITE_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "busy_timeout": 5000,
+    "cache_size": -64000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "memory",
+    "foreign_keys": 1,
+}
+
+
+def sqlite_databases(path, **pragmas):
+    """
+    Returns (writer, reader) for the SQLite file at `path` with
+    SQLITE_PRAGMAS, `pragmas` override them. The reader opens its own
+    connections with query_only, so with `install_peewee(writer,
+    replicas=[reader])` reads of read-only routes never wait on the
+    writer's lock.
+    """
+    pragmas = dict(SQLITE_PRAGMAS, **pragmas)
+    writer = SqliteDatabase(path, pragmas=pragmas)
+    reader = SqliteDatabase(path, pragmas=dict(pragmas, query_only=1))
+    return writer, reader
+
+
+class _ContextConnectionState(ContextLocal, _ConnectionState):
+    pass
+
+
+def context_connections(database):
+    """
+    Keeps the connection of `database` per thread and per asyncio task,
+    so the requests hyperp.asgi awaits together do not share one.
+    """
+    if not database.thread_safe or isinstance(database._state, _ContextConnectionState):
+        return
+
+    state = _ContextConnectionState()
+    # The connection this thread has open stays its own
+    for name, value in vars(database._state).items():
+        setattr(state, name, value)
+    database._state = state
+
+
+def _is_write(sql):
+    return sql.lstrip()[:6].upper() != "SELECT"
+
+
+def route_reads(database):
+    """
+    Lets `read_replica` send the SELECTs on `database` to a replica.
+    Writes, and every read after a write or in a transaction, stay on
+    `database`, so a request reads its own writes.
+    """
+    if getattr(database, "_hyperp_routing", None) is not None:
+        return
+
+    routing = database._hyperp_routing = ContextLocal()
+    execute = database.execute
+    execute_sql = database.execute_sql
+
+    def routed_execute(query, **kwargs):
+        replica = getattr(routing, "replica", None)
+        if (replica is not None and not routing.wrote and isinstance(query, SelectBase)
+                and not database.in_transaction()):
+            return replica.execute(query, **kwargs)
+        return execute(query, **kwargs)
+
+    def routed_execute_sql(sql, *args, **kwargs):
+        if _is_write(sql):
+            routing.wrote = True
+        return execute_sql(sql, *args, **kwargs)
+
+    database.execute = routed_execute
+    database.execute_sql = routed_execute_sql
+
+
+@contextmanager
+def read_replica(database, replica):
+    """Reads on `database` in this block go to `replica`, see route_reads"""
+    routing = database._hyperp_routing
+    previous = getattr(routing, "replica", None), getattr(routing, "wrote", False)
+    routing.replica, routing.wrote = replica, False
+    opened = replica.is_closed()
+    try:
+        yield replica
+    finally:
+        routing.replica, routing.wrote = previous
+        if opened and not replica.is_closed():
+            replica.close()
+
+
+# The statement_timeout in ms sent per Postgres connection in this deadline
+_statement_timeouts = ContextLocal()
+
+
+def _stale(sent, left_ms):
+    # Sent again only when it would let a query run well past the deadline
+    return sent is None or sent - left_ms > max(50, left_ms // 10)
+
+
+def enforce_deadlines(database):
+    """
+    Bounds the queries on `database` run inside a hyperp.deadline by the
+    time left, with statement_timeout on Postgres and a progress handler
+    interrupting the query on SQLite. Raises DeadlineExceeded when the
+    time is up. Outside of a deadline the only cost is one lookup.
+    statement_timeout is set once per connection and deadline, and again
+    only when the time left has shrunk by more than 10%.
+    """
+    if getattr(database, "_hyperp_deadlines", False):
+        return
+
+    execute_sql = database.execute_sql
+    is_sqlite = isinstance(database, SqliteDatabase)
+    is_postgres = isinstance(database, PostgresqlDatabase)
+
+    def reset(conn):
+        _sent().pop(conn, None)
+        if not database.is_closed() and database.connection() is conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SET statement_timeout TO DEFAULT")
+
+    def release(conn):
+        if database.is_closed() or database.connection() is not conn:
+            return
+        if remaining() is None:
+            conn.set_progress_handler(None, 0)
+        else:
+            # Ended a nested deadline, the outer one still applies
+            on_exit(lambda: release(conn), key=(database, conn))
+
+    def bounded_execute_sql(sql, *args, **kwargs):
+        left = remaining()
+        if left is None:
+            return execute_sql(sql, *args, **kwargs)
+        if left <= 0:
+            raise DeadlineExceeded()
+
+        conn = database.connection()
+        if is_sqlite:
+            # Installed until the deadline block ends, so the rows fetched
+            # after execute_sql returned are bounded too. A true return
+            # value interrupts the query.
+            if on_exit(lambda: release(conn), key=(database, conn)):
+                conn.set_progress_handler(expired, 1000)
+        elif is_postgres:
+            sent = _sent()
+            left_ms = max(1, int(left * 1000))
+            if _stale(sent.get(conn), left_ms):
+                with conn.cursor() as cursor:
+                    cursor.execute(f"SET statement_timeout = {left_ms}")
+                sent[conn] = left_ms
+            on_exit(lambda: reset(conn), key=(database, conn))
+
+        try:
+            return execute_sql(sql, *args, **kwargs)
+        except Exception as e:
+            if remaining() <= 0:
+                raise DeadlineExceeded() from e
+            raise
+
+    database.execute_sql = bounded_execute_sql
+    database._hyperp_deadlines = True
+
+
+def _sent():
+    sent = getattr(_statement_timeouts, "sent", None)
+    if sent is None:
+        sent = _statement_timeouts.sent = {}
+    return sent
+
+
+_identity = ContextLocal()
+
+
+def track_identity(database):
+    """Clears the identity map on any write to `database`, saves and deletes included"""
+    if getattr(database, "_hyperp_identity", False):
+        return
+
+    execute_sql = database.execute_sql
+
+    def tracked_execute_sql(sql, *args, **kwargs):
+        if getattr(_identity, "objects", None) and _is_write(sql):
+            _identity.objects.clear()
+        return execute_sql(sql, *args, **kwargs)
+
+    database.execute_sql = tracked_execute_sql
+    database._hyperp_identity = True
+
+
+def start_identity_map():
+    _identity.objects = {}
+
+
+def stop_identity_map():
+    _identity.objects = None
+
+
+def _pk_lookup(query):
+    # Only a plain Model.select().where(Model.pk == value), a locking
+    # read, e.g. .for_update(), must reach the database
+    where = getattr(query, "_where", None)
+    if (where is None or getattr(where, "op", None) != "="
+            or where.lhs is not query.model._meta.primary_key or isinstance(where.rhs, Node)
+            or not query._is_default or query._joins or query._having is not None
+            or query._for_update or query._group_by or query._cte_list
+            or query._limit is not None or query._offset is not None or query._order_by):
+        return None
+    return query.model, _adapt(query.model, where.rhs)
+
+
+def _adapt(Model, value):
+    # So "1" from a form and 1 are the same object
+    try:
+        return Model._meta.primary_key.adapt(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def get_cached(query):
+    """
+    query.get(), but a primary key lookup is answered from the identity
+    map when the object was loaded before in this request.
+    """
+    objects = getattr(_identity, "objects", None)
+    key = _pk_lookup(query) if objects is not None else None
+    if key is None:
+        return query.get()
+
+    if key not in objects:
+        objects[key] = query.get()
+    return objects[key]
+
+
+def get_many(Model, ids):
+    """
+    Returns {pk: object} for the `ids` that exist, the ones not in the
+    identity map are fetched with IN queries, batched to the parameter limit.
+    """
+    objects = getattr(_identity, "objects", None)
+    ids = [_adapt(Model, pk) for pk in ids]
+    found = {}
+    missing = []
+
+    for pk in dict.fromkeys(ids):
+        if objects is not None and (Model, pk) in objects:
+            found[pk] = objects[(Model, pk)]
+        else:
+            missing.append(pk)
+
+    primary_key = Model._meta.primary_key
+    batch_size = _parameter_limit(Model._meta.database)
+    for start in range(0, len(missing), batch_size):
+        for obj in Model.select().where(primary_key.in_(missing[start:start + batch_size])):
+            pk = _adapt(Model, obj._pk)
+            found[pk] = obj
+            if objects is not None:
+                objects[(Model, pk)] = obj
+
+    return found
+
+
 def paginate(qs, paginate_by: int, page: int):
 
     objects = []
@@ -44,3 +329,483 @@ def paginate(qs, paginate_by: int, page: int):
         objects = qs.paginate(page, paginate_by)
         
     return objects, total_objects, total_pages 
+
+
+def _timestamp(value):
+    # Like CustomObjectEncoder, so the output is the same as through dumps
+    if value.__class__ is datetime:
+        return int(value.timestamp())
+    return value
+
+
+class Serializer:
+    """
+    Turns rows into dicts ready for `dumps`, much faster than model_to_dict.
+
+    The projection is compiled once per serializer: only `fields` (all
+    by default, less `exclude`) are selected, foreign keys in `related`
+    are joined and nested in the same query, and rows are read as tuples
+    so no model instances are created.
+
+        items = Serializer(Item, exclude=["secret"], related={"owner": ["id", "name"]})
+
+        @rpc("/items")
+        def list_items(page: int = 1):
+            return {"items": items(Item.select().where(...).paginate(page, 20))}
+
+    `related` maps a foreign key name to a list of field names, or to a
+    Serializer of the related model for deeper nesting. A missing related
+    row is None.
+    """
+    def __init__(self, model, fields=None, exclude=(), related=None):
+        self.model = model
+        self.fields = fields
+        self.exclude = set(exclude)
+        self.related = {
+            name: spec if isinstance(spec, Serializer) else Serializer(model._meta.fields[name].rel_model, spec)
+            for name, spec in (related or {}).items()
+        }
+        self._compiled = None
+
+    def _own_fields(self):
+        meta = self.model._meta
+        names = self.fields or [field.name for field in meta.sorted_fields]
+        return [meta.fields[name] for name in names if name not in self.exclude]
+
+    def _compile(self, source, columns, joins):
+        own = [field for field in self._own_fields() if field.name not in self.related]
+        start = len(columns)
+        columns.extend(getattr(source, field.name) for field in own)
+        keys = tuple(field.name for field in own)
+        converters = [
+            (field.name, _timestamp) for field in own
+            if isinstance(field, (DateTimeField, TimestampField))
+        ]
+
+        children = []
+        for name, nested in self.related.items():
+            foreign_key = self.model._meta.fields[name]
+            target = foreign_key.rel_model.alias()
+            joins.append((
+                source, target,
+                getattr(source, name) == getattr(target, foreign_key.rel_field.name),
+            ))
+            # The related key tells a missing row from one with null fields
+            columns.append(getattr(target, foreign_key.rel_field.name))
+            children.append((name, nested._compile(target, columns, joins), len(columns) - 1))
+
+        end = start + len(keys)
+
+        def build(row):
+            item = dict(zip(keys, row[start:end]))
+            for key, convert in converters:
+                value = item[key]
+                if value is not None:
+                    item[key] = convert(value)
+            for key, child, key_index in children:
+                item[key] = child(row) if row[key_index] is not None else None
+            return item
+
+        return build
+
+    def columns(self, prefix=""):
+        """The keys of the flattened dicts, owner.name for nested rows"""
+        names = [
+            prefix + field.name for field in self._own_fields()
+            if field.name not in self.related
+        ]
+        for name, nested in self.related.items():
+            names.extend(nested.columns(f"{prefix}{name}."))
+        return names
+
+    def compiled(self):
+        if self._compiled is None:
+            columns, joins = [], []
+            build = self._compile(self.model, columns, joins)
+            self._compiled = (columns, joins, build)
+        return self._compiled
+
+    def query(self, query=None):
+        """`query` (all rows by default) selecting only the projection, as tuples"""
+        columns, joins, _ = self.compiled()
+        query = (query if query is not None else self.model.select()).select(*columns)
+        for source, target, on in joins:
+            query = query.join_from(source, target, JOIN.LEFT_OUTER, on=on)
+        return query.tuples()
+
+    def iterate(self, query=None, chunk_size=1000):
+        """Yields the dicts without caching the rows, for large results"""
+        build = self.compiled()[2]
+        for row in _iterator(self.query(query), chunk_size):
+            yield build(row)
+
+    def __call__(self, query=None):
+        build = self.compiled()[2]
+        return [build(row) for row in self.query(query)]
+
+
+class QueryStats:
+    def __init__(self, slow_query_ms=None):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+        self.slow_query_ms = slow_query_ms
+
+    @property
+    def ms(self):
+        return self.seconds * 1000
+
+
+_local = ContextLocal()
+
+# Collapses the placeholders of IN lists so "IN (?, ?)" and "IN (?, ?, ?)" match
+_PLACEHOLDER_LIST = re.compile(r"(\?|%s)(\s*,\s*(\?|%s))+")
+
+
+def _normalize(sql):
+    return _PLACEHOLDER_LIST.sub("?", sql)
+
+
+def _request_route():
+    # The path and route of the bottle request running the query, if any
+    from bottle import request
+
+    try:
+        environ = request.environ
+    except (RuntimeError, AttributeError):
+        return {}
+
+    route = environ.get("bottle.route")
+    return dict(path=request.path, route=route.rule if route is not None else None)
+
+
+def instrument_queries(database):
+    """
+    Wraps `database.execute_sql` so statements run inside `count_queries()`
+    are counted and timed. Outside of it the only cost is one attribute lookup.
+    """
+    if getattr(database, "_hyperp_instrumented", False):
+        return
+
+    execute_sql = database.execute_sql
+
+    def instrumented_execute_sql(sql, *args, **kwargs):
+        stats = getattr(_local, "stats", None)
+        if stats is None:
+            return execute_sql(sql, *args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return execute_sql(sql, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            stats.count += 1
+            stats.seconds += elapsed
+            stats.statements[_normalize(sql)] += 1
+
+            if stats.slow_query_ms is not None and elapsed * 1000 >= stats.slow_query_ms:
+                logger.warning(
+                    "Slow query",
+                    extra={"event": "slow_query", "sql": sql, "query_ms": round(elapsed * 1000, 2),
+                           **_request_route()},
+                )
+
+    database.execute_sql = instrumented_execute_sql
+    database._hyperp_instrumented = True
+
+
+@contextmanager
+def count_queries(slow_query_ms=None):
+    """
+    Counts the queries of instrumented databases run by this thread:
+
+        with count_queries() as stats:
+            handler()
+        assert stats.count == 2
+    """
+    previous = getattr(_local, "stats", None)
+    _local.stats = QueryStats(slow_query_ms)
+    try:
+        yield _local.stats
+    finally:
+        _local.stats = previous
+
+
+def start_counting(slow_query_ms=None):
+    # For request hooks, where a with block does not fit
+    _local.stats = QueryStats(slow_query_ms)
+    return _local.stats
+
+
+def stop_counting():
+    stats = getattr(_local, "stats", None)
+    _local.stats = None
+    return stats
+
+
+def repeated_queries(stats, limit):
+    """Returns (sql, count) for the statements run more than `limit` times"""
+    return [(sql, count) for sql, count in stats.statements.items() if count > limit]
+
+
+def _iterator(query, chunk_size):
+    database = query.model._meta.database
+
+    # PostgresqlExtDatabase can stream from a named, server-side cursor
+    if hasattr(database, "_server_side_cursors"):
+        from playhouse.postgres_ext import ServerSide
+
+        # Named cursors only live inside a transaction
+        with database.atomic():
+            yield from ServerSide(query, array_size=chunk_size)
+    else:
+        yield from query.iterator()
+
+
+def _chunks(rows, chunk_size):
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk, None
+
+
+def iterate_keyset(serializer, query=None, key=None, chunk_size=1000, after=None):
+    """
+    Yields (items, after) for the serialized rows of `query` in chunks of
+    `chunk_size`, ordered by `key`, a unique field (the primary key by
+    default). Every chunk is its own `WHERE key > after` query, so memory
+    stays bounded however many rows there are, and passing the last
+    `after` back resumes where it stopped. The order and limit of
+    `query` are replaced.
+    """
+    model = serializer.model
+    key = key or model._meta.primary_key
+    query = query if query is not None else model.select()
+
+    while True:
+        chunk_query = query.where(key > after) if after is not None else query
+        items = list(serializer.iterate(chunk_query.order_by(key).limit(chunk_size), chunk_size))
+        if not items:
+            return
+
+        if key.name not in items[0]:
+            raise ValueError(f"The serializer must include the key {key.name}")
+
+        after = items[-1][key.name]
+        yield items, after
+
+        if len(items) < chunk_size:
+            return
+
+
+def _flatten(item, prefix=""):
+    # Nested related rows become owner.name columns
+    flat = {}
+    for name, value in item.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{name}."))
+        else:
+            flat[f"{prefix}{name}"] = value
+    return flat
+
+
+def export(query=None, serializer=None, format="ndjson", key=None, chunk_size=1000,
+           after=None, header=True):
+    """
+    Yields (data, after) with the rows of `query` encoded as "ndjson" or
+    "csv" bytes, one chunk at a time, see iterate_keyset. With `key=False`
+    the rows are read in one pass instead, on a server-side cursor where
+    the database has them, and `after` is always None.
+    """
+    serializer = serializer or Serializer(query.model)
+    database = serializer.model._meta.database
+
+    if key is False:
+        chunks = _chunks(serializer.iterate(query, chunk_size), chunk_size)
+    else:
+        chunks = iterate_keyset(serializer, query, key, chunk_size, after)
+
+    # A streamed response is read after the request closed its connection
+    opened = database.is_closed()
+    if opened:
+        database.connect()
+
+    try:
+        for items, checkpoint in chunks:
+            buffer = io.StringIO()
+
+            if format == "csv":
+                # A missing related row is an "owner" None, left as empty columns
+                writer = csv.DictWriter(buffer, serializer.columns(), extrasaction="ignore")
+                if header:
+                    writer.writeheader()
+                    header = False
+                writer.writerows(_flatten(item) for item in items)
+            else:
+                for item in items:
+                    buffer.write(dumps(item))
+                    buffer.write("\n")
+
+            yield buffer.getvalue().encode("utf-8"), checkpoint
+    finally:
+        if opened and not database.is_closed():
+            database.close()
+
+
+def export_response(query=None, serializer=None, format="ndjson", filename=None, **kwargs):
+    """
+    Streams the export from a route with constant memory:
+
+        @get("/items.csv")
+        def items_csv():
+            return export_response(Item.select(), format="csv", filename="items.csv")
+    """
+    from bottle import response
+
+    response.content_type = "text/csv; charset=UTF-8" if format == "csv" else "application/x-ndjson"
+    if filename:
+        response.set_header("Content-Disposition", f'attachment; filename="{filename}"')
+
+    return (data for data, _ in export(query, serializer, format, **kwargs))
+
+
+def export_file(path, query=None, serializer=None, format="ndjson", key=None, chunk_size=1000):
+    """
+    Writes the export to `path`, checkpointing the key and file size
+    to `path`.checkpoint after every chunk. Run it again after a crash and
+    it resumes from the last complete chunk. Returns the size written.
+    """
+    checkpoint_path = f"{path}.checkpoint"
+    after, offset = None, 0
+
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as fh:
+            state = json.load(fh)
+        after, offset = state["after"], state["offset"]
+
+    with open(path, "r+b" if offset else "wb") as fh:
+        # Drops whatever was written after the checkpoint
+        fh.seek(offset)
+        fh.truncate()
+
+        for data, checkpoint in export(query, serializer, format, key, chunk_size, after, header=not offset):
+            fh.write(data)
+            offset += len(data)
+
+            if checkpoint is not None:
+                fh.flush()
+                os.fsync(fh.fileno())
+                with open(f"{checkpoint_path}.tmp", "w") as state_fh:
+                    json.dump(dict(after=checkpoint, offset=offset), state_fh)
+                os.replace(f"{checkpoint_path}.tmp", checkpoint_path)
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    return offset
+
+
+def _parameter_limit(database):
+    if isinstance(database, SqliteDatabase):
+        import sqlite3
+        # SQLITE_MAX_VARIABLE_NUMBER was raised in 3.32
+        return 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+    # Postgres and MySQL take 65535
+    return 65535
+
+
+def _row(row):
+    # check_form returns pydantic models
+    if hasattr(row, "model_dump"):
+        return row.model_dump()
+    if hasattr(row, "dict") and not isinstance(row, dict):
+        return row.dict()
+    return row
+
+
+def bulk_upsert(Model, rows, conflict_target=None, update=None, ignore=False,
+                batch_size=None, max_batch_size=5000):
+    """
+    Inserts `rows`, dicts or the forms from check_form, in multi-row
+    INSERTs with one transaction per batch, instead of a round trip and
+    a commit per row. `rows` may be a generator, only one batch is held
+    at a time.
+
+    With `conflict_target` (field names of a unique index) existing rows
+    get the `update` columns (all other columns by default) from the new
+    row, or are left as they are with `ignore`. The batch size follows
+    from the database's bound parameter limit and the number of columns.
+
+    Returns dict(rows, batches, batch_size, seconds, batch_ms).
+    """
+    database = Model._meta.database
+    rows = (_row(row) for row in rows)
+    first = next(rows, None)
+    stats = dict(rows=0, batches=0, batch_size=0, seconds=0.0, batch_ms=[])
+    if first is None:
+        return stats
+
+    columns = list(first)
+    fields = Model._meta.fields
+    conflict = None
+    if ignore:
+        conflict = dict(action="IGNORE")
+    elif conflict_target:
+        updated = update or [name for name in columns if name not in conflict_target]
+        conflict = dict(preserve=[fields[name] for name in updated])
+        # MySQL updates on any unique key, ON DUPLICATE KEY UPDATE has no target
+        if not isinstance(database, MySQLDatabase):
+            conflict["conflict_target"] = [fields[name] for name in conflict_target]
+
+    # Defaults are filled in here, so every row has the same columns
+    defaults = [
+        field for field in Model._meta.sorted_fields
+        if field.name not in columns and field.default is not None
+    ]
+    insert_fields = [fields[name] for name in columns] + defaults
+    converters = [field.db_value for field in insert_fields]
+
+    if batch_size is None:
+        batch_size = max(1, min(max_batch_size, _parameter_limit(database) // len(insert_fields)))
+    stats["batch_size"] = batch_size
+    statements = {}
+
+    def statement(count):
+        # Rendered by peewee once per batch size, the full batches and the
+        # last one, rendering thousands of rows costs more than the insert
+        if count not in statements:
+            query = Model.insert_many([[None] * len(insert_fields)] * count, fields=insert_fields)
+            if conflict is not None:
+                query = query.on_conflict(**conflict)
+            statements[count] = database.get_sql_context().sql(query).query()[0]
+        return statements[count]
+
+    rows = chain([first], rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+
+        start = time.perf_counter()
+        params = []
+        for row in batch:
+            values = [row[name] for name in columns]
+            values.extend(field.default() if callable(field.default) else field.default for field in defaults)
+            params.extend(convert(value) for convert, value in zip(converters, values))
+
+        with database.atomic():
+            database.execute_sql(statement(len(batch)), params)
+        elapsed = time.perf_counter() - start
+
+        stats["rows"] += len(batch)
+        stats["batches"] += 1
+        stats["seconds"] += elapsed
+        stats["batch_ms"].append(round(elapsed * 1000, 2))
+        logger.debug(
+            "Bulk upsert batch",
+            extra={"event": "bulk_batch", "table": Model._meta.table_name,
+                   "rows": len(batch), "batch_ms": round(elapsed * 1000, 2)},
+        )
+
+    return stats
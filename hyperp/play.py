@@ -1,5 +1,4 @@
 import json
-import requests
 
 
 def _format_json_value(value):
@@ -0,0 +1,160 @@
+import os
+import re
+import time
+import random
+import cProfile
+import threading
+from uuid import uuid4
+from functools import wraps
+from contextlib import contextmanager
+
+from bottle import request, response, static_file, HTTPResponse
+
+from .auth import make_signed_token, read_signed_token
+from .bottle import _check, _around
+from .utils import mkdir, dumps
+
+
+PROFILE_HEADER = "X-Hyperp-Profile"
+_PROFILE_NAME = re.compile(r"(\d+)-(.+)-[0-9a-f]{8}\.prof")
+
+# From Python 3.12 only one profiler can be active per process
+_profiling = threading.Lock()
+
+
+def make_profile_token(secret):
+    """Token for the X-Hyperp-Profile header, profiles any route when sent"""
+    return make_signed_token("profile", secret)
+
+
+class ProfilePlugin:
+    """
+    Bottle plugin running cProfile around the routes that asked for it
+    and writing pstats files to `directory`, keeping the newest `keep`.
+
+    A route is profiled when it was declared with `profile=True`, with
+    `profile=0.01` for a sampled fraction of its requests, or when the
+    request has a valid X-Hyperp-Profile header and `secret` is set.
+    Routes that can not be profiled are left unwrapped, so they cost nothing.
+    One request is profiled at a time, the others run unprofiled. An async
+    handler under hyperp.asgi is profiled until awaited, with whatever
+    else the event loop runs meanwhile.
+    """
+    name = "hyperp_profile"
+    api = 2
+
+    def __init__(self, directory, secret=None, keep=50, max_age=300):
+        self.directory = directory
+        self.secret = secret
+        self.keep = keep
+        self.max_age = max_age
+        mkdir(directory)
+
+    def apply(self, callback, route):
+        rate = route.config.get("profile")
+        if not rate and not self.secret:
+            return callback
+
+        @wraps(callback)
+        def wrapper(*args, **kwargs):
+            if not self._wanted(rate) or not _profiling.acquire(blocking=False):
+                return callback(*args, **kwargs)
+
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiling tool is active, run it unprofiled
+                _profiling.release()
+                return callback(*args, **kwargs)
+
+            return _around(self._profiled(profiler, route), lambda: callback(*args, **kwargs))
+
+        return wrapper
+
+    @contextmanager
+    def _profiled(self, profiler, route):
+        try:
+            yield
+        finally:
+            profiler.disable()
+            _profiling.release()
+            self._save(profiler, route)
+
+    def _wanted(self, rate):
+        if rate is True or (rate and random.random() < rate):
+            return True
+
+        token = request.get_header(PROFILE_HEADER)
+        if token and self.secret:
+            return read_signed_token(token, self.secret, self.max_age) is not None
+
+        return False
+
+    def _save(self, profiler, route):
+        name = getattr(route.callback, "__name__", "route")
+        path = os.path.join(self.directory, f"{int(time.time() * 1000)}-{name}-{uuid4().hex[:8]}.prof")
+        profiler.dump_stats(path)
+        self._trim()
+
+    def _trim(self):
+        files = sorted(
+            (entry for entry in os.scandir(self.directory) if _PROFILE_NAME.fullmatch(entry.name)),
+            key=lambda entry: entry.name,
+        )
+        for entry in files[:-self.keep]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def profiles(self):
+        result = []
+
+        for entry in sorted(os.scandir(self.directory), key=lambda e: e.name, reverse=True):
+            # Only the files _save wrote, others may share the directory
+            match = _PROFILE_NAME.fullmatch(entry.name)
+            if match is None:
+                continue
+
+            created, route = match.groups()
+            result.append(dict(
+                name=entry.name,
+                route=route,
+                created=int(created) / 1000,
+                size=entry.stat().st_size,
+            ))
+
+        return result
+
+
+def install_profiling(app, directory, path="/_profiles", checker=None, secret=None, keep=50):
+    """
+    Installs the ProfilePlugin on `app` and admin routes to list the
+    profiles at `path` and download one at `path/<name>`, open it with
+    `python -m pstats` or snakeviz. The admin routes use `checker`
+    like `rpc` and `get` do, it is required since profiles show the code.
+    """
+    if checker is None:
+        raise ValueError("install_profiling needs a checker for its admin routes")
+
+    plugin = ProfilePlugin(directory, secret=secret, keep=keep)
+    app.install(plugin)
+
+    def check():
+        checked = _check(checker, None)
+        if checked:
+            raise HTTPResponse(status=401, body=dumps(dict(msg=checked)), headers={"Content-Type": "application/json"})
+
+    @app.get(path, skip=[plugin])
+    def profiles_view():
+        check()
+        response.content_type = "application/json"
+        return dumps(plugin.profiles())
+
+    @app.get(f"{path}/<name>", skip=[plugin])
+    def profile_download(name):
+        check()
+        return static_file(name, root=directory, download=name)
+
+    return plugin
@@ -0,0 +1,318 @@
+"""
+Multi-process server for hyperp apps, run with `python -m hyperp.serve`
+
+Usage:
+  hyperp.serve <app> [--host=<host>] [--port=<port>] [--workers=<n>] [--threads=<n>] [--db=<db>] [--migrations=<path>] [--no-preload]
+
+Options:
+  --host=<host>        Interface to listen on [default: 127.0.0.1]
+  --port=<port>        Port to listen on [default: 8080]
+  --workers=<n>        Worker processes [default: 4]
+  --threads=<n>        Threads per worker [default: 8]
+  --db=<db>            peewee database as module:attribute, migrated once before forking
+  --migrations=<path>  Folder with the .sql migrations for --db
+  --no-preload         Import the app in each worker, so a reload picks up new code
+"""
+import os
+import sys
+import time
+import select
+import signal
+import socket
+import logging
+import importlib
+import threading
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+
+logger = logging.getLogger("hyperp")
+
+MASTER_PID = "HYPERP_MASTER_PID"
+
+_at_fork = []
+
+
+def load(target):
+    """Imports "module:attribute", or returns target if it is not a string"""
+    if not isinstance(target, str):
+        return target
+
+    module, _, attribute = target.partition(":")
+    return getattr(importlib.import_module(module), attribute or "app")
+
+
+def reload():
+    """
+    Asks the master to replace its workers one by one, e.g. as
+    `install_deploy(..., post_fun=reload)`. Returns False when not
+    running under hyperp.serve.
+    """
+    pid = os.environ.get(MASTER_PID)
+    if not pid:
+        return False
+
+    os.kill(int(pid), signal.SIGHUP)
+    return True
+
+
+def register_at_fork(before=None, after_in_parent=None, after_in_child=None):
+    """
+    Like os.register_at_fork, but only called around the forks of the
+    workers, e.g. to start threads again in a preloaded worker. Other
+    forks, such as those of a ProcessPoolExecutor, do not call them.
+    """
+    _at_fork.append((before, after_in_parent, after_in_child))
+
+
+def _fork():
+    # Same order as os.register_at_fork, `before` last registered first
+    for before, _, _ in reversed(_at_fork):
+        if before:
+            before()
+
+    pid = os.fork()
+    for _, after_in_parent, after_in_child in _at_fork:
+        callback = after_in_child if pid == 0 else after_in_parent
+        if callback:
+            callback()
+    return pid
+
+
+class _Handler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        # Requests are logged by hyperp.log when installed
+        pass
+
+
+class _Server(WSGIServer):
+    """
+    WSGI server on an already listening socket, requests run in a thread
+    pool. A connection is only accepted while a thread is free, so a busy
+    worker leaves it to an idle one.
+    """
+    def __init__(self, sock, app, threads):
+        socketserver.BaseServer.__init__(self, sock.getsockname(), _Handler)
+        self.socket = sock
+        host, port = sock.getsockname()[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+        self.setup_environ()
+        self.set_app(app)
+        self._pool = ThreadPoolExecutor(max_workers=threads)
+        self._slots = threading.Semaphore(threads)
+
+    def get_request(self):
+        # serve_forever skips the OSError and polls again, it checks for shutdown meanwhile
+        if not self._slots.acquire(timeout=0.5):
+            raise BlockingIOError()
+
+        # The listening socket is shared and non-blocking, workers race for it
+        try:
+            request, client_address = self.socket.accept()
+        except:  # noqa
+            self._slots.release()
+            raise
+
+        request.setblocking(True)
+        return request, client_address
+
+    def process_request(self, request, client_address):
+        try:
+            self._pool.submit(self._process, request, client_address)
+        except:  # noqa
+            self._slots.release()
+            raise
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        # The socket belongs to the master
+        self._pool.shutdown(wait=True)
+
+
+def _worker(sock, app, threads, ready):
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    server = _Server(sock, load(app), threads)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever, so it can not run on this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+
+    os.write(ready, b"1")
+    os.close(ready)
+
+    server.serve_forever()
+    server.server_close()
+
+
+class Master:
+    def __init__(self, app, host="127.0.0.1", port=8080, workers=4, threads=8,
+                 preload=True, ready_timeout=30):
+        self.app = load(app) if preload else app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.ready_timeout = ready_timeout
+        self.children = set()
+        self._reload = False
+        self._stop = False
+
+    def _spawn(self):
+        read, write = os.pipe()
+        pid = _fork()
+
+        if pid == 0:
+            os.close(read)
+            code = 0
+            try:
+                _worker(self.socket, self.app, self.threads, write)
+            except:  # noqa
+                logger.exception("Worker failed", extra={"event": "worker_failed"})
+                code = 1
+            finally:
+                # os._exit skips atexit, write the queued log records first
+                logging.shutdown()
+                os._exit(code)
+
+        os.close(write)
+        self.children.add(pid)
+
+        ready, _, _ = select.select([read], [], [], self.ready_timeout)
+        ok = bool(ready) and os.read(read, 1) == b"1"
+        os.close(read)
+        return pid, ok
+
+    def _stop_child(self, pid, timeout=30):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            done, _ = os.waitpid(pid, os.WNOHANG)
+            if done:
+                break
+            time.sleep(0.05)
+        else:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+        self.children.discard(pid)
+
+    def _rolling_restart(self):
+        for old in list(self.children):
+            pid, ok = self._spawn()
+            if not ok:
+                # Keep the old workers serving, the new code does not start
+                logger.error("New worker did not start, reload aborted", extra={"event": "reload_failed"})
+                self._stop_child(pid, timeout=1)
+                return
+            self._stop_child(old)
+
+        logger.info("Workers reloaded", extra={"event": "reloaded"})
+
+    def _reap(self):
+        # Replace workers that died on their own
+        while self.children:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                return
+            if pid in self.children:
+                self.children.discard(pid)
+                if not self._stop:
+                    logger.error("Worker died, restarting", extra={"event": "worker_died"})
+                    self._spawn()
+
+    def run(self):
+        self.socket = socket.create_server((self.host, self.port), backlog=2048, reuse_port=False)
+        self.socket.setblocking(False)
+        os.environ[MASTER_PID] = str(os.getpid())
+
+        def on_hup(signum, frame):
+            self._reload = True
+
+        def on_stop(signum, frame):
+            self._stop = True
+
+        signal.signal(signal.SIGHUP, on_hup)
+        signal.signal(signal.SIGTERM, on_stop)
+        signal.signal(signal.SIGINT, on_stop)
+
+        for _ in range(self.workers):
+            self._spawn()
+
+        while not self._stop:
+            if self._reload:
+                self._reload = False
+                self._rolling_restart()
+            self._reap()
+            time.sleep(0.2)
+
+        for pid in list(self.children):
+            self._stop_child(pid)
+        self.socket.close()
+
+
+def serve(app, host="127.0.0.1", port=8080, workers=4, threads=8,
+          db=None, migrations=None, preload=True):
+    """
+    Serves `app` (a WSGI app or "module:attribute") with `workers`
+    processes of `threads` threads sharing one listening socket.
+
+    `db` is migrated with `migrations` once before the workers are forked.
+    SIGHUP, or `reload()` from a worker, replaces the workers one at a
+    time with no downtime. With `preload` the app is imported once in the
+    master and shared by the workers, without it each worker imports the
+    app so a reload runs new code. Threads the app starts at import are
+    not copied into the workers, install_logging, Outbox.start and Tasks
+    start theirs again after the fork, others can use register_at_fork.
+    """
+    if db is not None and migrations:
+        from .peewee import migrate
+
+        db = load(db)
+        migrate(db, migrations)
+        # Workers must open their own connections
+        db.close()
+
+    Master(app, host, port, workers, threads, preload).run()
+
+
+def main(argv=None):
+    from docopt import docopt
+
+    args = docopt(__doc__, argv=argv)
+    sys.path.insert(0, os.getcwd())
+
+    serve(
+        args["<app>"],
+        host=args["--host"],
+        port=int(args["--port"]),
+        workers=int(args["--workers"]),
+        threads=int(args["--threads"]),
+        db=args["--db"],
+        migrations=args["--migrations"],
+        preload=not args["--no-preload"],
+    )
+
+
+if __name__ == "__main__":
+    # Through the module, what the app registers with register_at_fork
+    # goes to hyperp.serve, not to this __main__ copy
+    from hyperp.serve import main as serve_main
+    serve_main()
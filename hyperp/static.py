@@ -0,0 +1,259 @@
+import os
+import re
+import gzip
+import hashlib
+import tempfile
+import mimetypes
+import threading
+
+from bottle import request, response, HTTPResponse
+
+from .bottle import cache
+
+
+# Names like index-BwXq3J2k.js or main.3f2a1b9c.css, a hex or base64 run
+# of at least 8 characters with a digit and a letter right before the extension
+_HASHED = re.compile(r"[.-](?=[A-Za-z]*\d)(?=\d*[A-Za-z])[A-Za-z0-9]{8,}\.\w+$")
+_ETAG_SUFFIXES = {"br": "-br", "gzip": "-gz"}
+_COMPRESSIBLE = (
+    "text/", "application/javascript", "application/json", "application/xml",
+    "image/svg+xml", "application/wasm", "application/manifest+json",
+)
+_MIN_COMPRESS_SIZE = 1024
+_CHUNK_SIZE = 64 * 1024
+
+
+def _brotli():
+    try:
+        import brotli
+        return brotli
+    except ImportError:
+        return None
+
+
+def _etag(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def _accepted(header):
+    """The content codings an Accept-Encoding header allows, with q > 0"""
+    codings = {}
+    for part in header.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding] = q
+
+    wildcard = codings.pop("*", 0) > 0
+    return lambda coding: codings[coding] > 0 if coding in codings else wildcard
+
+
+def _strong(tag):
+    # Weak comparison, W/"x" matches "x"
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def _precompress(path, content_type, etag):
+    """Writes .gz and, when brotli is installed, .br next to the file if they are smaller"""
+    variants = {}
+    size = os.path.getsize(path)
+
+    if size < _MIN_COMPRESS_SIZE or not content_type.startswith(_COMPRESSIBLE):
+        return variants
+
+    with open(path, "rb") as fh:
+        data = fh.read()
+
+    compressors = [("gzip", ".gz", lambda d: gzip.compress(d, 9, mtime=0))]
+    brotli = _brotli()
+    if brotli:
+        compressors.insert(0, ("br", ".br", brotli.compress))
+
+    for encoding, suffix, compress in compressors:
+        compressed = compress(data)
+        if len(compressed) >= size:
+            continue
+        _replace(path + suffix, compressed)
+        # A strong ETag is per representation, the encoded bytes differ
+        variants[encoding] = (path + suffix, len(compressed), f'{etag[:-1]}{_ETAG_SUFFIXES[encoding]}"')
+
+    return variants
+
+
+def _replace(path, data):
+    # Swapped in whole, a request reading the old file keeps it, and a
+    # hard link shared with an older release is not written through
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=os.path.splitext(path)[1])
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+    except:  # noqa
+        os.remove(tmp)
+        raise
+
+
+def _unchanged(entry, path, stat):
+    return (entry is not None and entry["path"] == path
+            and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size)
+
+
+class StaticFiles:
+    """
+    In-memory index of the files under `root` with their ETag, content type
+    and precompressed variants. Call `reindex()` after the files change,
+    e.g. as the `post_fun` of `install_deploy`. Files with the same mtime
+    and size are not hashed again, nor compressed again while the hash
+    and the variants on disk are the same.
+    """
+    def __init__(self, root, max_age_days=365):
+        self.root = os.path.abspath(root)
+        self.max_age_days = max_age_days
+        self.files = {}
+        self._lock = threading.Lock()
+        self.reindex()
+
+    def reindex(self):
+        previous = self.files
+        files = {}
+
+        for folder, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith((".gz", ".br")):
+                    continue
+
+                path = os.path.join(folder, name)
+                relpath = os.path.relpath(path, self.root).replace(os.sep, "/")
+                content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                if content_type.startswith("text/") or content_type == "application/javascript":
+                    content_type += "; charset=UTF-8"
+
+                stat = os.stat(path)
+                entry = previous.get(relpath)
+                etag = entry["etag"] if _unchanged(entry, path, stat) else _etag(path)
+
+                if (entry is not None and entry["etag"] == etag
+                        and all(os.path.exists(variant[0]) for variant in entry["variants"].values())):
+                    variants = entry["variants"]
+                else:
+                    variants = _precompress(path, content_type, etag)
+
+                files[relpath] = dict(
+                    path=path,
+                    size=stat.st_size,
+                    mtime=stat.st_mtime_ns,
+                    etag=etag,
+                    content_type=content_type,
+                    variants=variants,
+                    immutable=bool(_HASHED.search(name)),
+                )
+
+        with self._lock:
+            self.files = files
+
+    def __call__(self, filepath):
+        entry = self.files.get(filepath)
+        if entry is None:
+            raise HTTPResponse(status=404, body="Not found")
+
+        if entry["immutable"]:
+            cache(days=self.max_age_days, immutable=True)
+        else:
+            # Revalidated every time, answered with 304 while unchanged
+            response.set_header("Cache-Control", "no-cache")
+
+        headers = {
+            "Content-Type": entry["content_type"],
+            "Accept-Ranges": "bytes",
+            "Cache-Control": response.get_header("Cache-Control"),
+        }
+        if entry["variants"]:
+            headers["Vary"] = "Accept-Encoding"
+
+        # Ranges are served from the uncompressed file
+        range_header = request.get_header("Range")
+        path, size, etag = entry["path"], entry["size"], entry["etag"]
+        if entry["variants"] and not range_header:
+            accepted = _accepted(request.get_header("Accept-Encoding", ""))
+            for encoding in ("br", "gzip"):
+                if encoding in entry["variants"] and accepted(encoding):
+                    path, size, etag = entry["variants"][encoding]
+                    headers["Content-Encoding"] = encoding
+                    break
+        headers["ETag"] = etag
+
+        if_none_match = request.get_header("If-None-Match", "")
+        tags = {_strong(tag.strip()) for tag in if_none_match.split(",")}
+        if etag in tags or "*" in tags:
+            headers.pop("Content-Encoding", None)
+            return HTTPResponse(status=304, headers=headers)
+
+        if range_header:
+            return self._range(entry, range_header, headers)
+
+        headers["Content-Length"] = str(size)
+        # A file object lets the server use wsgi.file_wrapper, i.e. sendfile
+        body = open(path, "rb") if request.method != "HEAD" else ""
+        return HTTPResponse(body, status=200, headers=headers)
+
+    def _range(self, entry, range_header, headers):
+        # Only single ranges on the uncompressed file
+        size = entry["size"]
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+        if not match or match.groups() == ("", ""):
+            return HTTPResponse(status=416, headers={"Content-Range": f"bytes */{size}"})
+
+        first, last = match.groups()
+        if first == "":
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start, end = int(first), min(size - 1, int(last)) if last else size - 1
+
+        if start > end or start >= size:
+            return HTTPResponse(status=416, headers={"Content-Range": f"bytes */{size}"})
+
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        body = _read_range(entry["path"], start, end - start + 1) if request.method != "HEAD" else ""
+        return HTTPResponse(body, status=206, headers=headers)
+
+
+def _read_range(path, offset, length):
+    with open(path, "rb") as fh:
+        fh.seek(offset)
+        while length > 0:
+            chunk = fh.read(min(_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_static(app, path, root, max_age_days=365):
+    """
+    Serves the files under `root` at `path/<filepath>` with ETags,
+    If-None-Match, Range, precompressed gzip/brotli variants and
+    immutable caching for hashed file names. Returns the StaticFiles
+    index, call its `reindex()` after a deploy.
+    """
+    static = StaticFiles(root, max_age_days)
+
+    @app.get(f"{path.rstrip('/')}/<filepath:path>")
+    def static_view(filepath):
+        return static(filepath)
+
+    return static
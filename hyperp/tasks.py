@@ -0,0 +1,201 @@
+import json
+import time
+import logging
+import threading
+from uuid import uuid4
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from .utils import dumps
+
+
+logger = logging.getLogger("hyperp")
+
+_tasks = None
+
+
+class Tasks:
+    """
+    Runs callables on a thread pool, or a process pool for CPU heavy work
+    with `processes`, and keeps their state in the peewee KeyValue `kv`
+    under "task:<id>" as JSON, so any worker can answer a poll.
+
+    Results must be JSON serializable and at most `max_result_size`
+    bytes, a task and its result are dropped `ttl` seconds after it was
+    submitted.
+    """
+    def __init__(self, kv, workers=4, processes=False, max_result_size=64 * 1024, ttl=3600):
+        self.kv = kv
+        self.workers = workers
+        self.processes = processes
+        self.max_result_size = max_result_size
+        self.ttl = ttl
+        self.futures = {}
+        self._pool = None
+        self._lock = threading.Lock()
+        self._cleaned = time.time()
+
+        from .serve import register_at_fork
+        register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # A pool created before the fork has no threads in the child
+        self._pool = None
+        self._lock = threading.Lock()
+        self.futures = {}
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                executor = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+                self._pool = executor(max_workers=self.workers)
+            return self._pool
+
+    def _key(self, task_id):
+        return f"task:{task_id}"
+
+    @contextmanager
+    def _connection(self):
+        # Closes the connection opened for the block, on a pool or sweep thread
+        database = self.kv.model._meta.database
+        opened = database.is_closed()
+        try:
+            yield
+        finally:
+            if opened and not database.is_closed():
+                database.close()
+
+    def _save(self, task_id, state):
+        # Runs on a pool thread, or inline in the request when already done
+        with self._connection():
+            self.kv[self._key(task_id)] = dumps(state)
+
+    def submit(self, func, *args, **kwargs):
+        """Queues func(*args, **kwargs), returns the task id to poll"""
+        task_id = uuid4().hex
+        now = time.time()
+        state = dict(id=task_id, name=func.__name__, status="pending", created=now, expires=now + self.ttl)
+        self.kv[self._key(task_id)] = dumps(state)
+
+        future = self.pool.submit(func, *args, **kwargs)
+        self.futures[task_id] = future
+        future.add_done_callback(lambda future: self._finished(task_id, state, future))
+
+        with self._lock:
+            sweep = now - self._cleaned > 60
+            if sweep:
+                self._cleaned = now
+        if sweep:
+            # It reads every task row, the request does not wait for it
+            threading.Thread(target=self._sweep, daemon=True).start()
+
+        return task_id
+
+    def _sweep(self):
+        try:
+            with self._connection():
+                self.cleanup()
+        except:  # noqa
+            logger.exception("Task cleanup failed", extra={"event": "task_cleanup_failed"})
+
+    def _finished(self, task_id, state, future):
+        state = dict(state, finished=time.time())
+        try:
+            result = dumps(future.result())
+            if len(result) > self.max_result_size:
+                state.update(status="failed", error=f"Result is larger than {self.max_result_size} bytes")
+            else:
+                state.update(status="done", result=json.loads(result))
+        except:  # noqa
+            logger.exception(f"Task {state['name']} failed", extra={"event": "task_failed"})
+            state.update(status="failed", error="Task failed")
+
+        try:
+            self._save(task_id, state)
+        finally:
+            self.futures.pop(task_id, None)
+
+    def status(self, task_id):
+        """The state of the task as a dict, None when unknown or expired"""
+        value = self.kv.get(self._key(task_id))
+        if value is None:
+            return None
+
+        state = json.loads(value)
+        if state["expires"] < time.time():
+            del self.kv[self._key(task_id)]
+            return None
+
+        future = self.futures.get(task_id)
+        if state["status"] == "pending" and future is not None and future.running():
+            state["status"] = "running"
+        return state
+
+    def cleanup(self):
+        """Deletes the expired tasks"""
+        now = time.time()
+        model, key = self.kv.model, self.kv.key
+        expired = [
+            row.key for row in model.select().where(key.startswith("task:"))
+            if json.loads(row.value)["expires"] < now
+        ]
+        if expired:
+            model.delete().where(key.in_(expired)).execute()
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+
+
+def task(func):
+    """
+    Adds `func.submit(*args, **kwargs)`, running it with the Tasks given
+    to install_tasks and returning the task id:
+
+        @task
+        def report(month: int):
+            return build_report(month)
+
+        @rpc("/report")
+        def start_report(month: int):
+            return {"task": report.submit(month)}
+    """
+    func.submit = lambda *args, **kwargs: submit(func, *args, **kwargs)
+    return func
+
+
+def submit(func, *args, **kwargs):
+    if _tasks is None:
+        raise RuntimeError("Call install_tasks first")
+    return _tasks.submit(func, *args, **kwargs)
+
+
+def install_tasks(kv, path="/tasks", checker=None, workers=4, processes=False,
+                  max_result_size=64 * 1024, ttl=3600):
+    """
+    Sets up the Tasks behind `task` and `submit` and a route at
+    `path`/<task_id> returning the status, and the result once done,
+    guarded by `checker` like `rpc` and `get` do. Functions for a
+    process pool must be defined at module level.
+    """
+    global _tasks
+    from bottle import HTTPResponse
+
+    from .bottle import get
+
+    _tasks = Tasks(kv, workers, processes, max_result_size, ttl)
+
+    # Polled right after submit, a lagging replica would not have it yet
+    @get(f"{path}/<task_id>", checker=checker, read_only=False)
+    def task_status(task_id):
+        state = _tasks.status(task_id)
+        if state is None:
+            raise HTTPResponse(
+                status=404,
+                headers={"Content-Type": "application/json"},
+                body=dumps(dict(msg="Task Not Exist")),
+            )
+        return state
+
+    return _tasks
@@ -0,0 +1,221 @@
+import io
+import os
+import hashlib
+import tempfile
+from uuid import uuid4
+from dataclasses import dataclass
+from email.message import Message
+
+from bottle import request, HTTPResponse, FormsDict
+
+from .utils import dumps, sanitize
+
+
+CHUNK_SIZE = 64 * 1024
+MAX_HEADER_SIZE = 16 * 1024
+MAX_UPLOAD_SIZE = 100 * 1024 * 1024
+
+
+@dataclass
+class Upload:
+    name: str
+    filename: str
+    content_type: str
+    path: str
+    size: int
+    sha256: str
+
+
+def _error(status, msg):
+    return HTTPResponse(
+        status=status,
+        headers={"Content-Type": "application/json"},
+        body=dumps(dict(msg=msg)),
+    )
+
+
+def _default_target(directory):
+    def target(name, filename):
+        return os.path.join(directory, f"{uuid4().hex}-{sanitize(filename)}")
+    return target
+
+
+class _Reader:
+    """Reads at most `length` bytes of `stream` in chunks, with a buffer to parse from"""
+    def __init__(self, stream, length, chunk_size):
+        self.stream = stream
+        self.remaining = length
+        self.chunk_size = chunk_size
+        self.buffer = b""
+
+    def fill(self):
+        if self.remaining <= 0:
+            return False
+        chunk = self.stream.read(min(self.chunk_size, self.remaining))
+        if not chunk:
+            self.remaining = 0
+            return False
+        self.remaining -= len(chunk)
+        self.buffer += chunk
+        return True
+
+    def read_until(self, marker, limit):
+        while marker not in self.buffer:
+            if len(self.buffer) > limit or not self.fill():
+                raise _error(400, "Malformed multipart body")
+        data, self.buffer = self.buffer.split(marker, 1)
+        return data
+
+
+def _part_headers(raw):
+    message = Message()
+    for line in raw.decode("utf-8", "replace").split("\r\n"):
+        if ":" in line:
+            key, value = line.split(":", 1)
+            message[key.strip()] = value.strip()
+
+    disposition = Message()
+    disposition["Content-Type"] = message.get("Content-Disposition", "")
+    name = disposition.get_param("name", header="content-type")
+    filename = disposition.get_param("filename", header="content-type")
+
+    return name, filename, message.get("Content-Type", "application/octet-stream")
+
+
+def parse_multipart(target=None, directory=None, max_part_size=MAX_UPLOAD_SIZE,
+                    max_total_size=MAX_UPLOAD_SIZE, max_field_size=64 * 1024, chunk_size=CHUNK_SIZE):
+    """
+    Parses the multipart body of the current request as it streams in,
+    file parts are written in `chunk_size` chunks straight to disk, so
+    memory stays bounded whatever the upload size.
+
+    `target(name, filename)` returns the path to write a file part to, or
+    None to skip it. By default files go to `directory` (the temp dir).
+    Limits are checked as early as possible and answered with 413, None
+    lifts one.
+
+    Returns (fields, uploads), the form fields as a dict and a dict of
+    Upload with the path, size and sha256 of every file written.
+
+    In an `rpc` route declare it with `stream_uploads=True`, else the
+    body is parsed, and spooled, by bottle before the handler runs.
+    """
+    content_type = request.get_header("Content-Type", "")
+    if "multipart/form-data" not in content_type:
+        raise _error(400, "Expected multipart/form-data")
+
+    header = Message()
+    header["Content-Type"] = content_type
+    boundary = header.get_param("boundary")
+    if not boundary:
+        raise _error(400, "Missing multipart boundary")
+
+    if request.content_length < 0:
+        raise _error(411, "Content-Length required")
+    if max_total_size is not None and request.content_length > max_total_size:
+        raise _error(413, f"Upload is larger than {max_total_size} bytes")
+
+    target = target or _default_target(directory or tempfile.gettempdir())
+    environ = request.environ
+    stream = environ.get("bottle.request.body")
+    if stream is not None:
+        # Read by bottle already, e.g. through request.forms
+        stream.seek(0)
+    else:
+        stream = environ["wsgi.input"]
+
+    reader = _Reader(stream, request.content_length, chunk_size)
+    delimiter = b"\r\n--" + boundary.encode("latin1")
+
+    fields = {}
+    uploads = {}
+    written = []
+
+    try:
+        # Preamble and first boundary
+        reader.buffer = b"\r\n"
+        reader.read_until(delimiter, MAX_HEADER_SIZE + len(delimiter))
+
+        while True:
+            while len(reader.buffer) < 2 and reader.fill():
+                pass
+            if reader.buffer.startswith(b"--"):
+                break
+            if not reader.buffer.startswith(b"\r\n"):
+                raise _error(400, "Malformed multipart body")
+            reader.buffer = reader.buffer[2:]
+
+            name, filename, part_type = _part_headers(reader.read_until(b"\r\n\r\n", MAX_HEADER_SIZE))
+
+            if filename is None:
+                value = _read_part(reader, delimiter, name, max_field_size, field=True)
+                fields[name] = value.decode("utf-8", "replace")
+                continue
+
+            path = target(name, filename)
+            if path is not None:
+                written.append(path)
+            size, sha256 = _read_part(reader, delimiter, name, max_part_size, path=path)
+            if path is not None:
+                uploads[name] = Upload(name, filename, part_type, path, size, sha256)
+    except:  # noqa
+        for path in written:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    finally:
+        # Later access to request.body must not read the input again
+        environ["bottle.request.body"] = io.BytesIO()
+
+    # request.forms keeps working, with bottle's latin1 native strings
+    environ["bottle.request.post"] = FormsDict(
+        {name: value.encode("utf-8").decode("latin1") for name, value in fields.items()}
+    )
+    return fields, uploads
+
+
+def _read_part(reader, delimiter, name, limit, path=None, field=False):
+    """
+    Consumes a part up to the next delimiter. A `field` is returned as
+    bytes, a file is written to `path`, if any, and (size, sha256) is returned.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    data = []
+    fh = open(path, "wb") if path is not None else None
+    keep = len(delimiter) - 1
+
+    def consume(chunk):
+        nonlocal size
+        size += len(chunk)
+        if limit is not None and size > limit:
+            raise _error(413, f"Part {name} is larger than {limit} bytes")
+        if field:
+            data.append(chunk)
+        else:
+            digest.update(chunk)
+            if fh is not None:
+                fh.write(chunk)
+
+    try:
+        while True:
+            index = reader.buffer.find(delimiter)
+            if index >= 0:
+                consume(reader.buffer[:index])
+                reader.buffer = reader.buffer[index + len(delimiter):]
+                break
+
+            # The end of the buffer may hold the start of the delimiter
+            if len(reader.buffer) > keep:
+                consume(reader.buffer[:-keep])
+                reader.buffer = reader.buffer[-keep:]
+
+            if not reader.fill():
+                raise _error(400, "Malformed multipart body")
+    finally:
+        if fh is not None:
+            fh.close()
+
+    if field:
+        return b"".join(data)
+    return size, digest.hexdigest()
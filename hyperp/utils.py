@@ -1,12 +1,14 @@
 import re
 import unicodedata
-import pathlib
-import shutil
 import json
+import logging
 from traceback import format_exc
 from datetime import datetime
 
 
+logger = logging.getLogger("hyperp")
+
+
 def check_form(Model, data):
     from pydantic import ValidationError # noqa
     try:
@@ -17,6 +19,18 @@ def check_form(Model, data):
         return None, errors
 
 
+# Blacklisted characters and everything below code point 32 are removed
+_SANITIZE_TABLE = dict.fromkeys(
+    [ord(c) for c in ["\\", "/", ":", "*", "?", "\"", "<", ">", "|", "\0"]] + list(range(32))
+)
+# Reserved words on Windows
+_RESERVED_FILENAMES = frozenset([
+    "CON", "PRN", "AUX", "NUL", "COM1", "COM2", "COM3", "COM4", "COM5",
+    "COM6", "COM7", "COM8", "COM9", "LPT1", "LPT2", "LPT3", "LPT4", "LPT5",
+    "LPT6", "LPT7", "LPT8", "LPT9",
+])
+
+
 def sanitize(filename):
     """Return a fairly safe version of the filename.
 
@@ -25,21 +39,15 @@ def sanitize(filename):
     and make sure we do not exceed Windows filename length limits.
     Hence a less safe blacklist, rather than a whitelist.
     """
-    blacklist = ["\\", "/", ":", "*", "?", "\"", "<", ">", "|", "\0"]
-    reserved = [
-        "CON", "PRN", "AUX", "NUL", "COM1", "COM2", "COM3", "COM4", "COM5",
-        "COM6", "COM7", "COM8", "COM9", "LPT1", "LPT2", "LPT3", "LPT4", "LPT5",
-        "LPT6", "LPT7", "LPT8", "LPT9",
-    ]  # Reserved words on Windows
-    filename = "".join(c for c in filename if c not in blacklist)
-    # Remove all charcters below code point 32
-    filename = "".join(c for c in filename if 31 < ord(c))
-    filename = unicodedata.normalize("NFKD", filename)
+    filename = filename.translate(_SANITIZE_TABLE)
+    # NFKD leaves ascii untouched
+    if not filename.isascii():
+        filename = unicodedata.normalize("NFKD", filename)
     filename = filename.rstrip(". ")  # Windows does not allow these at end
     filename = filename.strip()
-    if all([x == "." for x in filename]):
+    if not filename.strip("."):
         filename = "__" + filename
-    if filename in reserved:
+    if filename in _RESERVED_FILENAMES:
         filename = "__" + filename
     if len(filename) == 0:
         filename = "__"
@@ -64,11 +72,29 @@ def sanitize(filename):
     return filename
 
 
+def sanitize_many(filenames):
+    """
+    Sanitizes a list of filenames, such as the members of an archive,
+    names that repeat are only sanitized once.
+    """
+    done = {}
+    result = []
+
+    for filename in filenames:
+        if filename not in done:
+            done[filename] = sanitize(filename)
+        result.append(done[filename])
+
+    return result
+
+
 def mkdir(path):
+    import pathlib
     return pathlib.Path(path).mkdir(parents=True, exist_ok=True)
 
 
 def mkdir_file(file_path):
+    import pathlib
     return (
         pathlib.
         Path(file_path).
@@ -77,6 +103,7 @@ def mkdir_file(file_path):
 
 
 def rmdir(path):
+    import shutil
     shutil.rmtree(path, ignore_errors=True)
 
 
@@ -125,7 +152,7 @@ def runcron(kvdb, name, func, on_error):
         on_error(f'Cron {name} tried to run 11 times without fail')
         return
     elif int(kvdb[name]) > 0:
-        print("Cronjob is running already. Exit.")
+        logger.warning(f"Cron {name} is running already. Exit.", extra={"event": "cron_running"})
         kvdb[name] = str(int(kvdb[name]) + 1)
         return
 
@@ -133,7 +160,7 @@ def runcron(kvdb, name, func, on_error):
         kvdb[name] = "1"
         func()
     except:  # noqa
-        print(format_exc())
+        logger.exception(f"Failed cron {name}", extra={"event": "cron_failed"})
         on_error(f'Failed cron {name} {format_exc()}')
         return
     finally:
@@ -202,7 +229,7 @@ class Throttle:
             self._recent.append(datetime.utcnow())
             self._func(*args, **kwargs)
         else:
-            print("Throttled call")
+            logger.warning("Throttled call", extra={"event": "throttled"})
 
 
 def timestamp(dt):
@@ -0,0 +1,90 @@
+"""
+The implementations hyperp had before they were optimized, kept to check
+the new ones give the same results and to benchmark against
+"""
+import os
+import re
+import base64
+import unicodedata
+
+
+def sanitize(filename):
+    blacklist = ["\\", "/", ":", "*", "?", "\"", "<", ">", "|", "\0"]
+    reserved = [
+        "CON", "PRN", "AUX", "NUL", "COM1", "COM2", "COM3", "COM4", "COM5",
+        "COM6", "COM7", "COM8", "COM9", "LPT1", "LPT2", "LPT3", "LPT4", "LPT5",
+        "LPT6", "LPT7", "LPT8", "LPT9",
+    ]  # Reserved words on Windows
+    filename = "".join(c for c in filename if c not in blacklist)
+    # Remove all charcters below code point 32
+    filename = "".join(c for c in filename if 31 < ord(c))
+    filename = unicodedata.normalize("NFKD", filename)
+    filename = filename.rstrip(". ")  # Windows does not allow these at end
+    filename = filename.strip()
+    if all([x == "." for x in filename]):
+        filename = "__" + filename
+    if filename in reserved:
+        filename = "__" + filename
+    if len(filename) == 0:
+        filename = "__"
+    if len(filename) > 255:
+        parts = re.split(r"/|\\", filename)[-1].split(".")
+        if len(parts) > 1:
+            ext = "." + parts.pop()
+            filename = filename[:-len(ext)]
+        else:
+            ext = ""
+        if filename == "":
+            filename = "__"
+        if len(ext) > 254:
+            ext = ext[254:]
+        maxl = 255 - len(ext)
+        filename = filename[:maxl]
+        filename = filename + ext
+        # Re-check last character (if there was no extension)
+        filename = filename.rstrip(". ")
+        if len(filename) == 0:
+            filename = "__"
+    return filename
+
+
+def _derive_key(password, salt):
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.backends import default_backend
+
+    # Derive a cryptographic key from the password and salt
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=100000,
+        backend=default_backend()
+    )
+    return base64.urlsafe_b64encode(kdf.derive(password.encode()))
+
+
+def encrypt(message, password):
+    from cryptography.fernet import Fernet
+
+    # Generate a random salt
+    salt = os.urandom(16)
+    key = _derive_key(password, salt)
+    cipher = Fernet(key)
+    encrypted_message = cipher.encrypt(message.encode())
+    # Combine salt and encrypted message and encode to Base64
+    return base64.urlsafe_b64encode(salt + encrypted_message).decode()
+
+
+def decrypt(encrypted_message, password):
+    from cryptography.fernet import Fernet
+
+    # Decode the Base64 encoded message
+    encrypted_message = base64.urlsafe_b64decode(encrypted_message)
+    # Extract the salt from the encrypted message
+    salt = encrypted_message[:16]
+    encrypted_message = encrypted_message[16:]
+    key = _derive_key(password, salt)
+    cipher = Fernet(key)
+    decrypted_message = cipher.decrypt(encrypted_message).decode()
+    return decrypted_message
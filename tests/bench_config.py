@@ -0,0 +1,46 @@
+"""
+Operations per second of hyperp.config encryption against the
+implementation it replaced, run with `python -m tests.bench_config`
+"""
+import time
+
+from hyperp.config import encrypt, decrypt, encrypt_many, decrypt_many
+
+from . import baseline
+
+
+PASSWORD = "benchmark password"
+
+
+def ops_per_second(run, batch=1, seconds=1.0):
+    run()  # warm up, derives the master key
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        run()
+        count += batch
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    message = "a per-row secret, such as an API key"
+    messages = [message] * 1000
+    old = baseline.encrypt(message, PASSWORD)
+    new = encrypt(message, PASSWORD)
+    many = encrypt_many(messages, PASSWORD)
+
+    results = [
+        ("baseline encrypt", lambda: baseline.encrypt(message, PASSWORD), 1),
+        ("baseline decrypt", lambda: baseline.decrypt(old, PASSWORD), 1),
+        ("encrypt", lambda: encrypt(message, PASSWORD), 1),
+        ("decrypt", lambda: decrypt(new, PASSWORD), 1),
+        ("decrypt v1 value", lambda: decrypt(old, PASSWORD), 1),
+        ("encrypt_many", lambda: encrypt_many(messages, PASSWORD), len(messages)),
+        ("decrypt_many", lambda: decrypt_many(many, PASSWORD), len(messages)),
+    ]
+    for name, run, batch in results:
+        print(f"{name:<18} {ops_per_second(run, batch):12.1f} ops/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+Times sanitize against the implementation it replaced, run with
+`python -m tests.bench_sanitize`
+"""
+import random
+import timeit
+
+from hyperp.utils import sanitize, sanitize_many
+
+from . import baseline
+from .test_sanitize import _filename
+
+
+def main(number=20):
+    rnd = random.Random(0)
+    # Archive style members, folders repeat across many files
+    members = [f"project/src/module_{i % 50}/file_{i}.py" for i in range(800)]
+    members += [_filename(rnd) for _ in range(200)]
+
+    results = [
+        ("baseline sanitize", lambda: [baseline.sanitize(name) for name in members]),
+        ("sanitize", lambda: [sanitize(name) for name in members]),
+        ("sanitize_many", lambda: sanitize_many(members)),
+    ]
+    base = None
+    for name, run in results:
+        seconds = min(timeit.repeat(run, number=number, repeat=5)) / number
+        base = base or seconds
+        print(f"{name:<18} {seconds * 1000:8.3f}ms per {len(members)} names  {base / seconds:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Rows per second of hyperp.peewee.Serializer against peewee's
+model_to_dict on 100k rows with a nested foreign key, run with
+`python -m tests.bench_serializer`
+"""
+import time
+from datetime import datetime
+
+from peewee import SqliteDatabase, Model, CharField, IntegerField, DateTimeField, ForeignKeyField
+from playhouse.shortcuts import model_to_dict
+
+from hyperp.peewee import Serializer
+
+
+ROWS = 100_000
+
+db = SqliteDatabase(":memory:")
+
+
+class Owner(Model):
+    name = CharField()
+    email = CharField()
+
+    class Meta:
+        database = db
+
+
+class Item(Model):
+    owner = ForeignKeyField(Owner)
+    title = CharField()
+    quantity = IntegerField()
+    created = DateTimeField()
+    secret = CharField()
+
+    class Meta:
+        database = db
+
+
+def fill():
+    db.create_tables([Owner, Item])
+    with db.atomic():
+        Owner.insert_many([dict(name=f"owner {i}", email=f"{i}@example.com") for i in range(100)]).execute()
+        now = datetime(2024, 1, 1)
+        for start in range(0, ROWS, 5000):
+            Item.insert_many([
+                dict(owner=i % 100 + 1, title=f"item {i}", quantity=i, created=now, secret="s")
+                for i in range(start, start + 5000)
+            ]).execute()
+
+
+def rows_per_second(run):
+    start = time.perf_counter()
+    count = len(run())
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    fill()
+    query = Item.select(Item, Owner).join(Owner)
+    serializer = Serializer(Item, exclude=["secret"], related={"owner": ["id", "name"]})
+
+    results = [
+        ("model_to_dict", lambda: [
+            model_to_dict(item, exclude=[Item.secret], only=[*Item._meta.sorted_fields, Owner.id, Owner.name])
+            for item in query
+        ]),
+        ("Serializer", lambda: serializer(Item.select())),
+        ("Serializer.iterate", lambda: list(serializer.iterate(Item.select()))),
+    ]
+    for name, run in results:
+        print(f"{name:<20} {rows_per_second(run):12.1f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
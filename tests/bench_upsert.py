@@ -0,0 +1,68 @@
+"""
+Rows per second of hyperp.peewee.bulk_upsert against a Model.create
+per row, on a SQLite file, run with `python -m tests.bench_upsert`
+"""
+import os
+import time
+import tempfile
+
+from peewee import SqliteDatabase, Model, CharField, IntegerField
+
+from hyperp.peewee import bulk_upsert, SQLITE_PRAGMAS
+
+
+ROWS = 20_000
+
+
+def make_model(path):
+    db = SqliteDatabase(path, pragmas=SQLITE_PRAGMAS)
+
+    class Stock(Model):
+        sku = CharField(unique=True)
+        quantity = IntegerField()
+        warehouse = CharField(default="main")
+
+        class Meta:
+            database = db
+
+    db.create_tables([Stock])
+    return Stock
+
+
+def rows(count, offset=0):
+    return [dict(sku=f"sku-{i}", quantity=i + offset) for i in range(count)]
+
+
+def create_each(Stock):
+    for row in rows(ROWS):
+        Stock.create(**row)
+
+
+def create_in_transaction(Stock):
+    with Stock._meta.database.atomic():
+        for row in rows(ROWS):
+            Stock.create(**row)
+
+
+def main():
+    results = [
+        ("Model.create", create_each),
+        ("Model.create, atomic", create_in_transaction),
+        ("bulk_upsert", lambda Stock: bulk_upsert(Stock, rows(ROWS))),
+        ("bulk_upsert + update", lambda Stock: (
+            bulk_upsert(Stock, rows(ROWS)),
+            bulk_upsert(Stock, rows(ROWS, 1), conflict_target=["sku"]),
+        )),
+    ]
+
+    with tempfile.TemporaryDirectory() as folder:
+        for index, (name, run) in enumerate(results):
+            Stock = make_model(os.path.join(folder, f"{index}.sqlite"))
+            start = time.perf_counter()
+            run(Stock)
+            print(f"{name:<22} {ROWS / (time.perf_counter() - start):12.1f} rows/s")
+            Stock._meta.database.close()
+
+
+if __name__ == "__main__":
+    main()
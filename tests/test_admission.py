@@ -0,0 +1,58 @@
+import json
+import threading
+
+import bottle
+import pytest
+
+from hyperp.admission import install_admission
+
+from .client import request
+
+
+@pytest.fixture
+def app():
+    app = bottle.default_app.push()
+    yield app
+    bottle.default_app.pop()
+
+
+def test_checker_is_required(app):
+    with pytest.raises(ValueError):
+        install_admission(app)
+
+
+def test_stats_route_is_checked(app):
+    install_admission(app, checker=lambda: "" if bottle.request.get_header("X-Admin") else "No access")
+
+    status, _, _ = request(app, "GET", "/_admission")
+    assert status == 401
+
+    status, _, body = request(app, "GET", "/_admission", {"X-Admin": "1"})
+    assert status == 200
+    assert json.loads(body)["total"]["limit"] == 64
+
+
+def test_methods_of_a_path_share_one_limiter(app):
+    plugin = install_admission(app, route_limit=2, checker=lambda: "")
+
+    @app.route("/shared", method=["GET", "POST"])
+    def shared():
+        return "ok"
+
+    routes = [route for route in app.routes if route.rule == "/shared"]
+    start = threading.Barrier(8)
+
+    def apply(route):
+        start.wait()
+        route.call
+
+    threads = [threading.Thread(target=apply, args=(routes[i % len(routes)],)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert list(plugin.routes) == ["/shared"]
+    status, _, _ = request(app, "POST", "/shared")
+    assert status == 200
+    assert plugin.routes["/shared"].accepted == 1
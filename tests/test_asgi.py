@@ -0,0 +1,259 @@
+import json
+import time
+import asyncio
+import threading
+
+import bottle
+import pytest
+
+from hyperp.asgi import ASGI
+from hyperp.bottle import rpc, get, install_cors
+
+
+@pytest.fixture
+def app():
+    app = bottle.default_app.push()
+    yield app
+    bottle.default_app.pop()
+
+
+async def _request(application, method, path, body=b"", headers=()):
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": b"",
+        "headers": [(b"host", b"localhost")] + list(headers),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await application(scope, receive, send)
+    headers = {k.decode(): v.decode() for k, v in sent[0]["headers"]}
+    return sent[0]["status"], headers, sent[1]["body"]
+
+
+def call(application, method, path, data=None):
+    body = json.dumps(data).encode() if data is not None else b""
+    headers = [(b"content-type", b"application/json")] if data is not None else []
+    return asyncio.run(_request(application, method, path, body, headers))
+
+
+def test_sync_and_async_rpc(app):
+    @rpc("/sync")
+    def sync_add(a: int, b: int):
+        return {"sum": a + b}
+
+    @rpc("/async")
+    async def async_add(a: int, b: int):
+        await asyncio.sleep(0)
+        return {"sum": a + b}
+
+    application = ASGI(app)
+    for path in ("/sync", "/async"):
+        status, headers, body = call(application, "POST", path, {"a": 1, "b": 2})
+        assert status == 200
+        assert headers["Content-Type"] == "application/json"
+        assert json.loads(body) == {"sum": 3}
+
+        status, _, body = call(application, "POST", path, {"a": "x", "b": 2})
+        assert status == 400
+        assert json.loads(body)["param"] == "a"
+
+
+def test_get_route(app):
+    @get("/items/<item_id>")
+    async def item(item_id):
+        return {"id": item_id}
+
+    status, _, body = call(ASGI(app), "GET", "/items/7")
+    assert status == 200
+    assert json.loads(body) == {"id": "7"}
+
+
+def test_async_rpc_runs_hooks(app):
+    install_cors(app, ["localhost"])
+
+    @rpc("/async-cors")
+    async def async_cors():
+        return {"ok": True}
+
+    status, headers, _ = call(ASGI(app), "POST", "/async-cors", {})
+    assert status == 200
+    assert headers["Access-Control-Allow-Origin"] == "*"
+
+
+def test_async_rpc_runs_plugins(app):
+    seen = []
+
+    def plugin(callback):
+        def wrapper(*args, **kwargs):
+            seen.append("before")
+            return callback(*args, **kwargs)
+        return wrapper
+
+    app.install(plugin)
+
+    @rpc("/async-plugin")
+    async def async_plugin():
+        seen.append("handler")
+        return {"ok": True}
+
+    status, _, _ = call(ASGI(app), "POST", "/async-plugin", {})
+    assert status == 200
+    assert seen == ["before", "handler"]
+
+
+@pytest.mark.parametrize("with_plugin", [False, True])
+def test_async_deadline(app, with_plugin):
+    if with_plugin:
+        app.install(lambda callback: callback)
+
+    @rpc("/slow", deadline=0.2)
+    async def slow():
+        await asyncio.sleep(0.5)
+        return {"ok": True}
+
+    start = time.monotonic()
+    status, _, _ = call(ASGI(app), "POST", "/slow", {})
+    assert status == 504
+    assert time.monotonic() - start < 0.45
+
+
+def test_async_handlers_do_not_hold_threads(app):
+    @rpc("/wait")
+    async def wait():
+        await asyncio.sleep(0.2)
+        return {"ok": True}
+
+    application = ASGI(app, workers=2)
+
+    async def many():
+        return await asyncio.gather(*[_request(application, "POST", "/wait") for _ in range(50)])
+
+    start = time.monotonic()
+    results = asyncio.run(many())
+    assert all(status == 200 for status, _, _ in results)
+    assert time.monotonic() - start < 1.5
+
+
+def test_async_handlers_with_hooks_and_plugins_hold_no_threads(app, tmp_path):
+    from peewee import SqliteDatabase
+    from hyperp.bottle import ErrorHandler, install_peewee
+    from hyperp.admission import install_admission
+
+    db = SqliteDatabase(str(tmp_path / "db.sqlite"))
+    install_cors(app, ["localhost"])
+    install_peewee(db, query_stats=True)
+    install_admission(app, limit=100, checker=lambda: "")
+    app.install(ErrorHandler(lambda msg: None))
+
+    threads = set()
+    connections = set()
+
+    @rpc("/slow-async", deadline=5)
+    async def slow_async():
+        threads.add(threading.get_ident())
+        db.execute_sql("SELECT 1")
+        connections.add(id(db.connection()))
+        await asyncio.sleep(0.2)
+        db.execute_sql("SELECT 1")
+        return {"ok": True}
+
+    application = ASGI(app, workers=2)
+    before = threading.active_count()
+
+    async def many():
+        return await asyncio.gather(*[_request(application, "POST", "/slow-async") for _ in range(50)])
+
+    start = time.monotonic()
+    results = asyncio.run(many())
+    assert time.monotonic() - start < 1.5
+    assert all(status == 200 for status, _, _ in results)
+    assert all(headers["Access-Control-Allow-Origin"] == "*" for _, headers, _ in results)
+    assert all(headers["X-Query-Count"] == "2" for _, headers, _ in results)
+
+    # All on the event loop thread, none of the pool threads started
+    assert threads == {threading.get_ident()}
+    assert threading.active_count() == before
+    # Each request had its own connection
+    assert len(connections) == 50
+
+
+def test_async_admission_queues_on_the_loop(app):
+    from hyperp.admission import install_admission
+
+    plugin = install_admission(app, limit=2, queue=10, timeout=2, checker=lambda: "")
+
+    @rpc("/limited")
+    async def limited():
+        await asyncio.sleep(0.1)
+        return {"in_flight": plugin.limiter.in_flight}
+
+    application = ASGI(app, workers=1)
+
+    async def many():
+        return await asyncio.gather(*[_request(application, "POST", "/limited") for _ in range(6)])
+
+    results = asyncio.run(many())
+    assert [status for status, _, _ in results] == [200] * 6
+    assert max(json.loads(body)["in_flight"] for _, _, body in results) == 2
+    assert plugin.limiter.in_flight == 0
+
+
+def test_async_error_handler_sees_awaited_errors(app):
+    from hyperp.bottle import ErrorHandler
+
+    errors = []
+    app.install(ErrorHandler(errors.append))
+
+    @rpc("/fails")
+    async def fails():
+        await asyncio.sleep(0)
+        raise ValueError("boom")
+
+    status, _, body = call(ASGI(app), "POST", "/fails", {})
+    assert json.loads(body) == {"msg": "Internal Error"}
+    assert "ValueError: boom" in errors[0]
+
+
+def test_sync_body_is_streamed(app):
+    received = []
+
+    @app.post("/upload")
+    def upload():
+        before = len(received)
+        size = len(bottle.request.body.read())
+        return {"before": before, "size": size}
+
+    async def run():
+        scope = {
+            "type": "http",
+            "method": "POST",
+            "path": "/upload",
+            "query_string": b"",
+            "headers": [(b"content-length", str(10 * 65536).encode())],
+        }
+        chunks = [{"type": "http.request", "body": b"x" * 65536, "more_body": i < 9} for i in range(10)]
+        sent = []
+
+        async def receive():
+            received.append(1)
+            return chunks.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await ASGI(app)(scope, receive, send)
+        return sent
+
+    sent = asyncio.run(run())
+    assert sent[0]["status"] == 200
+    # Nothing was read before the handler asked for the body
+    assert json.loads(sent[1]["body"]) == {"before": 0, "size": 10 * 65536}
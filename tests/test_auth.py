@@ -0,0 +1,127 @@
+import time
+import threading
+
+import pytest
+
+from hyperp import auth
+from hyperp.auth import TokenCache, make_signed_token, read_signed_token
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(auth.time, "monotonic", clock)
+    return clock
+
+
+def test_cache_hits_until_ttl(clock):
+    loads = []
+    cache = TokenCache(lambda token: loads.append(token) or f"user {token}", ttl=10)
+
+    assert cache("a") == "user a"
+    assert cache("a") == "user a"
+    assert loads == ["a"]
+
+    clock.now += 11
+    assert cache("a") == "user a"
+    assert loads == ["a", "a"]
+
+
+def test_cache_skips_unknown_and_empty():
+    loads = []
+    cache = TokenCache(lambda token: loads.append(token))
+
+    assert cache("") is None
+    assert cache("a") is None
+    assert cache("a") is None
+    assert loads == ["a", "a"]
+
+
+def test_cache_drops_least_recently_used():
+    loads = []
+    cache = TokenCache(lambda token: loads.append(token) or token, maxsize=2)
+
+    cache("a"), cache("b"), cache("a"), cache("c")
+    assert list(cache._entries) == ["a", "c"]
+
+    cache("b")
+    assert loads == ["a", "b", "c", "b"]
+
+
+def test_invalidate_and_clear():
+    users = {"a": "alice", "b": "bob"}
+    cache = TokenCache(users.get)
+    cache("a"), cache("b")
+
+    users["a"] = "alice 2"
+    cache.invalidate("a")
+    assert cache("a") == "alice 2"
+
+    users["b"] = "bob 2"
+    cache.clear()
+    assert cache("b") == "bob 2"
+
+
+def test_invalidate_during_load_is_not_cached():
+    loading, invalidated = threading.Event(), threading.Event()
+    users = {"a": "alice"}
+
+    def loader(token):
+        principal = users.get(token)
+        loading.set()
+        invalidated.wait(5)
+        return principal
+
+    cache = TokenCache(loader)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(cache("a")))
+    thread.start()
+
+    loading.wait(5)
+    del users["a"]
+    cache.invalidate("a")
+    invalidated.set()
+    thread.join(5)
+
+    # The caller that raced gets what it loaded, later calls see the logout
+    assert result == ["alice"]
+    assert cache("a") is None
+
+
+def test_signed_token_roundtrip():
+    token = make_signed_token(42, "secret")
+    assert read_signed_token(token, "secret") == "42"
+    assert read_signed_token(token, "secret", max_age=60) == "42"
+
+
+def test_signed_token_rejects_tampering():
+    token = make_signed_token("alice", "secret")
+    value, issued, signature = token.split("$")
+
+    assert read_signed_token(token, "other") is None
+    assert read_signed_token(f"bob${issued}${signature}", "secret") is None
+    assert read_signed_token(f"{value}${int(issued) + 1}${signature}", "secret") is None
+    assert read_signed_token(f"{value}${issued}", "secret") is None
+    assert read_signed_token(None, "secret") is None
+
+
+def test_signed_token_expires(monkeypatch):
+    token = make_signed_token("alice", "secret")
+    now = time.time()
+    monkeypatch.setattr(auth.time, "time", lambda: now + 61)
+
+    assert read_signed_token(token, "secret", max_age=60) is None
+    assert read_signed_token(token, "secret") == "alice"
+
+
+def test_signed_token_refuses_separator():
+    with pytest.raises(ValueError):
+        make_signed_token("a$b", "secret")
@@ -0,0 +1,41 @@
+from peewee import SqliteDatabase, Model, CharField, IntegerField
+
+from hyperp.peewee import bulk_upsert
+
+
+def make_model(path):
+    db = SqliteDatabase(path)
+
+    class Stock(Model):
+        sku = CharField(unique=True)
+        quantity = IntegerField()
+        note = CharField(default="")
+
+        class Meta:
+            database = db
+
+    db.create_tables([Stock])
+    return Stock
+
+
+def test_batches_and_conflicts(tmp_path):
+    Stock = make_model(str(tmp_path / "db.sqlite"))
+
+    stats = bulk_upsert(Stock, ({"sku": f"s{i}", "quantity": i} for i in range(7)), batch_size=3)
+    assert (stats["rows"], stats["batches"]) == (7, 3)
+    assert Stock.select().count() == 7
+
+    bulk_upsert(Stock, [{"sku": "s1", "quantity": 100}, {"sku": "s9", "quantity": 9}], conflict_target=["sku"])
+    assert Stock.get(Stock.sku == "s1").quantity == 100
+    assert Stock.select().count() == 8
+
+    bulk_upsert(Stock, [{"sku": "s2", "quantity": 200}], ignore=True)
+    assert Stock.get(Stock.sku == "s2").quantity == 2
+
+
+def test_values_in_the_data_are_parameters(tmp_path):
+    Stock = make_model(str(tmp_path / "db.sqlite"))
+    note = " VALUES (?, ?, ?)"
+
+    bulk_upsert(Stock, [{"sku": "a", "quantity": 1, "note": note}, {"sku": "b", "quantity": 2, "note": note}])
+    assert [stock.note for stock in Stock.select()] == [note, note]
@@ -0,0 +1,76 @@
+import sys
+from enum import Enum
+from typing import List, Optional
+from datetime import date
+
+import pytest
+from bottle import FormsDict
+
+from hyperp.bottle import Api, InvalidForm, _coerce, validate_and_call
+
+
+class Color(Enum):
+    RED = "red"
+    BLUE = "blue"
+
+
+def handler(n: int, o: Optional[int] = None, u: Optional[float] = None, ids: List[int] = None,
+            tags: list = None, on: bool = False, day: date = None, color: Optional[Color] = None):
+    return dict(n=n, o=o, u=u, ids=ids, tags=tags, on=on, day=day, color=color)
+
+
+def form(**fields):
+    result = FormsDict()
+    for name, values in fields.items():
+        for value in values if isinstance(values, list) else [values]:
+            result.append(name, value)
+    return result
+
+
+def call(**fields):
+    api = Api("handler", "/handler", handler)
+    return validate_and_call(handler, api, _coerce(api.coerce, form(**fields)))
+
+
+def test_scalars():
+    result = call(n="1", on="yes", day="2024-02-03")
+    assert result["n"] == 1 and result["on"] is True and result["day"] == date(2024, 2, 3)
+
+
+def test_optional():
+    assert call(n="1", o="2", u="1.5")["o"] == 2
+    assert call(n="1", u="1.5")["u"] == 1.5
+    assert call(n="1", o="")["o"] is None
+    assert call(n="1", color="red")["color"] == "red"
+
+    for name in ("o", "u"):
+        with pytest.raises(InvalidForm) as e:
+            call(n="1", **{name: "x"})
+        assert e.value.param == name
+
+
+@pytest.mark.skipif(sys.version_info < (3, 10), reason="X | None needs 3.10")
+def test_union_syntax():
+    def union(u: float | None = None, ids: list[int] = None):
+        return dict(u=u, ids=ids)
+
+    api = Api("union", "/union", union)
+    result = validate_and_call(union, api, _coerce(api.coerce, form(u="1.5", ids=["1", "2"])))
+    assert result == dict(u=1.5, ids=[1, 2])
+    assert validate_and_call(union, api, _coerce(api.coerce, form(u="")))["u"] is None
+
+
+def test_lists():
+    assert call(n="1", ids=["1", "2"])["ids"] == [1, 2]
+    assert sorted(call(n="1", ids="3|4")["ids"]) == [3, 4]
+    assert call(n="1", tags=["a", "b"])["tags"] == ["a", "b"]
+
+    with pytest.raises(InvalidForm):
+        call(n="1", ids=["1", "x"])
+
+
+def test_json_optional():
+    api = Api("handler", "/handler", handler)
+    assert validate_and_call(handler, api, {"n": 1, "o": None})["o"] is None
+    with pytest.raises(InvalidForm):
+        validate_and_call(handler, api, {"n": 1, "o": "x"})
@@ -0,0 +1,21 @@
+from hyperp.config import encrypt, decrypt, encrypt_many, decrypt_many
+
+from . import baseline
+
+
+def test_v1_values_still_decrypt():
+    encrypted = baseline.encrypt("secret", "password")
+    assert decrypt(encrypted, "password") == "secret"
+
+
+def test_roundtrip():
+    encrypted = encrypt("secret æøå", "password")
+    assert encrypted.startswith("v2$")
+    assert decrypt(encrypted, "password") == "secret æøå"
+
+
+def test_many_mixes_versions():
+    messages = [f"row {i}" for i in range(20)]
+    encrypted = encrypt_many(messages, "password") + [baseline.encrypt("old", "password")]
+    assert decrypt_many(encrypted, "password") == messages + ["old"]
+    assert len(set(encrypted)) == len(encrypted)
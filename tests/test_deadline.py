@@ -0,0 +1,124 @@
+from contextlib import contextmanager
+
+import bottle
+import pytest
+from peewee import PostgresqlDatabase
+
+from hyperp import deadline as deadlines
+from hyperp.bottle import rpc
+from hyperp.deadline import deadline
+from hyperp.peewee import enforce_deadlines
+
+from .client import request
+
+
+@pytest.fixture
+def app():
+    app = bottle.default_app.push()
+    yield app
+    bottle.default_app.pop()
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Connection:
+    def __init__(self, statements):
+        self.statements = statements
+
+    @contextmanager
+    def cursor(self):
+        yield self
+
+    def execute(self, sql):
+        self.statements.append(sql)
+
+
+@pytest.fixture
+def postgres(monkeypatch):
+    # No server, the SQL reaching the connection is recorded
+    statements = []
+    conn = Connection(statements)
+    database = PostgresqlDatabase("hyperp")
+    database.is_closed = lambda: False
+    database.connection = lambda: conn
+    database.execute_sql = lambda sql, *args, **kwargs: statements.append(sql)
+    enforce_deadlines(database)
+    return database, statements
+
+
+def test_postgres_statement_timeout_is_set_once(postgres, monkeypatch):
+    database, statements = postgres
+    clock = Clock()
+    monkeypatch.setattr(deadlines.time, "monotonic", clock)
+
+    database.execute_sql("SELECT 1")
+    assert statements == ["SELECT 1"]
+    statements.clear()
+
+    with deadline(2):
+        database.execute_sql("SELECT 1")
+        clock.now += 0.125
+        database.execute_sql("SELECT 2")
+        # Over 10% less time is left than was sent
+        clock.now += 0.5
+        database.execute_sql("SELECT 3")
+
+        with deadline(0.25):
+            database.execute_sql("SELECT 4")
+        database.execute_sql("SELECT 5")
+
+    assert statements == [
+        "SET statement_timeout = 2000", "SELECT 1", "SELECT 2",
+        "SET statement_timeout = 1375", "SELECT 3",
+        "SET statement_timeout = 250", "SELECT 4", "SET statement_timeout TO DEFAULT",
+        "SET statement_timeout = 1375", "SELECT 5", "SET statement_timeout TO DEFAULT",
+    ]
+
+
+def test_databases_are_bounded_only_with_deadlines(app, tmp_path):
+    from peewee import SqliteDatabase
+    from hyperp.bottle import install_peewee, _deadlines
+
+    db = SqliteDatabase(str(tmp_path / "db.sqlite"))
+    used = _deadlines["used"]
+    _deadlines["used"] = False
+    try:
+        install_peewee(db)
+        assert not getattr(db, "_hyperp_deadlines", False)
+
+        @rpc("/bounded", deadline=1)
+        def bounded():
+            return {}
+
+        assert db._hyperp_deadlines
+    finally:
+        _deadlines["used"] = used
+        _deadlines["databases"].remove(db)
+
+
+def test_only_timeouts_are_answered_504(app):
+    @rpc("/timeout", deadline=0.01)
+    def timeout():
+        import time
+        time.sleep(0.02)
+        raise TimeoutError()
+
+    @rpc("/error", deadline=0.01)
+    def error():
+        import time
+        time.sleep(0.02)
+        raise ValueError("not the deadline")
+
+    @rpc("/early", deadline=5)
+    def early():
+        raise TimeoutError()
+
+    assert request(app, "POST", "/timeout")[0] == 504
+    assert request(app, "POST", "/error")[0] == 500
+    assert request(app, "POST", "/early")[0] == 500
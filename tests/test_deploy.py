@@ -0,0 +1,50 @@
+import os
+from zipfile import ZipFile
+
+import pytest
+from bottle import HTTPResponse
+
+from hyperp.deploy import Releases, manifest
+
+
+def make_zip(path, files):
+    with ZipFile(path, "w") as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return str(path)
+
+
+def test_deploy_links_unchanged_and_normalizes_names(tmp_path):
+    output = tmp_path / "site"
+    releases = Releases(str(output))
+
+    first = releases.deploy(make_zip(tmp_path / "1.zip", {"index.html": "v1", "css/app.css": "a"}), [], None)
+    second = releases.deploy(make_zip(tmp_path / "2.zip", {"css/./sub/../new.css": "b"}), ["index.html"], first)
+
+    assert sorted(releases.manifest()[1]) == ["css/app.css", "css/new.css"]
+    assert releases.manifest()[1] == manifest(str(output))
+    assert os.path.samefile(
+        os.path.join(releases.root, first, "css/app.css"), os.path.join(releases.root, second, "css/app.css"),
+    )
+
+
+@pytest.mark.parametrize("files", [{"../escape.txt": "x"}, {"ok.txt": "x", "/etc/passwd": "x"}])
+def test_failed_deploy_leaves_nothing(tmp_path, files):
+    releases = Releases(str(tmp_path / "site"))
+    first = releases.deploy(make_zip(tmp_path / "1.zip", {"index.html": "v1"}), [], None)
+    before = sorted(os.listdir(releases.root))
+
+    with pytest.raises(HTTPResponse):
+        releases.deploy(make_zip(tmp_path / "bad.zip", files), [], first)
+
+    assert sorted(os.listdir(releases.root)) == before
+    assert releases.manifest() == (first, {"index.html": manifest(str(tmp_path / "site"))["index.html"]})
+
+
+def test_corrupt_zip_leaves_nothing(tmp_path):
+    releases = Releases(str(tmp_path / "site"))
+    (tmp_path / "bad.zip").write_bytes(b"not a zip")
+
+    with pytest.raises(Exception):
+        releases.deploy(str(tmp_path / "bad.zip"), [], None)
+    assert os.listdir(releases.root) == [".lock"]
@@ -0,0 +1,14 @@
+import pytest
+
+from hyperp.importtime import BUDGETS, measure
+
+
+@pytest.mark.parametrize("module", sorted(BUDGETS))
+def test_import_time_within_budget(module):
+    # Each run is a fresh interpreter, see hyperp.importtime
+    try:
+        ms = measure(module)
+    except ImportError:
+        pytest.skip(f"{module} is not importable here")
+
+    assert ms <= BUDGETS[module], f"{module} took {ms:.1f}ms, budget is {BUDGETS[module]}ms"
@@ -0,0 +1,53 @@
+import json
+import tracemalloc
+
+import bottle
+import pytest
+
+from hyperp.memory import install_memory_profiling, MemoryPlugin, MAX_FRAMES
+
+from .client import request
+
+
+@pytest.fixture
+def app():
+    app = bottle.default_app.push()
+    yield app
+    bottle.default_app.pop()
+    tracemalloc.stop()
+
+
+def admin():
+    return "" if bottle.request.get_header("X-Admin") else "No access"
+
+
+def test_checker_and_keep_are_required(app):
+    with pytest.raises(ValueError):
+        install_memory_profiling(app)
+    with pytest.raises(ValueError):
+        MemoryPlugin(keep=0)
+
+
+def test_routes_are_checked_and_frames_bounded(app):
+    install_memory_profiling(app, checker=admin, sample=1, keep=2)
+
+    @app.get("/work")
+    def work():
+        return "x" * 100000
+
+    assert request(app, "POST", "/_memory/start?frames=100000")[0] == 401
+    assert not tracemalloc.is_tracing()
+
+    headers = {"X-Admin": "1"}
+    assert request(app, "POST", "/_memory/start?frames=100000", headers)[0] == 200
+    assert tracemalloc.get_traceback_limit() == MAX_FRAMES
+
+    request(app, "GET", "/work")
+    ids = [json.loads(request(app, "POST", "/_memory/snapshot", headers)[2])["id"] for _ in range(3)]
+
+    status, _, body = request(app, "GET", "/_memory", headers)
+    view = json.loads(body)
+    assert view["snapshots"] == ids[1:]
+    assert view["routes"]["GET /work"]["samples"] == 1
+    assert request(app, "GET", f"/_memory/top?id={ids[0]}", headers)[0] == 404
+    assert request(app, "GET", f"/_memory/top?id={ids[2]}", headers)[0] == 200
@@ -0,0 +1,39 @@
+import json
+
+import bottle
+import pytest
+
+from hyperp.profiling import install_profiling
+
+from .client import request
+
+
+@pytest.fixture
+def app():
+    app = bottle.default_app.push()
+    yield app
+    bottle.default_app.pop()
+
+
+def test_requires_checker(app, tmp_path):
+    with pytest.raises(ValueError):
+        install_profiling(app, str(tmp_path))
+
+
+def test_lists_only_its_profiles(app, tmp_path):
+    install_profiling(app, str(tmp_path), checker=lambda: "" if bottle.request.get_header("X-Admin") else "No access")
+
+    @app.get("/work", profile=True)
+    def work():
+        return "done"
+
+    (tmp_path / "notes.prof").write_text("foreign")
+    (tmp_path / "1-2.prof").write_text("foreign")
+
+    request(app, "GET", "/work")
+
+    assert request(app, "GET", "/_profiles")[0] == 401
+    status, _, body = request(app, "GET", "/_profiles", {"X-Admin": "1"})
+    profiles = json.loads(body)
+    assert [profile["route"] for profile in profiles] == ["work"]
+    assert (tmp_path / "notes.prof").exists()
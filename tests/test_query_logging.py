@@ -0,0 +1,35 @@
+import logging
+
+import bottle
+import pytest
+from peewee import SqliteDatabase
+
+from hyperp.bottle import install_peewee
+
+from .client import request
+
+
+@pytest.fixture
+def app():
+    app = bottle.default_app.push()
+    yield app
+    bottle.default_app.pop()
+
+
+def test_slow_and_repeated_queries_log_their_route(app, caplog):
+    db = SqliteDatabase(":memory:")
+    install_peewee(db, slow_query_ms=0, repeated_query_limit=1)
+
+    @app.get("/items/<item_id>")
+    def item(item_id):
+        db.execute_sql("SELECT 1")
+        db.execute_sql("SELECT 1")
+        return "ok"
+
+    with caplog.at_level(logging.WARNING, logger="hyperp"):
+        assert request(app, "GET", "/items/7")[0] == 200
+
+    events = {record.event: record for record in caplog.records}
+    for event in ("slow_query", "repeated_query"):
+        assert events[event].path == "/items/7"
+        assert events[event].route == "/items/<item_id>"
@@ -0,0 +1,50 @@
+import random
+
+import pytest
+
+from hyperp.utils import sanitize, sanitize_many
+
+from . import baseline
+
+
+# Characters sanitize treats specially, plus ones NFKD changes
+_ALPHABET = (
+    list("\\/:*?\"<>|\0") + [chr(c) for c in range(32)] + list(". \t ")
+    + list("abcXYZ019-_") + list("æøåéü") + list("ｆｕｌｌ１２") + ["ﬁ", "①", "́"]
+)
+_RESERVED = ["CON", "PRN", "AUX", "NUL", "COM1", "LPT9", "con", "Lpt1"]
+
+
+def _filename(rnd):
+    kind = rnd.random()
+    if kind < 0.1:
+        # Reserved names with padding that may be stripped
+        return rnd.choice(["", " ", "."]) + rnd.choice(_RESERVED) + rnd.choice(["", ".", " ", ". ", "\0"])
+    if kind < 0.2:
+        # Long names around the 255 limit, with and without extension
+        stem = "".join(rnd.choice(_ALPHABET) for _ in range(rnd.randint(240, 300)))
+        return stem + rnd.choice(["", ".txt", "." + "x" * rnd.randint(250, 260), "..", "/a.b"])
+    return "".join(rnd.choice(_ALPHABET) for _ in range(rnd.randint(0, 24)))
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_sanitize_matches_baseline(seed):
+    rnd = random.Random(seed)
+    for _ in range(5000):
+        filename = _filename(rnd)
+        assert sanitize(filename) == baseline.sanitize(filename), repr(filename)
+
+
+@pytest.mark.parametrize("filename", [
+    "", ".", "..", " . ", "CON", "CON.", "a/b\\c", "x" * 300, "x" * 300 + ".pdf",
+    "." * 300, "ｆｉｌｅ.txt", "é.txt", "\0\x1f", "a" * 250 + "." + "b" * 255,
+])
+def test_sanitize_edge_cases(filename):
+    assert sanitize(filename) == baseline.sanitize(filename)
+
+
+def test_sanitize_many():
+    rnd = random.Random(42)
+    filenames = [_filename(rnd) for _ in range(500)]
+    filenames += filenames[:100]
+    assert sanitize_many(filenames) == [baseline.sanitize(filename) for filename in filenames]
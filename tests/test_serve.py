@@ -0,0 +1,82 @@
+import os
+import socket
+import threading
+import urllib.request
+
+from hyperp import serve
+from hyperp.serve import _Server
+
+
+def test_fork_callbacks_only_run_for_workers(monkeypatch):
+    calls = []
+    monkeypatch.setattr(serve, "_at_fork", [])
+    serve.register_at_fork(
+        before=lambda: calls.append("before"),
+        after_in_parent=lambda: calls.append("parent"),
+        after_in_child=lambda: os._exit(7),
+    )
+
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0)
+    assert os.waitpid(pid, 0)[1] >> 8 == 0
+    assert calls == []
+
+    pid = serve._fork()
+    assert os.waitpid(pid, 0)[1] >> 8 == 7
+    assert calls == ["before", "parent"]
+
+
+def test_busy_worker_leaves_connections_to_idle_ones():
+    sock = socket.create_server(("127.0.0.1", 0))
+    sock.setblocking(False)
+    port = sock.getsockname()[1]
+
+    release = threading.Event()
+    busy = []
+
+    def app(name):
+        def handler(environ, start_response):
+            busy.append(name)
+            release.wait(5)
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            return [name.encode()]
+        return handler
+
+    servers = [_Server(sock, app(name), threads=1) for name in ("a", "b")]
+    answers = []
+
+    def start(server):
+        threading.Thread(target=server.serve_forever, kwargs=dict(poll_interval=0.05), daemon=True).start()
+
+    def fetch():
+        answers.append(urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5).read())
+
+    def wait_busy(count):
+        for _ in range(50):
+            if len(busy) >= count:
+                return
+            release.wait(0.02)
+
+    clients = [threading.Thread(target=fetch) for _ in range(2)]
+    try:
+        start(servers[0])
+        clients[0].start()
+        wait_busy(1)
+        # "a" has no free thread, it must leave this one in the backlog
+        clients[1].start()
+        release.wait(0.3)
+
+        start(servers[1])
+        wait_busy(2)
+        assert busy == ["a", "b"]
+    finally:
+        release.set()
+        for client in clients:
+            client.join(5)
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        sock.close()
+
+    assert sorted(answers) == [b"a", b"b"]
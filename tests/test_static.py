@@ -0,0 +1,37 @@
+import os
+
+from hyperp import static
+from hyperp.deploy import manifest
+
+
+def test_reindex_reuses_unchanged_variants(tmp_path, monkeypatch):
+    source = tmp_path / "app.js"
+    source.write_text("console.log('hello');\n" * 200)
+
+    files = static.StaticFiles(str(tmp_path))
+    variant = files.files["app.js"]["variants"]["gzip"][0]
+    inode = os.stat(variant).st_ino
+
+    compressed = []
+    precompress = static._precompress
+    monkeypatch.setattr(static, "_precompress", lambda *args: compressed.append(args) or precompress(*args))
+
+    files.reindex()
+    assert compressed == []
+    assert os.stat(variant).st_ino == inode
+
+    source.write_text("console.log('changed');\n" * 200)
+    files.reindex()
+    assert len(compressed) == 1
+    # Replaced, not written through, a hard link to the old one is untouched
+    assert os.stat(variant).st_ino != inode
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".")]
+
+
+def test_manifest_skips_generated_variants(tmp_path):
+    (tmp_path / "app.js").write_text("console.log('hello');\n" * 200)
+    (tmp_path / "data.gz").write_bytes(b"uploaded as is")
+    static.StaticFiles(str(tmp_path))
+
+    assert os.path.exists(tmp_path / "app.js.gz")
+    assert sorted(manifest(str(tmp_path))) == ["app.js", "data.gz"]
@@ -0,0 +1,66 @@
+import json
+import time
+import logging
+import threading
+
+import pytest
+from peewee import SqliteDatabase
+from playhouse.kv import KeyValue
+
+from hyperp.tasks import Tasks
+
+
+@pytest.fixture
+def tasks(tmp_path):
+    tasks = Tasks(KeyValue(database=SqliteDatabase(str(tmp_path / "tasks.sqlite"))), workers=2, ttl=60)
+    yield tasks
+    tasks.shutdown()
+
+
+def wait(tasks, task_id):
+    for _ in range(100):
+        state = tasks.status(task_id)
+        if state["status"] not in ("pending", "running"):
+            return state
+        time.sleep(0.01)
+    raise AssertionError("Task did not finish")
+
+
+def test_result_and_failure(tasks, caplog):
+    def add(a, b):
+        return a + b
+
+    def fails():
+        raise ValueError("boom")
+
+    assert wait(tasks, tasks.submit(add, 1, 2))["result"] == 3
+
+    with caplog.at_level(logging.ERROR, logger="hyperp"):
+        state = wait(tasks, tasks.submit(fails))
+    assert state["status"] == "failed"
+    record = [record for record in caplog.records if record.event == "task_failed"][0]
+    assert record.exc_info[0] is ValueError
+
+
+def test_cleanup_runs_off_the_request(tasks, monkeypatch):
+    old = tasks.submit(lambda: None)
+    wait(tasks, old)
+    state = json.loads(tasks.kv[f"task:{old}"])
+    tasks.kv[f"task:{old}"] = json.dumps(dict(state, expires=time.time() - 1))
+
+    swept = threading.Event()
+    cleanup = tasks.cleanup
+    threads = []
+
+    def tracked():
+        threads.append(threading.current_thread())
+        cleanup()
+        swept.set()
+
+    monkeypatch.setattr(tasks, "cleanup", tracked)
+    tasks._cleaned = 0
+    tasks.submit(lambda: None)
+
+    assert swept.wait(5)
+    assert threads[0] is not threading.current_thread()
+    assert f"task:{old}" not in tasks.kv
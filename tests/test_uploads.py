@@ -0,0 +1,75 @@
+import json
+
+import bottle
+import pytest
+
+from hyperp.bottle import rpc, get_principal
+from hyperp.uploads import parse_multipart
+
+from .client import request
+
+
+@pytest.fixture
+def app():
+    app = bottle.default_app.push()
+    yield app
+    bottle.default_app.pop()
+
+
+def multipart(fields, files):
+    boundary = "hyperpboundary"
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n".encode() + data + b"\r\n"
+        )
+    body = b"".join(parts) + f"--{boundary}--\r\n".encode()
+    return {"Content-Type": f"multipart/form-data; boundary={boundary}"}, body
+
+
+def test_streamed_upload_with_resolver_is_not_read_early(app, tmp_path):
+    seen = {}
+
+    def resolver(token):
+        # The form was not parsed to look for a token
+        seen["read"] = "bottle.request.body" in bottle.request.environ
+        return token
+
+    @rpc("/upload", resolver=resolver, checker=lambda principal: "" if principal else "no token",
+         stream_uploads=True)
+    def upload():
+        fields, uploads = parse_multipart(directory=str(tmp_path))
+        return dict(principal=get_principal(), note=fields["note"], size=uploads["file"].size)
+
+    headers, body = multipart({"note": "hi", "authorization": "in the form"}, {"file": ("a.bin", b"x" * 1000)})
+
+    status, _, data = request(app, "POST", "/upload", dict(headers, Authorization="Bearer abc"), body)
+    assert status == 200
+    assert json.loads(data) == dict(principal="abc", note="hi", size=1000)
+    assert seen["read"] is False
+
+    status, _, data = request(app, "POST", "/upload", headers, body)
+    assert status == 401
+
+
+def test_upload_limits_are_bounded_by_default():
+    import inspect
+    from hyperp.uploads import MAX_UPLOAD_SIZE
+
+    params = inspect.signature(parse_multipart).parameters
+    assert params["max_part_size"].default == MAX_UPLOAD_SIZE
+    assert params["max_total_size"].default == MAX_UPLOAD_SIZE
+
+
+def test_upload_over_the_limit(app, tmp_path):
+    @app.post("/upload")
+    def upload():
+        parse_multipart(directory=str(tmp_path), max_part_size=500)
+
+    headers, body = multipart({}, {"file": ("a.bin", b"x" * 1000)})
+    status, _, _ = request(app, "POST", "/upload", headers, body)
+    assert status == 413
+    assert list(tmp_path.iterdir()) == []